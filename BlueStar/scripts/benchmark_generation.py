@@ -0,0 +1,59 @@
+import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import json
+from transformers import AutoTokenizer
+from BlueStar.utils.generation import load_causal_lm, PROMPT_PREFIX, PROMPT_QUESTION
+from BlueStar.utils.model_benchmark import sample_passages, measure_speed, measure_perplexity
+from BlueStar.utils.ort_generation import load_ort_model, ORT_MODEL_FILE
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare tokens/sec and perplexity of the PyTorch and ONNX Runtime generators")
+    parser.add_argument("--model-path", default=os.path.join(script_dir, "..", "models", "quantized-gpt2-large"))
+    parser.add_argument("--onnx-model-path", default=os.path.join(script_dir, "..", "models", "gpt2-large-onnx-int8"))
+    parser.add_argument("--store-path", default=os.path.join(script_dir, "..", "data", "store"))
+    parser.add_argument("--test-set", default=os.path.join(script_dir, "..", "data", "test_set.txt"))
+    parser.add_argument("--output", default=os.path.join(script_dir, "..", "data", "generation_benchmark.json"))
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--num-prompts", type=int, default=10)
+    parser.add_argument("--num-passages", type=int, default=100, help="Held-out passages scored for perplexity")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    try:
+        with open(args.test_set, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()][:args.num_prompts]
+        passages = sample_passages(args.store_path, args.num_passages + len(queries), args.seed)
+
+        ## Speed prompts look like the real template, one passage of context per question
+        prompts = [PROMPT_PREFIX + passage + "\n" + PROMPT_QUESTION.format(query=query) for query, passage in zip(queries, passages)]
+        perplexity_texts = passages[len(queries):]
+
+        backends = [("torch-int8", lambda: load_causal_lm(args.model_path, "torch", num_threads=args.num_threads)),
+                    ("onnx-int8", lambda: load_causal_lm(args.onnx_model_path, "onnx", num_threads=args.num_threads))]
+        if os.path.exists(os.path.join(args.onnx_model_path, ORT_MODEL_FILE)):
+            backends.append(("onnx-fp32", lambda: load_ort_model(args.onnx_model_path, args.num_threads, ORT_MODEL_FILE)))
+
+        report = []
+        for label, load in backends:
+            print(f"[INFO][benchmark_generation.py] Benchmarking {label}...")
+            model = load()
+            tokenizer = AutoTokenizer.from_pretrained(args.onnx_model_path if label.startswith("onnx") else args.model_path)
+            row = {"backend": label, **measure_speed(model, tokenizer, prompts, args.new_tokens)}
+            row["perplexity"] = measure_perplexity(model, tokenizer, perplexity_texts, args.max_length)
+            report.append(row)
+            print(f"[INFO][benchmark_generation.py] {label:<11} decode={row['decode_tokens_per_s']:.2f} tok/s "
+                  f"prefill={row['prefill_s_mean']:.2f}s perplexity={row['perplexity']:.2f}")
+            del model
+
+        with open(args.output, 'w') as f:
+            json.dump({"new_tokens": args.new_tokens, "num_prompts": len(prompts), "num_perplexity_passages": len(perplexity_texts), "results": report}, f, indent=2)
+        print(f"[INFO][benchmark_generation.py] Report saved to {args.output}")
+    except Exception as e:
+        print(f"[ERROR][benchmark_generation.py] Generation benchmark failed: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,95 @@
+import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import json
+import time
+import numpy as np
+from BlueStar.utils.guardrails import DEFAULT_RULES_PATH, Guardrails, TopicClassifier, load_rules
+
+## The substring checks RAGModel.is_allowed_topic ran before the rules file, kept as the baseline
+LEGACY_TOPICS = ['violence', 'illegal', 'hate speech', 'adult content', 'weapons', 'drugs', 'terrorism', 'extremism',
+                 'personal information', 'hacking', 'malware']
+LEGACY_COMMANDS = ['sudo', 'rm -rf', 'format', 'del']
+
+def legacy_is_allowed(query: str) -> bool:
+    return not (any(topic in query.lower() for topic in LEGACY_TOPICS) or any(cmd in query.lower() for cmd in LEGACY_COMMANDS))
+
+def load_queries(test_set: str, store_path: str, num_queries: int, seed: int) -> list:
+    """Test-set questions padded with the opening sentences of sampled passages, repeated up to num_queries"""
+    with open(test_set, 'r', encoding='utf-8') as f:
+        queries = [line.strip() for line in f if line.strip()]
+    if os.path.isdir(store_path):
+        from BlueStar.utils.doc_store import DocStore
+        store = DocStore(store_path)
+        rng = np.random.default_rng(seed)
+        for pid in rng.choice(store.num_passages, min(num_queries, store.num_passages), replace=False):
+            if not store.is_deleted(int(pid)):
+                queries.append(store.get_passage(int(pid)).split(". ")[0][:200])
+        store.close()
+    return (queries * (num_queries // max(len(queries), 1) + 1))[:num_queries]
+
+def throughput(run, num_queries: int, batch_size: int = 1, repeats: int = 3) -> float:
+    """Best queries/sec over repeats of run(start, end) across all queries, batch_size at a time"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, num_queries, batch_size):
+            run(i, i + batch_size)
+        best = min(best, time.perf_counter() - start)
+    return num_queries / best
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure guardrail throughput against the old substring checks")
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH)
+    parser.add_argument("--test-set", default=os.path.join(script_dir, "..", "data", "test_set.txt"))
+    parser.add_argument("--store-path", default=os.path.join(script_dir, "..", "data", "store"))
+    parser.add_argument("--output", default=os.path.join(script_dir, "..", "data", "guardrail_benchmark.json"))
+    parser.add_argument("--num-queries", type=int, default=10000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 64, 512])
+    parser.add_argument("--classifier", action="store_true", help="Also time the embedding topic classifier on precomputed embeddings")
+    parser.add_argument("--model-name", default="all-MiniLM-L6-v2", help="Encoder for the classifier, as used by the retriever")
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    try:
+        queries = load_queries(args.test_set, args.store_path, args.num_queries, args.seed)
+        rules = load_rules(args.rules)
+        guardrails = Guardrails(rules)
+
+        legacy = [legacy_is_allowed(query) for query in queries]
+        compiled = [decision["allowed"] for decision in guardrails.check_batch(queries)]
+        changed = sorted({query for query, old, new in zip(queries, legacy, compiled) if old != new})
+
+        report = {"num_queries": len(queries), "rules": os.path.abspath(args.rules), "decisions_changed": len(changed),
+                  "changed_examples": changed[:20], "results": []}
+        report["results"].append({"method": "legacy", "batch_size": 1,
+                                  "queries_per_s": throughput(lambda i, j: [legacy_is_allowed(query) for query in queries[i:j]], len(queries))})
+        for batch_size in args.batch_sizes:
+            report["results"].append({"method": "compiled", "batch_size": batch_size,
+                                      "queries_per_s": throughput(lambda i, j: guardrails.check_batch(queries[i:j]), len(queries), batch_size)})
+
+        if args.classifier:
+            from BlueStar.utils.encoders import load_encoder
+            encoder = load_encoder('torch', args.model_name)
+            settings = rules.get("topic_classifier", {})
+            classifier = TopicClassifier(settings.get("examples", {}), lambda texts: encoder.encode(texts, convert_to_numpy=True), settings.get("threshold", 0.6))
+            with_classifier = Guardrails(rules, classifier)
+            ## Embeddings are computed up front, as the retriever's cache would supply them, so only the classifier is timed
+            embeddings = np.asarray(encoder.encode(queries, batch_size=256, convert_to_numpy=True))
+            for batch_size in args.batch_sizes:
+                report["results"].append({"method": "compiled+classifier", "batch_size": batch_size,
+                                          "queries_per_s": throughput(lambda i, j: with_classifier.check_batch(queries[i:j], embeddings[i:j]), len(queries), batch_size)})
+
+        for row in report["results"]:
+            print(f"[INFO][benchmark_guardrails.py] {row['method']:<20} batch={row['batch_size']:<4} {row['queries_per_s']:,.0f} queries/s")
+        print(f"[INFO][benchmark_guardrails.py] {len(changed)} distinct queries decided differently from the substring checks")
+
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO][benchmark_guardrails.py] Report saved to {args.output}")
+    except Exception as e:
+        print(f"[ERROR][benchmark_guardrails.py] Guardrail benchmark failed: {str(e)}")
+        sys.exit(1)
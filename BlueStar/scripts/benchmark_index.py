@@ -0,0 +1,117 @@
+import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from BlueStar.utils.doc_store import DocStore
+from BlueStar.utils.faiss_index import build_index, set_search_params, DEFAULT_PQ_M, DEFAULT_HNSW_M
+
+## Runtime knob values swept for each approximate index type
+SWEEPS = {
+    "flat": ("", [None]),
+    "ivf-flat": ("nprobe", [1, 2, 4, 8, 16, 32, 64]),
+    "ivf-pq": ("nprobe", [1, 2, 4, 8, 16, 32, 64]),
+    "hnsw": ("efSearch", [16, 32, 64, 128, 256]),
+}
+
+def load_embeddings(store_path: str, model_name: str, max_passages: int, num_queries: int, test_set: str, seed: int):
+    """Embed a sample of store passages and split off held-out passages to use as queries alongside the test set"""
+    store = DocStore(store_path)
+    rng = np.random.default_rng(seed)
+    total = min(store.num_passages, max_passages + num_queries)
+    passage_ids = rng.choice(store.num_passages, total, replace=False)
+
+    queries = []
+    if test_set and os.path.exists(test_set):
+        with open(test_set, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    texts = [store.get_passage(int(pid)) for pid in passage_ids]
+    model = SentenceTransformer(model_name)
+    corpus_embeddings = model.encode(texts[num_queries:], show_progress_bar=True, convert_to_numpy=True)
+    query_embeddings = model.encode(queries + texts[:num_queries], show_progress_bar=True, convert_to_numpy=True)
+    return np.ascontiguousarray(corpus_embeddings, dtype=np.float32), np.ascontiguousarray(query_embeddings, dtype=np.float32)
+
+def time_queries(index, queries: np.ndarray, top_k: int):
+    """Search one query at a time, as the CLI does, returning the results and per-query latencies in ms"""
+    results = np.empty((len(queries), top_k), dtype=np.int64)
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, indices = index.search(queries[i:i + 1], top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results[i] = indices[0]
+    return results, np.array(latencies)
+
+def recall_at_k(results: np.ndarray, ground_truth: np.ndarray) -> float:
+    """Fraction of the exact top-k neighbours that an approximate search also returned"""
+    hits = sum(len(set(found) & set(truth)) for found, truth in zip(results, ground_truth))
+    return hits / ground_truth.size
+
+def run_benchmark(corpus: np.ndarray, queries: np.ndarray, top_k: int, index_types, **index_params) -> list:
+    """Sweep each index type over its runtime knob and compare recall@k and latency with the flat baseline"""
+    flat, _ = build_index(corpus, "flat")
+    ground_truth, _ = time_queries(flat, queries, top_k)
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index, metadata = build_index(corpus, index_type, **index_params)
+        build_time = time.perf_counter() - start
+        index_bytes = faiss.serialize_index(index).nbytes
+
+        knob, values = SWEEPS[index_type]
+        for value in values:
+            if knob:
+                set_search_params(index, {knob: value})
+            results, latencies = time_queries(index, queries, top_k)
+            row = {
+                "index_type": index_type,
+                "factory": metadata["factory"],
+                "search_params": {knob: value} if knob else {},
+                f"recall@{top_k}": recall_at_k(results, ground_truth),
+                "latency_ms_p50": float(np.percentile(latencies, 50)),
+                "latency_ms_p95": float(np.percentile(latencies, 95)),
+                "build_time_s": build_time,
+                "index_size_mb": index_bytes / (1024 * 1024),
+            }
+            report.append(row)
+            print(f"[INFO][benchmark_index.py] {row['factory']:<18} {str(row['search_params']):<18} "
+                  f"recall@{top_k}={row[f'recall@{top_k}']:.3f} p50={row['latency_ms_p50']:.3f}ms p95={row['latency_ms_p95']:.3f}ms "
+                  f"size={row['index_size_mb']:.1f}MB")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report recall@k against latency for each FAISS index type")
+    parser.add_argument("--store-path", default=os.path.join(script_dir, "..", "data", "store"))
+    parser.add_argument("--test-set", default=os.path.join(script_dir, "..", "data", "test_set.txt"))
+    parser.add_argument("--output", default=os.path.join(script_dir, "..", "data", "index_benchmark.json"))
+    parser.add_argument("--model-name", default="all-MiniLM-L6-v2")
+    parser.add_argument("--index-types", nargs="+", choices=list(SWEEPS), default=list(SWEEPS))
+    parser.add_argument("--max-passages", type=int, default=100000, help="Passages to index, raise to match the production corpus")
+    parser.add_argument("--num-queries", type=int, default=200, help="Held-out passages used as queries")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M)
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M)
+    parser.add_argument("--seed", type=int, default=1234)
+    args = parser.parse_args()
+
+    try:
+        corpus, queries = load_embeddings(args.store_path, args.model_name, args.max_passages, args.num_queries, args.test_set, args.seed)
+        print(f"[INFO][benchmark_index.py] Benchmarking {len(queries)} queries against {len(corpus)} passages")
+
+        report = run_benchmark(corpus, queries, args.top_k, args.index_types, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m)
+
+        with open(args.output, 'w') as f:
+            json.dump({"num_passages": len(corpus), "num_queries": len(queries), "top_k": args.top_k, "results": report}, f, indent=2)
+        print(f"[INFO][benchmark_index.py] Report saved to {args.output}")
+    except Exception as e:
+        print(f"[ERROR][benchmark_index.py] Index benchmark failed: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,217 @@
+import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone
+
+## Bump when the result layout or what is measured changes; compare refuses files from another version
+## Version 2 decodes exactly --new-tokens per answer, version 1 runs stopped early at sentence ends and repeats
+SCHEMA_VERSION = 2
+PERCENTILES = (50, 95, 99)
+## Latency metrics reported per configuration; lower is better for all of them
+METRICS = ("ttft_s", "decode_s_per_token", "retrieval_s", "end_to_end_s")
+
+def summarize(values: list) -> dict:
+    import numpy as np
+    values = np.asarray(values, dtype=np.float64)
+    summary = {f"p{p}": float(np.percentile(values, p)) for p in PERCENTILES}
+    summary["mean"] = float(values.mean())
+    return summary
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=script_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def reset_caches(rag):
+    """Drop cached embeddings, results and passage key/value states so every request takes the uncached path"""
+    rag.retriever.embedding_cache.clear()
+    rag.retriever.result_cache.clear()
+    if rag.kv_cache is not None:
+        rag.kv_cache.clear()
+
+def measure_request(rag, query: str, top_k: int) -> dict:
+    """Run one real generate_response and split its time using the request's trace"""
+    start = time.perf_counter()
+    _, _, metrics = rag.generate_response(query, top_k, return_metrics=True)
+    end_to_end = time.perf_counter() - start
+    if "stages" not in metrics:
+        raise RuntimeError(f"Generation failed for query '{query}'")
+
+    stages = metrics["stages"]
+    decode = stages.get("decode", 0.0)
+    return {
+        "ttft_s": end_to_end - decode,
+        "decode_s_per_token": decode / max(metrics["new_tokens"] - 1, 1),
+        "retrieval_s": stages.get("retrieval", 0.0),
+        "end_to_end_s": end_to_end,
+        "new_tokens": metrics["new_tokens"],
+    }
+
+def run_benchmark(args) -> dict:
+    import numpy as np
+    import torch
+    from BlueStar.utils.generation import RAGModel
+    from BlueStar.utils.retrieval import Retriever
+    from BlueStar.utils.tracing import configure_tracing
+
+    with open(args.test_set, 'r', encoding='utf-8') as f:
+        queries = [line.strip() for line in f if line.strip()][:args.num_queries]
+    ## Traces give the per-stage split; they are kept in memory only
+    configure_tracing(True)
+
+    retriever = Retriever(args.index_path, args.store_path, retrieval_mode=args.retrieval_mode)
+    results = []
+    rag = None
+    for threads in args.threads:
+        ## ONNX Runtime fixes its thread pool when the session is created, so that backend reloads per thread count
+        if rag is None or args.backend == "onnx":
+            rag = RAGModel(args.model_path, retriever, backend=args.backend, num_threads=threads)
+        torch.set_num_threads(threads)
+        ## Greedy decoding of exactly new_tokens keeps runs comparable: min_new_tokens holds off EOS, and the sentence-end
+        ## and repetition stops, which would end answers at different lengths, are turned off
+        rag.generation_kwargs.update(do_sample=False, max_new_tokens=args.new_tokens, min_new_tokens=args.new_tokens)
+        rag.early_stopping = False
+
+        for prompt_length in args.prompt_lengths:
+            rag.MAX_INPUT_LENGTH = prompt_length
+            torch.manual_seed(args.seed)
+            for query in queries[:args.warmup]:
+                rag.generate_response(query, args.top_k)
+
+            rows = []
+            for repeat in range(args.repeats):
+                for query in queries:
+                    if not args.warm_cache:
+                        reset_caches(rag)
+                    rows.append(measure_request(rag, query, args.top_k))
+
+            result = {
+                "prompt_length": prompt_length,
+                "threads": threads,
+                "requests": len(rows),
+                "new_tokens_mean": float(np.mean([row["new_tokens"] for row in rows])),
+                "metrics": {metric: summarize([row[metric] for row in rows]) for metric in METRICS},
+            }
+            results.append(result)
+            print(f"[INFO][benchmark_latency.py] prompt<={prompt_length} threads={threads}: "
+                  + ", ".join(f"{metric} p50={result['metrics'][metric]['p50'] * 1000:.1f}ms p95={result['metrics'][metric]['p95'] * 1000:.1f}ms" for metric in METRICS))
+
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "settings": {
+            "model_path": os.path.abspath(args.model_path),
+            "backend": args.backend,
+            "retrieval_mode": args.retrieval_mode,
+            "top_k": args.top_k,
+            "new_tokens": args.new_tokens,
+            "num_queries": len(queries),
+            "repeats": args.repeats,
+            "warmup": args.warmup,
+            "warm_cache": args.warm_cache,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+def compare_results(baseline: dict, current: dict, tolerance: float, percentiles: list) -> list:
+    """Return a row per (configuration, metric, percentile) with the relative change, flagging slowdowns beyond tolerance"""
+    for report in (baseline, current):
+        if report.get("schema_version") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported benchmark schema version {report.get('schema_version')}, expected {SCHEMA_VERSION}")
+
+    baseline_results = {(row["prompt_length"], row["threads"]): row for row in baseline["results"]}
+    rows = []
+    for row in current["results"]:
+        key = (row["prompt_length"], row["threads"])
+        if key not in baseline_results:
+            continue
+        ## Time to first token and end-to-end time grow with the tokens decoded, so only equal-length runs compare
+        if abs(row["new_tokens_mean"] - baseline_results[key]["new_tokens_mean"]) > 0.5:
+            raise ValueError(f"prompt<={key[0]} threads={key[1]} decoded {row['new_tokens_mean']:.1f} tokens per answer against "
+                             f"{baseline_results[key]['new_tokens_mean']:.1f} in the baseline; rerun both with the same --new-tokens")
+        for metric in METRICS:
+            for percentile in percentiles:
+                before = baseline_results[key]["metrics"][metric][percentile]
+                after = row["metrics"][metric][percentile]
+                change = (after - before) / before if before > 0 else 0.0
+                rows.append({"prompt_length": key[0], "threads": key[1], "metric": metric, "percentile": percentile,
+                             "baseline": before, "current": after, "change": change, "regression": change > tolerance})
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generate_response latency, or compare a run against a baseline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Replay the test set through generate_response and save latency percentiles")
+    run_parser.add_argument("--model-path", default=os.path.join(script_dir, "..", "models", "quantized-gpt2-large"))
+    run_parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    run_parser.add_argument("--index-path", default=os.path.join(script_dir, "..", "data", "faiss_index.bin"))
+    run_parser.add_argument("--store-path", default=os.path.join(script_dir, "..", "data", "store"))
+    run_parser.add_argument("--retrieval-mode", choices=["hybrid", "dense"], default="hybrid")
+    run_parser.add_argument("--test-set", default=os.path.join(script_dir, "..", "data", "test_set.txt"))
+    run_parser.add_argument("--output", default=os.path.join(script_dir, "..", "data", "latency_benchmark.json"))
+    run_parser.add_argument("--prompt-lengths", type=int, nargs="+", default=[256, 512, 800], help="Prompt token budgets to sweep")
+    run_parser.add_argument("--threads", type=int, nargs="+", default=[os.cpu_count() or 1], help="Thread counts to sweep")
+    run_parser.add_argument("--top-k", type=int, default=5, help="Passages retrieved; enough to fill the larger prompt budgets")
+    run_parser.add_argument("--new-tokens", type=int, default=64)
+    run_parser.add_argument("--num-queries", type=int, default=20)
+    run_parser.add_argument("--repeats", type=int, default=1)
+    run_parser.add_argument("--warmup", type=int, default=3, help="Untimed requests before each configuration")
+    run_parser.add_argument("--warm-cache", action="store_true", help="Keep retrieval and prompt KV caches between requests")
+    run_parser.add_argument("--seed", type=int, default=1234)
+
+    compare_parser = subparsers.add_parser("compare", help="Flag metrics that got slower than a stored baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown before a metric counts as a regression")
+    compare_parser.add_argument("--percentiles", nargs="+", default=["p50", "p95"], choices=[f"p{p}" for p in PERCENTILES] + ["mean"])
+    args = parser.parse_args()
+
+    if args.command == "run":
+        try:
+            report = run_benchmark(args)
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"[INFO][benchmark_latency.py] Report saved to {args.output}")
+        except Exception as e:
+            print(f"[ERROR][benchmark_latency.py] Latency benchmark failed: {str(e)}")
+            sys.exit(1)
+    else:
+        try:
+            with open(args.baseline, 'r') as f:
+                baseline = json.load(f)
+            with open(args.current, 'r') as f:
+                current = json.load(f)
+            rows = compare_results(baseline, current, args.tolerance, args.percentiles)
+        except Exception as e:
+            print(f"[ERROR][benchmark_latency.py] Comparison failed: {str(e)}")
+            sys.exit(2)
+
+        for row in rows:
+            status = "REGRESSION" if row["regression"] else "ok"
+            print(f"[INFO][benchmark_latency.py] prompt<={row['prompt_length']} threads={row['threads']} {row['metric']} {row['percentile']}: "
+                  f"{row['baseline'] * 1000:.1f}ms -> {row['current'] * 1000:.1f}ms ({row['change']:+.1%}) {status}")
+        regressions = [row for row in rows if row["regression"]]
+        if not rows:
+            print("[ERROR][benchmark_latency.py] No configurations in common with the baseline")
+            sys.exit(2)
+        if regressions:
+            print(f"[ERROR][benchmark_latency.py] {len(regressions)} of {len(rows)} metrics regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
+        print(f"[INFO][benchmark_latency.py] No regressions beyond {args.tolerance:.0%}")
@@ -1,10 +1,27 @@
 import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import hashlib
+import json
+import time
 import faiss
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from sentence_transformers import SentenceTransformer
-import pickle
 from tqdm import tqdm
+from transformers import AutoTokenizer
 import logging
-import sys
+from BlueStar.utils.chunking import chunk_texts, DEFAULT_CHUNK_TOKENS, DEFAULT_CHUNK_OVERLAP
+from BlueStar.utils.bm25 import build_bm25_index
+from BlueStar.utils.doc_store import DocStore, DocStoreWriter, discard_staged_files, store_file_sizes, truncate_store
+from BlueStar.utils.faiss_index import (INDEX_TYPES, TRAINED_INDEX_TYPES, DEFAULT_PQ_M, DEFAULT_HNSW_M,
+                                        MIN_POINTS_PER_CENTROID, create_index, train_index, save_index, add_embeddings,
+                                        remove_ids, can_remove_ids, default_nlist, load_index_metadata)
+from BlueStar.utils.manifest import load_manifest, save_manifest, new_manifest, document_entry, file_entry, diff_corpus, diff_shards
+from BlueStar.utils.corpus import content_hash, iter_shard, list_shards
 
 ## Set up logging with custom format
 logging.basicConfig(
@@ -16,69 +33,375 @@ logging.basicConfig(
     ]
 )
 
-def load_corpus(corpus_dir: str):
-    """Load documents from corpus directory"""
-    documents = []
-    try:
-        files = os.listdir(corpus_dir)
-        for filename in tqdm(files, desc="Loading corpus"):
-            if filename.endswith(".txt"):
-                with open(os.path.join(corpus_dir, filename), 'r', encoding='utf-8') as f:
-                    documents.append(f.read())
-        logging.info(f"Loaded {len(documents)} documents from corpus")
-        return documents
-    except Exception as e:
-        logging.error(f"Error loading corpus: {str(e)}")
-        raise
+CHECKPOINT_FILE = "build_checkpoint.json"
 
-def build_embeddings(documents, model_name: str = 'all-MiniLM-L6-v2'):
-    """Build embeddings using sentence transformer"""
-    try:
-        model = SentenceTransformer(model_name)
-        logging.info(f"Building embeddings using {model_name}")
-        embeddings = model.encode(documents, show_progress_bar=True, convert_to_numpy=True)
-        logging.info(f"Built embeddings with shape {embeddings.shape}")
-        return embeddings
-    except Exception as e:
-        logging.error(f"Error building embeddings: {str(e)}")
-        raise
+def list_corpus_files(corpus_dir: str):
+    """Return the sorted names of the .txt files in the corpus directory; shards are listed separately"""
+    return sorted(filename for filename in os.listdir(corpus_dir) if filename.endswith(".txt"))
 
-def build_faiss_index(embeddings, index_path: str):
-    """Build and save FAISS index"""
-    try:
-        dimension = embeddings.shape[1]
-        index = faiss.IndexFlatL2(dimension)
-        index.add(embeddings)
-        faiss.write_index(index, index_path)
-        logging.info(f"FAISS index built and saved to {index_path}")
-    except Exception as e:
-        logging.error(f"Error building FAISS index: {str(e)}")
-        raise
+def read_corpus_file(path: str, known_hash: str = None):
+    """Read a corpus file, returning its text and the SHA-256 of its contents, hashing only when known_hash is not given"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return raw.decode('utf-8'), known_hash or hashlib.sha256(raw).hexdigest()
+
+def get_build_config(args) -> dict:
+    """Settings that must match for an incremental update or a resumed build to reuse the existing store and index"""
+    return {
+        "model_name": args.model_name,
+        "chunk_tokens": args.chunk_tokens,
+        "chunk_overlap": args.chunk_overlap,
+        "index_type": args.index_type,
+    }
+
+def load_checkpoint(store_dir: str):
+    path = os.path.join(store_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_checkpoint(checkpoint: dict, store_dir: str):
+    path = os.path.join(store_dir, CHECKPOINT_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+def clear_checkpoint(store_dir: str, index_path: str):
+    for path in (os.path.join(store_dir, CHECKPOINT_FILE), index_path + ".checkpoint"):
+        if os.path.exists(path):
+            os.remove(path)
+    discard_staged_files(store_dir)
 
-def save_corpus(documents, corpus_path: str):
-    """Save corpus to pickle file"""
+def build_lexical_index(store_dir: str):
+    """Rebuild the BM25 inverted index from the live passages in the store"""
     try:
-        with open(corpus_path, 'wb') as f:
-            pickle.dump(documents, f)
-        logging.info(f"Corpus saved to {corpus_path}")
+        store = DocStore(store_dir)
+        build_bm25_index(store, store_dir)
+        store.close()
+        logging.info(f"BM25 index built in {store_dir}")
     except Exception as e:
-        logging.error(f"Error saving corpus: {str(e)}")
+        logging.error(f"Error building BM25 index: {str(e)}")
         raise
 
+class StreamingIndexBuilder:
+    """Reads, chunks, embeds and indexes corpus files and shards in bounded memory, checkpointing periodically.
+
+    Files are read by a thread pool a batch at a time and shards are streamed record by record. Passages are embedded
+    in fixed-size batches and added to the index as they are produced, so memory holds at most one read batch plus
+    one embedding batch. IVF indexes keep up to train_size embeddings in memory until they have been trained.
+    """
+
+    def __init__(self, corpus_dir: str, store_dir: str, index_path: str, model, args, index, metadata: dict, manifest: dict, append: bool):
+        self.corpus_dir = corpus_dir
+        self.store_dir = store_dir
+        self.index_path = index_path
+        self.model = model
+        self.args = args
+        self.index = index
+        self.metadata = metadata
+        self.manifest = manifest
+        ## Passages are also stored as generator token ids so prompts can be assembled without re-tokenizing them
+        tokenizer = AutoTokenizer.from_pretrained(args.generator_tokenizer) if args.generator_tokenizer else None
+        self.writer = DocStoreWriter(store_dir, append=append, tokenizer=tokenizer, tokenizer_name=args.generator_tokenizer)
+
+        self.pending_texts, self.pending_ids = [], []
+        self.pending_removals = []
+        self.train_embeddings, self.train_ids = [], []
+        self.num_train_embeddings = 0
+        self.documents_expected = 0
+        self.documents_done = 0
+        self.passages_done = 0
+        self.last_checkpoint = time.monotonic()
+
+    def checkpoint(self, index_file: str = None):
+        """Persist enough state to resume: store sizes, an index snapshot and the manifest of indexed files.
+
+        Nothing is written while an IVF index is still collecting its training sample, since those embeddings only live in memory.
+        """
+        if self.index is None and (self.manifest["files"] or self.manifest["shards"]):
+            return
+        self._embed_pending(len(self.pending_texts))
+        self._flush_removals()
+        self.writer.flush()
+
+        if index_file is None and self.index is not None:
+            index_file = self.index_path + ".checkpoint"
+            faiss.write_index(self.index, index_file + ".tmp")
+            os.replace(index_file + ".tmp", index_file)
+        if self.metadata is not None:
+            self.metadata["ntotal"] = int(self.index.ntotal)
+
+        save_checkpoint({
+            "build_config": get_build_config(self.args),
+            "store_sizes": store_file_sizes(self.store_dir),
+            "index_file": index_file,
+            "index_metadata": self.metadata,
+            "manifest": self.manifest,
+        }, self.store_dir)
+        self.last_checkpoint = time.monotonic()
+        logging.info(f"Checkpointed after {self.documents_done} documents")
+
+    def _queue_removal(self, entries):
+        """Queue the passages of superseded document entries for removal"""
+        for entry in entries:
+            self.pending_removals.extend(range(*entry["passage_ids"]))
+
+    def _flush_removals(self):
+        """Remove queued passages with a single index call, since every remove_ids call scans the whole index"""
+        if not self.pending_removals:
+            return
+        self.writer.delete_passages(self.pending_removals)
+        removed_count = remove_ids(self.index, self.pending_removals)
+        logging.info(f"Removed {removed_count} stale passages")
+        self.pending_removals = []
+
+    def remove(self, filenames):
+        """Drop the passages of changed or deleted files from the store and index"""
+        self._queue_removal(self.manifest["files"].pop(filename) for filename in filenames)
+        self._flush_removals()
+
+    def remove_shards(self, shard_names):
+        """Drop the passages of every document in shards that no longer exist"""
+        self._queue_removal(entry for name in shard_names for entry in self.manifest["shards"].pop(name)["documents"].values())
+        self._flush_removals()
+
+    def _add_documents(self, texts, spans_by_doc):
+        """Append documents to the store and queue their passages for embedding, returning (doc_id, passage_ids) per document"""
+        added = []
+        for text, spans in zip(texts, spans_by_doc):
+            doc_id, passage_ids = self.writer.add_document(text, spans)
+            self.pending_texts.extend(text[start:end] for start, end in spans)
+            self.pending_ids.extend(passage_ids)
+            added.append((doc_id, passage_ids))
+        self.documents_done += len(texts)
+        self._step()
+        return added
+
+    def _step(self):
+        """Embed full batches and checkpoint when due"""
+        while len(self.pending_texts) >= self.args.embed_batch:
+            self._embed_pending(self.args.embed_batch)
+        if time.monotonic() - self.last_checkpoint >= self.args.checkpoint_interval:
+            self.checkpoint()
+
+    def add_files(self, filenames, hashes: dict = None):
+        """Stream the given .txt files into the store and index, reusing hashes diff_corpus already computed"""
+        hashes = hashes or {}
+        read_batch = self.args.read_batch
+        progress = tqdm(total=len(filenames), desc="Indexing corpus files")
+
+        with ThreadPoolExecutor(max_workers=self.args.workers) as pool:
+            for i in range(0, len(filenames), read_batch):
+                names = filenames[i:i + read_batch]
+                contents = list(pool.map(read_corpus_file, [os.path.join(self.corpus_dir, name) for name in names], [hashes.get(name) for name in names]))
+                spans_by_doc = chunk_texts([text for text, _ in contents], self.model.tokenizer, self.args.chunk_tokens, self.args.chunk_overlap)
+
+                added = self._add_documents([text for text, _ in contents], spans_by_doc)
+                for name, (_, file_hash), (doc_id, passage_ids) in zip(names, contents, added):
+                    self.manifest["files"][name] = file_entry(os.path.join(self.corpus_dir, name), file_hash, doc_id, passage_ids)
+                progress.update(len(names))
+
+        progress.close()
+
+    def add_shards(self, shard_names):
+        """Stream new or changed shards into the store and index, skipping documents whose hash is unchanged"""
+        for name in shard_names:
+            path = os.path.join(self.corpus_dir, name)
+            shard = self.manifest["shards"].setdefault(name, {"size": None, "mtime_ns": None, "documents": {}})
+            documents = shard["documents"]
+            seen = set()
+            batch = []
+
+            for record_id, text in tqdm(iter_shard(path), desc=f"Indexing {name}"):
+                seen.add(record_id)
+                text_hash = content_hash(text)
+                previous = documents.get(record_id)
+                if previous is not None:
+                    if previous["sha256"] == text_hash:
+                        continue
+                    self._queue_removal([previous])
+                batch.append((record_id, text, text_hash))
+                if len(batch) >= self.args.read_batch:
+                    self._add_shard_batch(documents, batch)
+                    batch = []
+            self._add_shard_batch(documents, batch)
+
+            ## Documents that disappeared from a shard are dropped with it
+            stale = [record_id for record_id in documents if record_id not in seen]
+            self._queue_removal(documents.pop(record_id) for record_id in stale)
+            self._flush_removals()
+
+            stat = os.stat(path)
+            shard["size"], shard["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+
+    def _add_shard_batch(self, documents: dict, batch):
+        if not batch:
+            return
+        texts = [text for _, text, _ in batch]
+        spans_by_doc = chunk_texts(texts, self.model.tokenizer, self.args.chunk_tokens, self.args.chunk_overlap)
+        added = self._add_documents(texts, spans_by_doc)
+        for (record_id, _, text_hash), (doc_id, passage_ids) in zip(batch, added):
+            documents[record_id] = document_entry(text_hash, doc_id, passage_ids)
+
+    def finish(self):
+        """Embed what is left, make sure the index exists and close the store"""
+        self._embed_pending(len(self.pending_texts))
+        self._flush_removals()
+        if self.index is None:
+            if not self.train_embeddings:
+                raise ValueError("Corpus produced no passages to index")
+            self._train_and_flush()
+        self.writer.close()
+
+        self.metadata["ntotal"] = int(self.index.ntotal)
+        return self.index, self.metadata, self.manifest
+
+    def _embed_pending(self, count: int):
+        """Embed and index the first count pending passages"""
+        if count <= 0:
+            return
+        texts, ids = self.pending_texts[:count], self.pending_ids[:count]
+        del self.pending_texts[:count], self.pending_ids[:count]
+
+        embeddings = self.model.encode(texts, batch_size=self.args.encode_batch_size, convert_to_numpy=True, show_progress_bar=False)
+        self.passages_done += len(texts)
+
+        if self.index is None and self.args.index_type not in TRAINED_INDEX_TYPES:
+            self.index, self.metadata = create_index(embeddings.shape[1], self.args.index_type, pq_m=self.args.pq_m, hnsw_m=self.args.hnsw_m)
+
+        if self.index is None:
+            self.train_embeddings.append(embeddings)
+            self.train_ids.append(np.asarray(ids, dtype=np.int64))
+            self.num_train_embeddings += len(embeddings)
+            if self.num_train_embeddings >= self.args.train_size:
+                self._train_and_flush()
+        else:
+            add_embeddings(self.index, embeddings, ids)
+
+    def _train_and_flush(self):
+        """Create and train the IVF index on the buffered sample, then add the buffered embeddings"""
+        embeddings = np.concatenate(self.train_embeddings)
+        ids = np.concatenate(self.train_ids)
+        self.train_embeddings, self.train_ids = [], []
+
+        nlist = self.args.nlist
+        if nlist is None:
+            ## Size the lists for the passage count the whole corpus is expected to produce
+            estimated_total = int(self.passages_done / max(self.documents_done, 1) * max(self.documents_expected, self.documents_done, 1))
+            nlist = max(1, min(default_nlist(estimated_total), len(embeddings) // MIN_POINTS_PER_CENTROID))
+
+        self.index, self.metadata = create_index(embeddings.shape[1], self.args.index_type, nlist, self.args.pq_m, self.args.hnsw_m)
+        logging.info(f"Training {self.metadata['factory']} on {len(embeddings)} embeddings")
+        train_index(self.index, embeddings, self.args.train_size)
+        add_embeddings(self.index, embeddings, ids)
+
+def run_build(corpus_dir: str, store_dir: str, index_path: str, model, args, force_full: bool = False):
+    """Build or update the store, index and manifest, resuming from a checkpoint when one matches the settings"""
+    build_config = get_build_config(args)
+    previous_version = load_index_metadata(index_path).get("version", 0) if os.path.exists(index_path) else 0
+
+    checkpoint = None if force_full else load_checkpoint(store_dir)
+    if checkpoint is not None and (args.no_resume or checkpoint["build_config"] != build_config):
+        logging.info("Discarding existing build checkpoint")
+        clear_checkpoint(store_dir, index_path)
+        checkpoint = None
+    if checkpoint is None:
+        ## Staged store files without a checkpoint come from a build killed before it could record one
+        discard_staged_files(store_dir)
+
+    index, metadata, resume_from = None, None, None
+    manifest = None if force_full else load_manifest(store_dir)
+    if checkpoint is not None:
+        logging.info("Resuming interrupted build from checkpoint")
+        truncate_store(store_dir, checkpoint["store_sizes"])
+        manifest, metadata = checkpoint["manifest"], checkpoint["index_metadata"]
+        if checkpoint["index_file"] is not None:
+            index = faiss.read_index(checkpoint["index_file"])
+        resume_from = checkpoint["index_file"]
+        append = True
+    elif args.update and manifest is not None and manifest["build_config"] == build_config and os.path.exists(index_path):
+        index, metadata = faiss.read_index(index_path), load_index_metadata(index_path)
+        resume_from = index_path
+        append = True
+    else:
+        if args.update:
+            logging.info("No compatible existing build found, running a full build")
+        manifest = new_manifest(build_config)
+        append = False
+
+    added, changed, removed, hashes = diff_corpus(manifest, corpus_dir, list_corpus_files(corpus_dir))
+    shard_names = list_shards(corpus_dir)
+    shards_to_scan, removed_shards = diff_shards(manifest, corpus_dir, shard_names)
+    logging.info(f"Corpus changes: {len(added)} added, {len(changed)} changed, {len(removed)} removed files; "
+                 f"{len(shards_to_scan)} new or changed, {len(removed_shards)} removed shards")
+    if append and checkpoint is None and not (added or changed or removed or shards_to_scan or removed_shards):
+        save_manifest(manifest, store_dir)
+        logging.info("Index is up to date")
+        return
+
+    ## A rescanned shard that was indexed before may drop or replace documents
+    may_remove = changed or removed or removed_shards or any(name in manifest["shards"] for name in shards_to_scan)
+    if may_remove and index is not None and not can_remove_ids(index, metadata["index_type"]):
+        logging.info(f"This {metadata['index_type']} index cannot remove vectors in place, running a full build")
+        clear_checkpoint(store_dir, index_path)
+        return run_build(corpus_dir, store_dir, index_path, model, args, force_full=True)
+
+    builder = StreamingIndexBuilder(corpus_dir, store_dir, index_path, model, args, index, metadata, manifest, append)
+
+    ## Record the starting state first so a crash before the first periodic checkpoint can still be rolled back
+    if checkpoint is None:
+        builder.checkpoint(index_file=resume_from)
+
+    ## Shards are assumed to be full when estimating the passage count for IVF list sizing
+    builder.documents_expected = len(added) + len(changed) + len(shards_to_scan) * args.shard_size
+
+    if changed or removed:
+        builder.remove(changed + removed)
+    if removed_shards:
+        builder.remove_shards(removed_shards)
+    builder.add_files(added + changed, hashes)
+    builder.add_shards(shards_to_scan)
+    index, metadata, manifest = builder.finish()
+
+    metadata["version"] = max(previous_version, metadata.get("version", 0)) + 1
+    metadata["embedding_model"] = args.model_name
+    save_index(index, index_path, metadata)
+    logging.info(f"FAISS index ({metadata['factory']}, {metadata['ntotal']} passages) saved to {index_path} as version {metadata['version']}")
+
+    save_manifest(manifest, store_dir)
+    clear_checkpoint(store_dir, index_path)
+    build_lexical_index(store_dir)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the BlueStar retrieval index")
+    parser.add_argument("--update", action="store_true", help="Only embed new or changed files and drop deleted ones")
+    parser.add_argument("--no-resume", action="store_true", help="Discard an interrupted build's checkpoint instead of resuming it")
+    parser.add_argument("--model-name", default="all-MiniLM-L6-v2", help="Sentence transformer used for embeddings")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS, help="Maximum tokens per passage")
+    parser.add_argument("--chunk-overlap", type=int, default=DEFAULT_CHUNK_OVERLAP, help="Tokens shared by consecutive passages")
+    parser.add_argument("--generator-tokenizer", default="gpt2-large", help="Tokenizer whose ids are stored for each passage, '' to skip")
+    parser.add_argument("--index-type", choices=list(INDEX_TYPES), default="flat", help="FAISS index type to build")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF list count (defaults to about 4 * sqrt(passages))")
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_PQ_M, help="PQ sub-quantizer count, must divide the embedding dimension")
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_HNSW_M, help="HNSW neighbours per node")
+    parser.add_argument("--train-size", type=int, default=100000, help="Embeddings sampled to train IVF/PQ indexes")
+    parser.add_argument("--workers", type=int, default=4, help="Threads reading corpus files")
+    parser.add_argument("--read-batch", type=int, default=64, help="Files or shard records read and chunked per step")
+    parser.add_argument("--shard-size", type=int, default=10000, help="Records per corpus shard, used to estimate corpus size")
+    parser.add_argument("--embed-batch", type=int, default=2048, help="Passages embedded and added to the index per step")
+    parser.add_argument("--encode-batch-size", type=int, default=64, help="Batch size passed to the sentence transformer")
+    parser.add_argument("--checkpoint-interval", type=float, default=600, help="Seconds between build checkpoints")
+    args = parser.parse_args()
+
     try:
-        ## Get the absolute path to the script
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
         ## Define paths relative to the script location
         CORPUS_DIR = os.path.join(script_dir, "..", "data", "corpus")
         INDEX_PATH = os.path.join(script_dir, "..", "data", "faiss_index.bin")
-        CORPUS_PATH = os.path.join(script_dir, "..", "data", "corpus.pkl")
+        STORE_PATH = os.path.join(script_dir, "..", "data", "store")
 
-        documents = load_corpus(CORPUS_DIR)
-        save_corpus(documents, CORPUS_PATH)
-        embeddings = build_embeddings(documents)
-        build_faiss_index(embeddings, INDEX_PATH)
+        model = SentenceTransformer(args.model_name)
+        run_build(CORPUS_DIR, STORE_PATH, INDEX_PATH, model, args)
         
         logging.info("Build retrieval process completed successfully")
         
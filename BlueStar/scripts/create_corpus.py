@@ -1,8 +1,15 @@
 import os
-from datasets import load_dataset
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import gzip
+import json
+import multiprocessing
 import logging
 from tqdm import tqdm
-import sys
+from BlueStar.utils.corpus import ShardWriter, compile_keyword_matcher, format_article
 
 ## Set up logging
 logging.basicConfig(
@@ -14,11 +21,19 @@ logging.basicConfig(
     ]
 )
 
-def download_wikipedia_corpus(num_articles=1000):
+## Filter for relevant articles
+KEYWORDS = ['machine learning', 'artificial intelligence', 'deep learning', 
+            'neural network', 'computer science', 'data science']
+
+## Plain JSONL dumps are split into byte ranges of this size so several workers can scan one file
+JSONL_CHUNK_BYTES = 64 * 1024 * 1024
+
+def download_wikipedia_corpus(num_articles=1000, keywords=KEYWORDS):
     """Downloads Wikipedia articles and saves them as individual files"""
+    from datasets import load_dataset
+
     try:
         ## Get the absolute path to the BlueStar/data/corpus directory
-        script_dir = os.path.dirname(os.path.abspath(__file__))
         corpus_dir = os.path.join(script_dir, "..", "data", "corpus")
         corpus_dir = os.path.abspath(corpus_dir)
         
@@ -33,9 +48,7 @@ def download_wikipedia_corpus(num_articles=1000):
             streaming=True
         )
         
-        ## Filter for relevant articles
-        keywords = ['machine learning', 'artificial intelligence', 'deep learning', 
-                   'neural network', 'computer science', 'data science']
+        matcher = compile_keyword_matcher(keywords)
         
         print(f"[INFO][create_corpus.py] Filtering for relevant articles containing keywords: {keywords}")
         articles_saved = 0
@@ -47,11 +60,11 @@ def download_wikipedia_corpus(num_articles=1000):
                 break
                 
             ## Check if article is relevant
-            if any(keyword in article['text'].lower() for keyword in keywords):
+            if matcher.search(article['text']):
                 try:
                     ## Clean the title to be filesystem-safe
                     title = "".join(c for c in article['title'] if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                    content = f"Title: {article['title']}\n\n{article['text']}"
+                    content = format_article(article['title'], article['text'])
                     
                     filename = f"{articles_saved:04d}_{title[:50]}.txt"
                     filepath = os.path.join(corpus_dir, filename)
@@ -73,9 +86,114 @@ def download_wikipedia_corpus(num_articles=1000):
         print(f"[ERROR][create_corpus.py] Error creating corpus: {str(e)}")
         raise
 
+def plan_tasks(input_paths):
+    """Split local dump files into independent scan tasks: one per Parquet row group or JSONL byte range"""
+    tasks = []
+    for path in input_paths:
+        if path.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            for row_group in range(pq.ParquetFile(path).num_row_groups):
+                tasks.append(("parquet", path, row_group, None))
+        elif path.endswith(".gz"):
+            ## Compressed streams cannot be entered mid-file, so each one is a single task
+            tasks.append(("jsonl", path, 0, None))
+        elif path.endswith(".jsonl") or path.endswith(".json"):
+            size = os.path.getsize(path)
+            for start in range(0, max(size, 1), JSONL_CHUNK_BYTES):
+                tasks.append(("jsonl", path, start, min(start + JSONL_CHUNK_BYTES, size)))
+        else:
+            raise ValueError(f"Unsupported dump file '{path}', expected .parquet, .jsonl or .jsonl.gz")
+    return tasks
+
+_matcher = None
+
+def _init_worker(keywords):
+    global _matcher
+    _matcher = compile_keyword_matcher(keywords)
+
+def _iter_jsonl_range(path: str, start: int, end):
+    """Yield records from the lines that start inside [start, end) of a JSONL file"""
+    if path.endswith(".gz"):
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        ## A range that starts mid-line leaves that line to the previous range
+        if start > 0:
+            f.seek(start - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield json.loads(line)
+
+def _filter_task(task):
+    """Scan one task's articles and return the (id, title, text) of those matching a keyword"""
+    kind, path, position, end = task
+    if kind == "parquet":
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        columns = [name for name in ("id", "title", "text") if name in parquet_file.schema_arrow.names]
+        records = parquet_file.read_row_group(position, columns=columns).to_pylist()
+    else:
+        records = _iter_jsonl_range(path, position, end)
+
+    matches = []
+    for record in records:
+        text = record.get("text") or ""
+        if _matcher.search(text):
+            matches.append((record.get("id") or record["title"], record["title"], text))
+    return matches
+
+def create_offline_corpus(input_paths, output_dir: str, num_articles=None, workers=None, shard_size: int = 10000, keywords=KEYWORDS):
+    """Filter a local Wikipedia dump (Parquet or JSONL) across a process pool and write compressed corpus shards"""
+    try:
+        tasks = plan_tasks(input_paths)
+        print(f"[INFO][create_corpus.py] Scanning {len(input_paths)} dump files as {len(tasks)} tasks for keywords: {keywords}")
+
+        done = False
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(keywords,)) as pool, \
+             ShardWriter(output_dir, shard_size) as writer:
+            if writer.removed_shards:
+                print(f"[INFO][create_corpus.py] Removed {len(writer.removed_shards)} shards of the previous corpus from {output_dir}")
+            ## imap keeps task order, so the corpus is deterministic for a given dump
+            for matches in tqdm(pool.imap(_filter_task, tasks), total=len(tasks), desc="Scanning dump"):
+                for record_id, title, text in matches:
+                    if num_articles is not None and writer.num_records >= num_articles:
+                        done = True
+                        break
+                    writer.write(record_id, title, text)
+                if done:
+                    break
+
+        print(f"[INFO][create_corpus.py] Created corpus with {writer.num_records} articles in {writer.num_shards} shards in {output_dir}")
+
+    except Exception as e:
+        print(f"[ERROR][create_corpus.py] Error creating offline corpus: {str(e)}")
+        raise
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the BlueStar retrieval corpus")
+    parser.add_argument("--input", nargs="+", default=None, help="Local Wikipedia dump files (.parquet, .jsonl, .jsonl.gz); enables offline mode")
+    parser.add_argument("--output-dir", default=os.path.join(script_dir, "..", "data", "corpus"), help="Directory for corpus shards in offline mode")
+    parser.add_argument("--num-articles", type=int, default=None, help="Maximum articles to keep (1000 when downloading)")
+    parser.add_argument("--workers", type=int, default=None, help="Processes scanning the dump (defaults to the CPU count)")
+    parser.add_argument("--shard-size", type=int, default=10000, help="Articles per shard")
+    parser.add_argument("--keywords", nargs="+", default=KEYWORDS, help="Keep articles mentioning any of these")
+    args = parser.parse_args()
+
     try:
-        download_wikipedia_corpus()
+        if args.input:
+            create_offline_corpus(args.input, args.output_dir, args.num_articles, args.workers, args.shard_size, args.keywords)
+        else:
+            download_wikipedia_corpus(args.num_articles or 1000, args.keywords)
     except Exception as e:
         print(f"[ERROR][create_corpus.py] Corpus creation failed: {str(e)}")
         sys.exit(1)
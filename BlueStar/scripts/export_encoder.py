@@ -0,0 +1,111 @@
+import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import json
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from BlueStar.utils.encoders import OnnxQueryEncoder, ENCODER_FILE, TOKENIZER_FILE, ENCODER_CONFIG_FILE
+
+class PooledEncoder(torch.nn.Module):
+    """Transformer plus the mean pooling and normalization SentenceTransformer applies, so both live in the ONNX graph"""
+
+    def __init__(self, transformer):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        hidden = self.transformer(input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids)[0]
+        mask = attention_mask.unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        return torch.nn.functional.normalize(pooled, p=2, dim=1)
+
+def export_encoder(model_name: str, output_dir: str, keep_fp32: bool = False):
+    """Export the sentence transformer to ONNX and quantize its weights to int8"""
+    print(f"[INFO][export_encoder.py] Exporting {model_name}...")
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device='cpu')
+    model.eval()
+
+    tokenizer = model.tokenizer
+    transformer = model[0].auto_model
+    wrapper = PooledEncoder(transformer).eval()
+
+    dummy = tokenizer(["BlueStar exports its query encoder"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "encoder-fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["sentence_embedding"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "token_type_ids": {0: "batch", 1: "sequence"},
+                "sentence_embedding": {0: "batch"},
+            },
+            opset_version=14
+        )
+
+    print("[INFO][export_encoder.py] Quantizing to int8...")
+    quantize_dynamic(fp32_path, os.path.join(output_dir, ENCODER_FILE), weight_type=QuantType.QInt8)
+    if not keep_fp32:
+        os.remove(fp32_path)
+
+    ## The fast tokenizer is saved as tokenizer.json, which the runtime loads without transformers
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ENCODER_CONFIG_FILE), 'w') as f:
+        json.dump({
+            "model_name": model_name,
+            "max_seq_length": model.max_seq_length,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "pad_token": tokenizer.pad_token,
+            "pad_token_id": tokenizer.pad_token_id,
+        }, f, indent=2)
+
+    if not os.path.exists(os.path.join(output_dir, TOKENIZER_FILE)):
+        raise RuntimeError(f"{model_name} has no fast tokenizer to export")
+    print(f"[SUCCESS][export_encoder.py] Encoder exported to {output_dir}")
+    return model
+
+def check_parity(model, output_dir: str, texts, min_cosine: float) -> dict:
+    """Compare int8 ONNX embeddings with the PyTorch ones and fail if any pair falls below min_cosine"""
+    reference = model.encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    exported = OnnxQueryEncoder(output_dir).encode(texts)
+    cosines = np.sum(reference * exported, axis=1) / (np.linalg.norm(reference, axis=1) * np.linalg.norm(exported, axis=1))
+
+    report = {"num_texts": len(texts), "min_cosine": float(cosines.min()), "mean_cosine": float(cosines.mean()), "threshold": min_cosine}
+    print(f"[INFO][export_encoder.py] Parity over {len(texts)} texts: min cosine {report['min_cosine']:.4f}, mean {report['mean_cosine']:.4f}")
+    if report["min_cosine"] < min_cosine:
+        raise AssertionError(f"ONNX encoder parity check failed: min cosine {report['min_cosine']:.4f} < {min_cosine}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the query encoder to an int8 ONNX model")
+    parser.add_argument("--model-name", default="all-MiniLM-L6-v2")
+    parser.add_argument("--output-dir", default=os.path.join(script_dir, "..", "models", "minilm-onnx"))
+    parser.add_argument("--test-set", default=os.path.join(script_dir, "..", "data", "test_set.txt"))
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="Lowest acceptable cosine similarity to the PyTorch embeddings")
+    parser.add_argument("--keep-fp32", action="store_true", help="Keep the unquantized ONNX export next to the int8 one")
+    args = parser.parse_args()
+
+    try:
+        model = export_encoder(args.model_name, args.output_dir, args.keep_fp32)
+
+        with open(args.test_set, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        ## Include long inputs so truncation and padding are exercised, not only short queries
+        texts += [" ".join(texts * 40), "BlueStar", "What is the difference between supervised and unsupervised learning?"]
+
+        report = check_parity(model, args.output_dir, texts, args.min_cosine)
+        with open(os.path.join(args.output_dir, "parity.json"), 'w') as f:
+            json.dump(report, f, indent=2)
+    except Exception as e:
+        print(f"[ERROR][export_encoder.py] Encoder export failed: {str(e)}")
+        sys.exit(1)
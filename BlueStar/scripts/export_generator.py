@@ -0,0 +1,22 @@
+import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+from BlueStar.utils.ort_generation import export_ort_model
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the generator with past-key-value support to an int8 ONNX model")
+    parser.add_argument("--model-name", default="gpt2-large")
+    parser.add_argument("--output-dir", default=os.path.join(script_dir, "..", "models", "gpt2-large-onnx-int8"))
+    parser.add_argument("--keep-fp32", action="store_true", help="Keep the unquantized export for benchmark comparisons")
+    args = parser.parse_args()
+
+    try:
+        print(f"[INFO][export_generator.py] Exporting and quantizing {args.model_name}, this takes a while for GPT-2 Large...")
+        export_ort_model(args.model_name, args.output_dir, args.keep_fp32)
+        print(f"[SUCCESS][export_generator.py] ONNX generator saved to {args.output_dir}")
+    except Exception as e:
+        print(f"[ERROR][export_generator.py] Export failed: {str(e)}")
+        sys.exit(1)
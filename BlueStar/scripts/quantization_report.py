@@ -0,0 +1,117 @@
+import os
+import sys
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+import argparse
+import json
+import multiprocessing
+import time
+
+def directory_size_mb(path: str) -> float:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path)) / (1024 * 1024)
+
+def measure_model(model_path: str, prompts: list, texts: list, new_tokens: int, max_length: int) -> dict:
+    """Load a checkpoint and measure it; runs in a fresh process so RSS reflects this model alone"""
+    import torch
+    from transformers import AutoTokenizer
+    from BlueStar.utils.generation import load_causal_lm
+    from BlueStar.utils.metrics import get_peak_memory, get_process_memory
+    from BlueStar.utils.model_benchmark import measure_speed, measure_perplexity
+
+    torch.manual_seed(0)
+    start = time.perf_counter()
+    model = load_causal_lm(model_path)
+    load_time = time.perf_counter() - start
+    loaded_rss = get_process_memory()['rss']
+    load_peak_rss = get_peak_memory()
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    row = {
+        "load_time_s": load_time,
+        "rss_mb": loaded_rss,
+        "load_peak_rss_mb": load_peak_rss,
+        **measure_speed(model, tokenizer, prompts, new_tokens),
+        "perplexity": measure_perplexity(model, tokenizer, texts, max_length),
+    }
+    row["peak_rss_mb"] = get_peak_memory()
+    return row
+
+def _measure_worker(queue, *args):
+    try:
+        queue.put(("ok", measure_model(*args)))
+    except Exception as e:
+        queue.put(("error", str(e)))
+
+def measure_in_subprocess(*args) -> dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure_worker, args=(queue, *args))
+    process.start()
+    status, result = queue.get()
+    process.join()
+    if status != "ok":
+        raise RuntimeError(result)
+    return result
+
+if __name__ == "__main__":
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from BlueStar.scripts.quantize_model import quantize_model, load_calibration_texts
+    from BlueStar.utils.generation import PROMPT_PREFIX, PROMPT_QUESTION
+    from BlueStar.utils.model_benchmark import sample_passages
+    from BlueStar.utils.weight_quant import QUANTIZATION_MODES, DEFAULT_GROUP_SIZE
+
+    parser = argparse.ArgumentParser(description="Quantize the generator in each mode and report measured size, memory, speed and perplexity")
+    parser.add_argument("--model-name", default="gpt2-large")
+    parser.add_argument("--modes", nargs="+", choices=QUANTIZATION_MODES, default=list(QUANTIZATION_MODES))
+    parser.add_argument("--work-dir", default=os.path.join(script_dir, "..", "models", "quantization-report"))
+    parser.add_argument("--store-path", default=os.path.join(script_dir, "..", "data", "store"))
+    parser.add_argument("--test-set", default=os.path.join(script_dir, "..", "data", "test_set.txt"))
+    parser.add_argument("--output", default=os.path.join(script_dir, "..", "data", "quantization_report.json"))
+    parser.add_argument("--group-size", type=int, default=DEFAULT_GROUP_SIZE)
+    parser.add_argument("--calibration-samples", type=int, default=64)
+    parser.add_argument("--num-prompts", type=int, default=5)
+    parser.add_argument("--num-passages", type=int, default=50, help="Held-out passages scored for perplexity")
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--skip-fp32", action="store_true", help="Skip the float baseline, perplexity deltas are then omitted")
+    args = parser.parse_args()
+
+    try:
+        with open(args.test_set, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()][:args.num_prompts]
+        ## A different seed than calibration, so perplexity is scored on passages the clipping never saw
+        passages = sample_passages(args.store_path, args.num_passages + len(queries), seed=4321)
+        prompts = [PROMPT_PREFIX + passage + "\n" + PROMPT_QUESTION.format(query=query) for query, passage in zip(queries, passages)]
+        texts = passages[len(queries):]
+        calibration_texts = load_calibration_texts(args.store_path, args.test_set, args.calibration_samples)
+
+        report = []
+        if not args.skip_fp32:
+            fp32_dir = os.path.join(args.work_dir, "fp32")
+            if not os.path.exists(fp32_dir):
+                AutoModelForCausalLM.from_pretrained(args.model_name).save_pretrained(fp32_dir)
+                AutoTokenizer.from_pretrained(args.model_name).save_pretrained(fp32_dir)
+            report.append({"mode": "fp32", "disk_mb": directory_size_mb(fp32_dir), **measure_in_subprocess(fp32_dir, prompts, texts, args.new_tokens, args.max_length)})
+
+        for mode in args.modes:
+            mode_dir = os.path.join(args.work_dir, mode)
+            if quantize_model(args.model_name, mode_dir, mode, calibration_texts if mode != "dynamic" else None, args.group_size) is None:
+                raise RuntimeError(f"Quantizing in {mode} mode failed")
+            report.append({"mode": mode, "disk_mb": directory_size_mb(mode_dir), **measure_in_subprocess(mode_dir, prompts, texts, args.new_tokens, args.max_length)})
+
+        baseline = next((row for row in report if row["mode"] == "fp32"), None)
+        for row in report:
+            if baseline is not None:
+                row["perplexity_delta"] = row["perplexity"] - baseline["perplexity"]
+            print(f"[INFO][quantization_report.py] {row['mode']:<8} disk={row['disk_mb']:.0f}MB rss={row['rss_mb']:.0f}MB "
+                  f"load_peak={row['load_peak_rss_mb']:.0f}MB decode={row['decode_tokens_per_s']:.2f} tok/s "
+                  f"perplexity={row['perplexity']:.2f}" + (f" ({row['perplexity_delta']:+.2f})" if "perplexity_delta" in row else ""))
+
+        with open(args.output, 'w') as f:
+            json.dump({"model_name": args.model_name, "calibration_samples": len(calibration_texts), "group_size": args.group_size,
+                       "new_tokens": args.new_tokens, "num_perplexity_passages": len(texts), "results": report}, f, indent=2)
+        print(f"[INFO][quantization_report.py] Report saved to {args.output}")
+    except Exception as e:
+        print(f"[ERROR][quantization_report.py] Quantization report failed: {str(e)}")
+        sys.exit(1)
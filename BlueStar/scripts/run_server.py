@@ -0,0 +1,58 @@
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
+sys.path.insert(0, bluestar_dir)
+
+import argparse
+from BlueStar.utils.retrieval import Retriever
+from BlueStar.utils.generation import RAGModel
+from BlueStar.utils.server import BatchingEngine, create_server
+from BlueStar.utils.tracing import configure_tracing
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve BlueStar over HTTP on a TCP port or a Unix socket")
+    parser.add_argument("--model-path", default=os.path.join(script_dir, "..", "models", "quantized-gpt2-large"))
+    parser.add_argument("--index-path", default=os.path.join(script_dir, "..", "data", "faiss_index.bin"))
+    parser.add_argument("--store-path", default=os.path.join(script_dir, "..", "data", "store"))
+    parser.add_argument("--retrieval-mode", choices=["hybrid", "dense"], default="hybrid")
+    parser.add_argument("--encoder-backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--encoder-path", default=os.path.join(script_dir, "..", "models", "minilm-onnx"))
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--onnx-model-path", default=os.path.join(script_dir, "..", "models", "gpt2-large-onnx-int8"))
+    parser.add_argument("--num-threads", type=int, default=None)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", default=None, help="Listen on this Unix socket path instead of a TCP port")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="Most requests merged into one generation batch")
+    parser.add_argument("--max-wait-ms", type=float, default=20.0, help="Longest a request waits for others to join its batch")
+    parser.add_argument("--request-timeout", type=float, default=300.0, help="Seconds before a queued request is answered with 504")
+    parser.add_argument("--sample-interval-ms", type=float, default=50.0, help="Resource sampling period during each batch, 0 for start and end only")
+    parser.add_argument("--trace", action="store_true", help="Trace each batch's stages for GET /metrics")
+    parser.add_argument("--trace-file", default=None, help="Also append each trace to this JSONL file, implies --trace")
+    args = parser.parse_args()
+
+    try:
+        configure_tracing(args.trace or args.trace_file is not None, args.trace_file)
+        retriever = Retriever(args.index_path, args.store_path, retrieval_mode=args.retrieval_mode,
+                              encoder_backend=args.encoder_backend, encoder_path=args.encoder_path)
+        model_path = args.onnx_model_path if args.backend == "onnx" else args.model_path
+        rag = RAGModel(model_path, retriever, backend=args.backend, num_threads=args.num_threads, sample_interval_ms=args.sample_interval_ms)
+        engine = BatchingEngine(rag, args.max_batch_size, args.max_wait_ms)
+        server = create_server(engine, args.host, args.port, args.socket, args.request_timeout)
+    except Exception as e:
+        print(f"[ERROR][run_server.py] Failed to start server: {str(e)}")
+        sys.exit(1)
+
+    address = args.socket if args.socket else f"http://{args.host}:{args.port}"
+    print(f"[INFO][run_server.py] Serving on {address} (max batch {args.max_batch_size}, max wait {args.max_wait_ms}ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[INFO][run_server.py] Shutting down...")
+    finally:
+        server.server_close()
+        engine.shutdown()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
@@ -3,43 +3,50 @@ import sys
 script_dir = os.path.dirname(os.path.abspath(__file__))
 bluestar_dir = os.path.dirname(os.path.dirname(script_dir))
 sys.path.insert(0, bluestar_dir)
+import argparse
 import json
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import time
+from transformers import AutoTokenizer
 from BlueStar.utils.retrieval import Retriever
 from BlueStar.utils.evaluation import ModelEvaluator
+from BlueStar.utils.generation import load_causal_lm
+from BlueStar.utils.metrics import get_process_memory
 
-def calculate_memory_footprint(model, dtype_size=4):
-    """Calculate memory footprint in bytes."""
-    return sum(p.numel() * dtype_size for p in model.parameters())
+def checkpoint_size_mb(model_path: str) -> float:
+    """Measured size of the model files on disk"""
+    return sum(os.path.getsize(os.path.join(model_path, name)) for name in os.listdir(model_path)) / (1024 * 1024)
 
-def validate_model(model_path: str, test_set: str, index_path: str, corpus_path: str):
+def validate_model(model_path: str, test_set: str, index_path: str, store_path: str, batch_size: int = 8, num_workers: int = 1,
+                   checkpoint_path: str = None, speed_runs: int = 3):
     """Validate the quantized model's performance"""
     
     try:
         print("[INFO] [validate_model.py] Loading model and tokenizer...")
         
         tokenizer = AutoTokenizer.from_pretrained(model_path)
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
-            device_map='cpu',
-            torch_dtype=torch.float32,
-            low_cpu_mem_usage=True
-        )
+        rss_before = get_process_memory()['rss']
+        start = time.perf_counter()
+        model = load_causal_lm(model_path)
+        load_time = time.perf_counter() - start
         
         print("[INFO] [validate_model.py] Successfully loaded model and tokenizer")
-        print("[INFO] [validate_model.py] Model size:", calculate_memory_footprint(model) / (1024 * 1024), "MB")
+        print(f"[INFO] [validate_model.py] Load time: {load_time:.2f}s, RSS growth: {get_process_memory()['rss'] - rss_before:.1f}MB")
+        print(f"[INFO] [validate_model.py] Checkpoint size: {checkpoint_size_mb(model_path):.1f}MB")
         
         print("[INFO] [validate_model.py] Initializing retriever...")
-        retriever = Retriever(index_path, corpus_path)
+        retriever = Retriever(index_path, store_path)
         
         print("[INFO] [validate_model.py] Setting up evaluator...")
-        evaluator = ModelEvaluator(model, tokenizer, retriever)
+        evaluator = ModelEvaluator(model, tokenizer, retriever, model_path=model_path)
         
         print("[INFO] [validate_model.py] Running evaluation...")
         results = evaluator.run_full_evaluation(
             test_set,
-            os.path.join(os.path.dirname(test_set), "evaluation_results.json")
+            os.path.join(os.path.dirname(test_set), "evaluation_results.json"),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            checkpoint_path=checkpoint_path,
+            speed_runs=speed_runs
         )
         
         print("[INFO] [validate_model.py] Evaluation Results:")
@@ -53,9 +60,16 @@ def validate_model(model_path: str, test_set: str, index_path: str, corpus_path:
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    MODEL_PATH = os.path.join(script_dir, "..", "models", "quantized-gpt2-large")
-    TEST_SET = os.path.join(script_dir, "..", "data", "test_set.txt")
-    INDEX_PATH = os.path.join(script_dir, "..", "data", "faiss_index.bin")
-    CORPUS_PATH = os.path.join(script_dir, "..", "data", "corpus.pkl")
+    parser = argparse.ArgumentParser(description="Validate the quantized model's perplexity, speed and retrieval on the test set")
+    parser.add_argument("--model-path", default=os.path.join(script_dir, "..", "models", "quantized-gpt2-large"))
+    parser.add_argument("--test-set", default=os.path.join(script_dir, "..", "data", "test_set.txt"))
+    parser.add_argument("--index-path", default=os.path.join(script_dir, "..", "data", "faiss_index.bin"))
+    parser.add_argument("--store-path", default=os.path.join(script_dir, "..", "data", "store"))
+    parser.add_argument("--batch-size", type=int, default=8, help="Queries scored per padded perplexity batch, and per shard")
+    parser.add_argument("--num-workers", type=int, default=1, help="Processes evaluating shards, each with its own copy of the model")
+    parser.add_argument("--checkpoint", default=None, help="JSONL of finished items to resume from (defaults to evaluation_results.checkpoint.jsonl); "
+                        "only items from the same model files are reused, and it is removed once the results are written")
+    parser.add_argument("--speed-runs", type=int, default=3, help="Timed generations per query, 0 to score perplexity only")
+    args = parser.parse_args()
     
-    validate_model(MODEL_PATH, TEST_SET, INDEX_PATH, CORPUS_PATH)
+    validate_model(args.model_path, args.test_set, args.index_path, args.store_path, args.batch_size, args.num_workers, args.checkpoint, args.speed_runs)
@@ -0,0 +1,61 @@
+import os
+import sys
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(tests_dir))
+sys.path.insert(0, bluestar_dir)
+import copy
+import pytest
+
+from BlueStar.scripts.benchmark_latency import METRICS, SCHEMA_VERSION, compare_results
+
+def make_report(seconds: float, new_tokens_mean: float = 64.0, prompt_lengths=(256, 512)) -> dict:
+    """A report whose every metric and percentile reads seconds"""
+    summary = {"p50": seconds, "p95": seconds, "p99": seconds, "mean": seconds}
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "results": [{"prompt_length": prompt_length, "threads": 4, "requests": 20, "new_tokens_mean": new_tokens_mean,
+                     "metrics": {metric: dict(summary) for metric in METRICS}} for prompt_length in prompt_lengths],
+    }
+
+def test_slowdowns_beyond_tolerance_are_regressions():
+    baseline = make_report(1.0)
+    within = compare_results(baseline, make_report(1.09), 0.10, ["p50", "p95"])
+    assert len(within) == 2 * len(METRICS) * 2
+    assert not any(row["regression"] for row in within)
+
+    beyond = compare_results(baseline, make_report(1.11), 0.10, ["p50", "p95"])
+    assert all(row["regression"] for row in beyond)
+    assert beyond[0]["change"] == pytest.approx(0.11)
+
+    ## Getting faster is never a regression
+    assert not any(row["regression"] for row in compare_results(baseline, make_report(0.5), 0.10, ["p50"]))
+
+def test_only_regressed_metric_is_flagged():
+    current = make_report(1.0)
+    current["results"][1]["metrics"]["ttft_s"]["p95"] = 1.5
+    flagged = [row for row in compare_results(make_report(1.0), current, 0.10, ["p50", "p95"]) if row["regression"]]
+    assert [(row["prompt_length"], row["metric"], row["percentile"]) for row in flagged] == [(512, "ttft_s", "p95")]
+
+def test_configurations_missing_from_baseline_are_skipped():
+    rows = compare_results(make_report(1.0, prompt_lengths=(256,)), make_report(2.0, prompt_lengths=(256, 800)), 0.10, ["p50"])
+    assert {row["prompt_length"] for row in rows} == {256}
+
+@pytest.mark.parametrize("which", ["baseline", "current"])
+def test_other_schema_versions_are_refused(which):
+    reports = {"baseline": make_report(1.0), "current": make_report(1.0)}
+    reports[which]["schema_version"] = SCHEMA_VERSION - 1
+    with pytest.raises(ValueError, match="schema version"):
+        compare_results(reports["baseline"], reports["current"], 0.10, ["p50"])
+
+def test_mismatched_answer_lengths_are_refused():
+    baseline = make_report(1.0, new_tokens_mean=64.0)
+    ## Half a token of drift is allowed, more means the runs decoded different lengths
+    assert compare_results(baseline, make_report(1.0, new_tokens_mean=63.6), 0.10, ["p50"])
+    with pytest.raises(ValueError, match="--new-tokens"):
+        compare_results(baseline, make_report(1.0, new_tokens_mean=32.0), 0.10, ["p50"])
+
+def test_compare_does_not_modify_reports():
+    baseline, current = make_report(1.0), make_report(1.2)
+    before = copy.deepcopy((baseline, current))
+    compare_results(baseline, current, 0.10, ["p50"])
+    assert (baseline, current) == before
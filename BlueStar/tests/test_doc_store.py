@@ -0,0 +1,51 @@
+import os
+import sys
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(tests_dir))
+sys.path.insert(0, bluestar_dir)
+import pytest
+
+pytest.importorskip("numpy")
+
+from BlueStar.utils.doc_store import DocStore, DocStoreWriter, store_file_sizes, truncate_store
+
+def passages(store) -> list:
+    return [store.get_passage(passage_id) for passage_id in range(store.num_passages)]
+
+def test_rebuild_leaves_mapped_store_intact(tmp_path):
+    store_dir = str(tmp_path)
+    with DocStoreWriter(store_dir) as writer:
+        writer.add_document("first build text", [(0, 5), (6, 11)])
+    reader = DocStore(store_dir)
+
+    writer = DocStoreWriter(store_dir)
+    writer.add_document("second", [(0, 6)])
+    writer.flush()
+    ## The old files are neither truncated nor replaced until the rebuild closes
+    assert passages(reader) == ["first", "build"]
+    assert passages(DocStore(store_dir)) == ["first", "build"]
+
+    writer.close()
+    assert passages(reader) == ["first", "build"]
+    assert passages(DocStore(store_dir)) == ["second"]
+
+def test_interrupted_rebuild_resumes_from_staged_files(tmp_path):
+    store_dir = str(tmp_path)
+    with DocStoreWriter(store_dir) as writer:
+        writer.add_document("old", [(0, 3)])
+
+    writer = DocStoreWriter(store_dir)
+    writer.add_document("kept", [(0, 4)])
+    writer.flush()
+    sizes = store_file_sizes(store_dir)
+    writer.add_document("lost", [(0, 4)])
+    with pytest.raises(KeyError):
+        with writer:
+            raise KeyError("crash")
+    assert passages(DocStore(store_dir)) == ["old"]
+
+    truncate_store(store_dir, sizes)
+    with DocStoreWriter(store_dir, append=True) as writer:
+        writer.add_document("resumed", [(0, 7)])
+    assert passages(DocStore(store_dir)) == ["kept", "resumed"]
+    assert not any(name.endswith(".building") for name in os.listdir(store_dir))
@@ -0,0 +1,37 @@
+import json
+import os
+import sys
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(tests_dir))
+sys.path.insert(0, bluestar_dir)
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+sentence_transformers = pytest.importorskip("sentence_transformers")
+
+from BlueStar.utils.encoders import ENCODER_CONFIG_FILE, ENCODER_FILE, OnnxQueryEncoder
+
+## Written by scripts/export_encoder.py
+ENCODER_DIR = os.path.join(tests_dir, "..", "models", "minilm-onnx")
+TEST_SET = os.path.join(tests_dir, "..", "data", "test_set.txt")
+MIN_COSINE = 0.98
+
+@pytest.fixture(scope="module")
+def texts() -> list:
+    with open(TEST_SET, 'r', encoding='utf-8') as f:
+        texts = [line.strip() for line in f if line.strip()]
+    ## Long and one-word inputs exercise truncation and padding, not only typical queries
+    return texts + [" ".join(texts * 40), "BlueStar"]
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(ENCODER_DIR, ENCODER_FILE)), reason="no exported encoder, run scripts/export_encoder.py")
+def test_onnx_embeddings_match_pytorch(texts):
+    with open(os.path.join(ENCODER_DIR, ENCODER_CONFIG_FILE), 'r') as f:
+        model_name = json.load(f)["model_name"]
+    reference = sentence_transformers.SentenceTransformer(model_name, device='cpu').encode(texts, convert_to_numpy=True, normalize_embeddings=True)
+    exported = OnnxQueryEncoder(ENCODER_DIR).encode(texts)
+
+    assert exported.shape == reference.shape
+    cosines = np.sum(reference * exported, axis=1) / (np.linalg.norm(reference, axis=1) * np.linalg.norm(exported, axis=1))
+    assert cosines.min() >= MIN_COSINE, f"lowest cosine {cosines.min():.4f} for {texts[int(cosines.argmin())][:60]!r}"
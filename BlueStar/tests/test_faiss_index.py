@@ -0,0 +1,72 @@
+import os
+import sys
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(tests_dir))
+sys.path.insert(0, bluestar_dir)
+import pytest
+
+faiss = pytest.importorskip("faiss")
+np = pytest.importorskip("numpy")
+
+from BlueStar.utils.faiss_index import (add_embeddings, build_index, can_remove_ids, create_index, read_index, remove_ids,
+                                        save_index, set_search_params)
+
+DIMENSION = 16
+
+def random_embeddings(count: int, seed: int):
+    return np.random.default_rng(seed).standard_normal((count, DIMENSION)).astype(np.float32)
+
+def nearest_ids(index, queries) -> list:
+    _, labels = index.search(queries, 1)
+    return labels[:, 0].tolist()
+
+@pytest.mark.parametrize("index_type", ["ivf-flat", "flat"])
+def test_search_labels_survive_removal_and_append(tmp_path, index_type):
+    embeddings = random_embeddings(400, seed=0)
+    index, metadata = build_index(embeddings, index_type, nlist=4)
+    ## Visit every list so the nearest neighbour of a stored vector is always itself
+    set_search_params(index, {"nprobe": 4})
+    assert can_remove_ids(index, index_type)
+
+    assert remove_ids(index, np.arange(0, 100)) == 100
+    appended = random_embeddings(50, seed=1)
+    add_embeddings(index, appended, np.arange(1000, 1050))
+    assert index.ntotal == 350
+
+    assert nearest_ids(index, embeddings[150:160]) == list(range(150, 160))
+    assert nearest_ids(index, appended[:10]) == list(range(1000, 1010))
+    assert all(label not in range(0, 100) for label in nearest_ids(index, embeddings[:100]))
+
+    ## Labels still come out right after a save and a memory-mapped reload
+    index_path = str(tmp_path / "index.bin")
+    save_index(index, index_path, metadata)
+    loaded = read_index(index_path, index_type)
+    set_search_params(loaded, {"nprobe": 4})
+    assert nearest_ids(loaded, embeddings[300:310]) == list(range(300, 310))
+
+def test_ivf_index_is_memory_mapped(tmp_path):
+    index, metadata = build_index(random_embeddings(400, seed=3), "ivf-flat", nlist=4)
+    index_path = str(tmp_path / "index.bin")
+    save_index(index, index_path, metadata)
+
+    ## A full read would hold the lists in an in-memory ArrayInvertedLists
+    loaded = read_index(index_path)
+    invlists = faiss.downcast_InvertedLists(faiss.extract_index_ivf(loaded).invlists)
+    assert isinstance(invlists, faiss.OnDiskInvertedLists)
+    assert loaded.ntotal == 400
+
+def test_ivf_index_is_not_id_mapped():
+    index, _ = create_index(DIMENSION, "ivf-pq", nlist=4, pq_m=4)
+    assert not isinstance(index, faiss.IndexIDMap)
+
+def test_wrapped_ivf_index_needs_rebuild(tmp_path):
+    ## IVF indexes written before the fix were wrapped in an IndexIDMap2 and must not be updated in place
+    embeddings = random_embeddings(200, seed=2)
+    wrapped = faiss.IndexIDMap2(faiss.index_factory(DIMENSION, "IVF4,Flat"))
+    wrapped.train(embeddings)
+    wrapped.add_with_ids(embeddings, np.arange(200, dtype=np.int64))
+    index_path = str(tmp_path / "legacy.bin")
+    faiss.write_index(wrapped, index_path)
+
+    assert not can_remove_ids(faiss.read_index(index_path), "ivf-flat")
+    assert not can_remove_ids(create_index(DIMENSION, "hnsw")[0], "hnsw")
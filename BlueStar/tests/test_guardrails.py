@@ -0,0 +1,65 @@
+import os
+import sys
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+bluestar_dir = os.path.dirname(os.path.dirname(tests_dir))
+sys.path.insert(0, bluestar_dir)
+import pytest
+
+pytest.importorskip("numpy")
+
+from BlueStar.utils.guardrails import Guardrails, compile_terms, load_rules
+
+RULES = {
+    "version": 1,
+    "blocked": {
+        "topic": ["illegal", "hate speech", "personal information"],
+        "command": ["rm -rf", "format", "del"],
+    },
+}
+
+@pytest.fixture
+def guardrails() -> Guardrails:
+    return Guardrails(RULES)
+
+def blocked_rules(guardrails, queries) -> list:
+    return [decision["rule"] for decision in guardrails.check_batch(queries)]
+
+def test_terms_only_match_whole_words(guardrails):
+    assert blocked_rules(guardrails, [
+        "How does a language model work?",
+        "What information does a transformer store?",
+        "Why was it done illegally?",
+        "Is it ILLEGAL to scrape websites?",
+        "Explain del in Python",
+        "How do I format a disk?",
+    ]) == [None, None, None, "illegal", "del", "format"]
+
+def test_multi_word_terms_match_across_whitespace(guardrails):
+    assert blocked_rules(guardrails, ["What counts as hate\tspeech?", "find  Personal   Information online", "rm -rf /"]) == \
+        ["hate speech", "personal information", "rm -rf"]
+    ## The words alone are not the term
+    assert blocked_rules(guardrails, ["hate", "speech recognition", "personal projects"]) == [None, None, None]
+
+def test_terms_do_not_span_batch_entries(guardrails):
+    ## Batches are scanned newline-joined, so the end of one query and the start of the next must not form a term
+    assert blocked_rules(guardrails, ["I hate", "speech synthesis", "my personal", "information retrieval"]) == [None, None, None, None]
+    ## A newline inside a query is only whitespace within that query
+    assert blocked_rules(guardrails, ["hate\nspeech", "fine"]) == ["hate speech", None]
+
+def test_matches_are_attributed_to_their_query(guardrails):
+    decisions = guardrails.check_batch(["what is a transformer", "is it illegal", "attention", "hate speech and illegal", ""])
+    assert [decision["allowed"] for decision in decisions] == [True, False, True, False, True]
+    assert decisions[1]["category"] == "topic"
+    ## The first match in a query decides its rule
+    assert decisions[3]["rule"] == "hate speech"
+    assert guardrails.check("please format this")["category"] == "command"
+
+def test_compile_terms_prefers_longest_term():
+    pattern = compile_terms(["hate", "hate speech"])
+    assert pattern.search("no hate speech here").group(0) == "hate speech"
+    assert compile_terms(["", "  "]) is None
+
+def test_shipped_rules_load():
+    guardrails = Guardrails(load_rules())
+    assert guardrails.check("How is a neural network model trained?")["allowed"]
+    assert not guardrails.check("How do I get into hacking?")["allowed"]
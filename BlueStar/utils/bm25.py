@@ -0,0 +1,138 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+from collections import Counter
+from typing import List, Tuple
+from tqdm import tqdm
+
+## Inverted index layout, all arrays are saved as .npy next to the document store and memory-mapped at load:
+##   bm25_terms.npy     - sorted uint64 term hashes, the term id is the position in this array
+##   bm25_offsets.npy   - int64 offsets into the postings arrays, one more entry than there are terms
+##   bm25_postings.npy  - uint32 passage ids, each term's postings sorted by descending weight
+##   bm25_weights.npy   - float32 precomputed BM25 contribution of the term to each passage
+##   bm25_meta.json     - build parameters and corpus statistics
+TERMS_FILE = "bm25_terms.npy"
+OFFSETS_FILE = "bm25_offsets.npy"
+POSTINGS_FILE = "bm25_postings.npy"
+WEIGHTS_FILE = "bm25_weights.npy"
+META_FILE = "bm25_meta.json"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, keeping digits so product codes and names match exactly"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def hash_terms(terms) -> np.ndarray:
+    """Map terms to stable 64-bit ids so no vocabulary has to be loaded at query time"""
+    return np.array([int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little') for term in terms], dtype=np.uint64)
+
+def bm25_exists(store_dir: str) -> bool:
+    return os.path.exists(os.path.join(store_dir, META_FILE))
+
+def build_bm25_index(store, store_dir: str, k1: float = 1.2, b: float = 0.75):
+    """Build the BM25 inverted index over every live passage in a document store.
+
+    Weights depend on corpus-wide statistics, so incremental updates rebuild this index from the store;
+    that only re-tokenizes text and never re-embeds anything.
+    """
+    term_chunks, passage_chunks, tf_chunks, lengths = [], [], [], {}
+
+    for passage_id in tqdm(range(store.num_passages), desc="Building BM25 index"):
+        if store.is_deleted(passage_id):
+            continue
+        tokens = tokenize(store.get_passage(passage_id))
+        lengths[passage_id] = len(tokens)
+        counts = Counter(tokens)
+        if not counts:
+            continue
+        term_chunks.append(hash_terms(counts.keys()))
+        tf_chunks.append(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+        passage_chunks.append(np.full(len(counts), passage_id, dtype=np.uint32))
+
+    num_passages = len(lengths)
+    avgdl = sum(lengths.values()) / max(num_passages, 1)
+
+    if term_chunks:
+        term_hashes = np.concatenate(term_chunks)
+        passage_ids = np.concatenate(passage_chunks)
+        tfs = np.concatenate(tf_chunks)
+    else:
+        term_hashes = np.zeros(0, dtype=np.uint64)
+        passage_ids = np.zeros(0, dtype=np.uint32)
+        tfs = np.zeros(0, dtype=np.float32)
+
+    doc_lengths = np.zeros(store.num_passages, dtype=np.float32)
+    doc_lengths[list(lengths)] = list(lengths.values())
+
+    terms, term_ids, dfs = np.unique(term_hashes, return_inverse=True, return_counts=True)
+    idf = np.log1p((num_passages - dfs + 0.5) / (dfs + 0.5)).astype(np.float32)
+    norms = k1 * (1 - b + b * doc_lengths[passage_ids] / max(avgdl, 1e-9))
+    weights = idf[term_ids] * tfs * (k1 + 1) / (tfs + norms)
+
+    ## Group by term, highest weight first, so queries can read a bounded prefix of long postings lists
+    order = np.lexsort((-weights, term_ids))
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(dfs)
+
+    ## Running retrievers have the old arrays memory-mapped, so each file is written aside and then moved into place
+    arrays = {TERMS_FILE: terms, OFFSETS_FILE: offsets, POSTINGS_FILE: passage_ids[order], WEIGHTS_FILE: weights[order].astype(np.float32)}
+    for name, array in arrays.items():
+        path = os.path.join(store_dir, name)
+        with open(path + ".tmp", 'wb') as f:
+            np.save(f, array)
+        os.replace(path + ".tmp", path)
+    meta_path = os.path.join(store_dir, META_FILE)
+    with open(meta_path + ".tmp", 'w') as f:
+        json.dump({"k1": k1, "b": b, "num_passages": num_passages, "avgdl": avgdl, "num_terms": len(terms)}, f, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+
+class BM25Index:
+    """Memory-mapped BM25 inverted index with vectorized scoring"""
+
+    def __init__(self, store_dir: str, max_postings_per_term: int = 20000):
+        self.terms = np.load(os.path.join(store_dir, TERMS_FILE), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode='r')
+        self.postings = np.load(os.path.join(store_dir, POSTINGS_FILE), mmap_mode='r')
+        self.weights = np.load(os.path.join(store_dir, WEIGHTS_FILE), mmap_mode='r')
+        with open(os.path.join(store_dir, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        self.max_postings_per_term = max_postings_per_term
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Return (passage_id, score) pairs for the top_k passages by BM25"""
+        hashes = np.unique(hash_terms(set(tokenize(query))))
+        if len(hashes) == 0 or len(self.terms) == 0:
+            return []
+
+        positions = np.searchsorted(self.terms, hashes)
+        in_range = positions < len(self.terms)
+        positions, hashes = positions[in_range], hashes[in_range]
+        positions = positions[self.terms[positions] == hashes]
+        if len(positions) == 0:
+            return []
+
+        passage_parts, weight_parts = [], []
+        for position in positions:
+            start = int(self.offsets[position])
+            end = min(int(self.offsets[position + 1]), start + self.max_postings_per_term)
+            passage_parts.append(self.postings[start:end])
+            weight_parts.append(self.weights[start:end])
+
+        candidates, inverse = np.unique(np.concatenate(passage_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weight_parts))
+
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(candidates[i]), float(scores[i])) for i in best]
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse several ranked id lists, scoring each id by the sum of 1 / (k + rank) over the lists it appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
@@ -0,0 +1,34 @@
+from typing import List, Tuple
+
+## Defaults sized for all-MiniLM-L6-v2, which truncates its input at 256 word pieces
+DEFAULT_CHUNK_TOKENS = 200
+DEFAULT_CHUNK_OVERLAP = 40
+
+def _spans_from_offsets(offsets, max_tokens: int, overlap: int) -> List[Tuple[int, int]]:
+    """Slide a max_tokens window over token offsets and return each window's character span"""
+    if not offsets:
+        return []
+
+    stride = max_tokens - overlap
+    spans = []
+    for start in range(0, len(offsets), stride):
+        end = min(start + max_tokens, len(offsets))
+        spans.append((offsets[start][0], offsets[end - 1][1]))
+        if end == len(offsets):
+            break
+
+    return spans
+
+def chunk_text(text: str, tokenizer, max_tokens: int = DEFAULT_CHUNK_TOKENS, overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[Tuple[int, int]]:
+    """Split text into overlapping, token-bounded passages and return their (start, end) character offsets"""
+    return chunk_texts([text], tokenizer, max_tokens, overlap)[0]
+
+def chunk_texts(texts: List[str], tokenizer, max_tokens: int = DEFAULT_CHUNK_TOKENS, overlap: int = DEFAULT_CHUNK_OVERLAP) -> List[List[Tuple[int, int]]]:
+    """Chunk several texts with one batched tokenizer call, returning the spans of each text"""
+    if overlap >= max_tokens:
+        raise ValueError(f"Chunk overlap ({overlap}) must be smaller than chunk size ({max_tokens})")
+    if not texts:
+        return []
+
+    encoding = tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+    return [_spans_from_offsets(offsets, max_tokens, overlap) for offsets in encoding["offset_mapping"]]
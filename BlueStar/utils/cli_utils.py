@@ -1,18 +1,22 @@
 import click
+import contextlib
+import json
 import os
+import signal
 import sys
 import threading
 import time
-from itertools import cycle
-from BlueStar.utils.metrics import monitor_resources
+from itertools import cycle, islice
+from typing import Optional
 
 ## Add the BlueStar directory to the Python path
 utils_dir = os.path.dirname(os.path.abspath(__file__))
 bluestar_dir = os.path.dirname(os.path.dirname(utils_dir))
 sys.path.insert(0, bluestar_dir)
 
-from BlueStar.utils.retrieval import Retriever
-from BlueStar.utils.generation import RAGModel
+## Only the daemon client is imported up front; retrieval, generation and tracing pull in torch, transformers
+## and faiss, so they are imported by the commands that load models and a client session starts without them
+from BlueStar.utils.daemon_client import DaemonClient, IncompatibleDaemonError, default_socket_path
 
 ## Add threading.Event for controlling the spinner
 def spinner_task(stop_event):
@@ -25,43 +29,159 @@ def spinner_task(stop_event):
     sys.stdout.write('\r' + ' ' * 20 + '\r')
     sys.stdout.flush()
 
-@click.command()
-@click.option('--model-path',
-    default=os.path.join(os.path.dirname(__file__), "..", "models", "quantized-gpt2-large"),
-    help='Path to quantized model.')
-@click.option('--index-path',
-    default=os.path.join(os.path.dirname(__file__), "..", "data", "faiss_index.bin"),
-    help='Path to FAISS index.')
-@click.option('--corpus-path',
-    default=os.path.join(os.path.dirname(__file__), "..", "data", "corpus.pkl"),
-    help='Path to the corpus pickle file.')
-@click.option('--device',
-    default='cpu',
-    help='Device to use for model inference. Currently only supports CPU.')
-def main(model_path, index_path, corpus_path, device):
-    try:
-        click.echo("Initializing BlueStar...")
-        retriever = Retriever(index_path, corpus_path)
-        rag = RAGModel(model_path, retriever, device)
-        click.echo("Initialization complete!")
-    except Exception as e:
-        click.echo(f"Error initializing BlueStar: {e}")
-        return
+class StreamPrinter:
+    """Echoes streamed text word by word, wrapping lines at width as they fill"""
+
+    def __init__(self, width: int, column: int = 0):
+        self.width = width
+        self.column = column
+        self.word = ""
+        self.line_has_words = False
+
+    def write(self, text: str):
+        for char in text:
+            if char.isspace():
+                self._flush_word()
+            else:
+                self.word += char
+
+    def _flush_word(self):
+        if not self.word:
+            return
+        if self.line_has_words and self.column + 1 + len(self.word) > self.width:
+            click.echo()
+            self.column = 0
+            self.line_has_words = False
+        if self.line_has_words:
+            click.echo(" ", nl=False)
+            self.column += 1
+        click.echo(self.word, nl=False)
+        self.column += len(self.word)
+        self.line_has_words = True
+        self.word = ""
 
+    def finish(self):
+        self._flush_word()
+        click.echo()
+
+MODEL_OPTIONS = [
+    click.option('--model-path',
+        default=os.path.join(os.path.dirname(__file__), "..", "models", "quantized-gpt2-large"),
+        help='Path to quantized model.'),
+    click.option('--index-path',
+        default=os.path.join(os.path.dirname(__file__), "..", "data", "faiss_index.bin"),
+        help='Path to FAISS index.'),
+    click.option('--store-path',
+        default=os.path.join(os.path.dirname(__file__), "..", "data", "store"),
+        help='Path to the document store directory.'),
+    click.option('--retrieval-mode',
+        type=click.Choice(['hybrid', 'dense']),
+        default='hybrid',
+        help='Fuse BM25 and dense results, or use dense retrieval only.'),
+    click.option('--nprobe',
+        type=int,
+        default=None,
+        help='IVF lists to visit per query. Defaults to the value stored with the index.'),
+    click.option('--ef-search',
+        type=int,
+        default=None,
+        help='HNSW search breadth. Defaults to the value stored with the index.'),
+    click.option('--encoder-backend',
+        type=click.Choice(['torch', 'onnx']),
+        default='torch',
+        help='Run the query encoder with PyTorch, or as the int8 ONNX export from scripts/export_encoder.py.'),
+    click.option('--encoder-path',
+        default=os.path.join(os.path.dirname(__file__), "..", "models", "minilm-onnx"),
+        help='Directory of the exported ONNX query encoder.'),
+    click.option('--backend',
+        type=click.Choice(['torch', 'onnx']),
+        default='torch',
+        help='Generate with the PyTorch dynamic-quant model, or the int8 ONNX export from scripts/export_generator.py.'),
+    click.option('--onnx-model-path',
+        default=os.path.join(os.path.dirname(__file__), "..", "models", "gpt2-large-onnx-int8"),
+        help='Directory of the exported ONNX generator, used with --backend onnx.'),
+    click.option('--num-threads',
+        type=int,
+        default=None,
+        help='Threads for generation. Defaults to the physical core count for ONNX Runtime and the PyTorch default otherwise.'),
+    click.option('--speculative/--no-speculative',
+        default=False,
+        help='Let a small draft model propose tokens for the main model to verify.'),
+    click.option('--draft-model',
+        default='gpt2',
+        help='Draft model for speculative decoding, it must share the main model\'s tokenizer.'),
+    click.option('--num-draft-tokens',
+        type=int,
+        default=4,
+        help='Tokens the draft model proposes per verification step.'),
+    click.option('--latency-slo',
+        type=float,
+        default=None,
+        help='Seconds an answer may take, retrieval included. Sizes the token budget from measured speed and stops at the deadline.'),
+    click.option('--trace/--no-trace',
+        default=False,
+        help='Time each stage of every answer (embedding, search, prompt assembly, tokenization, prefill, decode) and print the breakdown.'),
+    click.option('--trace-file',
+        default=None,
+        help='Append each answer\'s trace to this JSONL file. Implies --trace.'),
+    click.option('--metrics-port',
+        type=int,
+        default=None,
+        help='Serve Prometheus metrics on this local port at /metrics. Implies --trace.'),
+    click.option('--sample-interval-ms',
+        type=float,
+        default=50.0,
+        help='How often process RSS, CPU time and threads are sampled during an answer, 0 for start and end only.'),
+    click.option('--device',
+        default='cpu',
+        help='Device to use for model inference. Currently only supports CPU.'),
+]
+
+def model_options(command):
+    """Apply the options for loading the models, shared by the local session and the daemon"""
+    for option in reversed(MODEL_OPTIONS):
+        command = option(command)
+    return command
+
+socket_option = click.option('--socket', 'socket_path',
+    default=default_socket_path,
+    envvar='BLUESTAR_SOCKET',
+    help='Unix socket of the daemon. Defaults to bluestar-<uid>.sock in $XDG_RUNTIME_DIR or /tmp.')
+
+def load_rag(model_path, index_path, store_path, retrieval_mode, nprobe, ef_search, encoder_backend, encoder_path, backend, onnx_model_path, num_threads, speculative, draft_model, num_draft_tokens, latency_slo, trace, trace_file, metrics_port, sample_interval_ms, device):
+    """Configure tracing and load the retriever and generator in this process"""
+    from BlueStar.utils.retrieval import Retriever
+    from BlueStar.utils.generation import RAGModel
+    from BlueStar.utils.tracing import configure_tracing, start_metrics_server
+
+    trace = trace or trace_file is not None or metrics_port is not None
+    configure_tracing(trace, trace_file)
+    if metrics_port is not None:
+        start_metrics_server(metrics_port)
+        click.echo(f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
+    retriever = Retriever(index_path, store_path, nprobe=nprobe, ef_search=ef_search, retrieval_mode=retrieval_mode,
+                          encoder_backend=encoder_backend, encoder_path=encoder_path)
+    return RAGModel(onnx_model_path if backend == 'onnx' else model_path, retriever, device, backend=backend, num_threads=num_threads,
+                    draft_model=draft_model if speculative else None, num_draft_tokens=num_draft_tokens,
+                    sample_interval_ms=sample_interval_ms)
+
+def run_session(rag, latency_slo: float = None):
+    """Interactive query loop over a RAGModel, or a DaemonClient that answers the same calls from a daemon"""
     click.echo("BlueStar RAG CLI. Type 'exit' to quit.")
+    stop_spinner = threading.Event()
     while True:
         try:
             query = click.prompt('You', type=str)
             if query.lower() in ['exit', 'quit']:
                 break
             
-            ## Check if topic is allowed
-            if not rag.is_allowed_topic(query):
-                click.echo("I apologize, but I cannot assist with that topic due to ethical constraints.")
+            ## Check if topic is allowed and refine the query if needed
+            decision = rag.prepare_query(query)
+            if not decision["allowed"]:
+                click.echo(decision["message"])
                 continue
             
-            ## Refine query if needed
-            refined_query = rag.refine_query(query)
+            refined_query = decision["query"]
             if refined_query != query:
                 click.echo(f"Refining query: {refined_query}")
                 query = refined_query
@@ -73,11 +193,16 @@ def main(model_path, index_path, corpus_path, device):
             spinner.start()
             
             start_time = time.time()
-            cpu_start, ram_start = monitor_resources()
             
-            ## Generate response
+            ## Retrieve, prefill and start decoding; the spinner runs until the first token arrives
             try:
-                response, sources = rag.generate_response(query)
+                stream = rag.generate_stream(query, latency_slo=latency_slo)
+            except KeyboardInterrupt:
+                ## Ctrl-C during retrieval or prefill drops the answer before decoding starts
+                stop_spinner.set()
+                spinner.join()
+                click.echo("[Generation cancelled]")
+                continue
             except RuntimeError as e:
                 stop_spinner.set()
                 if "out of memory" in str(e):
@@ -86,29 +211,305 @@ def main(model_path, index_path, corpus_path, device):
                 else:
                     click.echo(f"An error occurred during generation: {str(e)}")
                     continue
-            
-            ## Get resource usage
-            cpu_end, ram_end = monitor_resources()
+
+            printer = StreamPrinter(rag.COLUMN_WIDTH, len("BlueStar: "))
+            first_token_time = None
+            try:
+                for text in stream:
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                        stop_spinner.set()
+                        spinner.join()
+                        click.echo("BlueStar: ", nl=False)
+                    printer.write(text)
+            except KeyboardInterrupt:
+                ## Ctrl-C stops decoding after the current token and keeps the CLI running
+                stream.cancel()
+            finally:
+                stop_spinner.set()
+                spinner.join()
+
+            if first_token_time is None:
+                click.echo("BlueStar: ", nl=False)
+            printer.finish()
+            if stream.cancelled:
+                click.echo("[Generation cancelled]")
+            elif stream.metrics.get("truncated"):
+                click.echo("[Answer shortened to fit the latency budget]" if latency_slo is not None else "[Answer reached the token limit]")
+
             end_time = time.time()
-            
-            ## Stop the spinner
-            stop_spinner.set()
-            spinner.join()
-            
-            click.echo(f"BlueStar: {response}")
+
+            sources = stream.context_parts
             if sources:
                 click.echo("\nSources:")
                 for i, doc in enumerate(sources, 1):
                     click.echo(f"{i}. {doc[:200]}...")
             
             click.echo(f"\nPerformance Metrics:")
+            if first_token_time is not None:
+                click.echo(f"Time to First Token: {first_token_time - start_time:.2f}s")
             click.echo(f"Response Time: {end_time - start_time:.2f}s")
-            click.echo(f"CPU Usage: {cpu_end - cpu_start:.1f}%")
-            click.echo(f"RAM Usage: {ram_end - ram_start:.1f}%")
+            if stream.metrics:
+                click.echo(f"Decode Speed: {stream.metrics['tokens_per_second']:.2f} tokens/s")
+            if stream.metrics.get("speculative"):
+                click.echo(f"Draft Acceptance: {stream.metrics['acceptance_rate']:.1%} ({stream.metrics['tokens_per_target_pass']:.2f} tokens per verification)")
+                click.echo(f"Estimated Speedup: {stream.metrics['estimated_speedup']:.2f}x")
+            ## Stage timings are only recorded when tracing is on
+            for stage, seconds in stream.stages.items():
+                click.echo(f"  {stage}: {seconds * 1000:.1f}ms")
+            resources = stream.resources
+            if resources:
+                click.echo(f"Peak RSS: {resources['rss_peak_mb']:.0f}MB ({resources['rss_peak_mb'] - resources['rss_start_mb']:+.0f}MB during the answer)")
+                click.echo(f"CPU Time: {resources['cpu_user_s']:.2f}s user, {resources['cpu_system_s']:.2f}s system "
+                           f"({resources['cpu_percent']:.0f}% of one core, {resources['threads_peak']} threads)")
                     
+        except click.Abort:
+            ## End of input or Ctrl-C at the prompt
+            click.echo()
+            break
         except Exception as e:
             stop_spinner.set()
             click.echo(f"An error occurred: {e}")
 
+@click.group(invoke_without_command=True)
+@model_options
+@click.pass_context
+def main(ctx, **options):
+    """BlueStar RAG CLI. Without a command, loads the models in this process and answers queries interactively."""
+    if ctx.invoked_subcommand is not None:
+        return
+    try:
+        click.echo("Initializing BlueStar...")
+        rag = load_rag(**options)
+        click.echo("Initialization complete!")
+    except Exception as e:
+        click.echo(f"Error initializing BlueStar: {e}")
+        return
+    run_session(rag, options["latency_slo"])
+
+def wait_for_daemon(socket_path: str, pid: int, log_file: str) -> Optional[str]:
+    """Poll the socket until the forked daemon answers, returning None once it does or why it never will"""
+    while True:
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            return f"BlueStar daemon exited while loading, see {log_file}"
+        try:
+            with DaemonClient(socket_path) as client:
+                client.ping()
+            return None
+        except ConnectionError:
+            time.sleep(0.2)
+        except IncompatibleDaemonError as e:
+            ## Another process took the socket while the models loaded; the new daemon could never bind it
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+            return f"{e}\nStop that daemon or choose another --socket."
+
+@main.command()
+@model_options
+@socket_option
+@click.option('--detach',
+    is_flag=True,
+    help='Load the models in a background process and return once it accepts connections.')
+@click.option('--log-file',
+    default=None,
+    help='Output of a detached daemon. Defaults to the socket path with a .log suffix.')
+def daemon(socket_path, detach, log_file, **options):
+    """Keep the models loaded and answer sessions started with 'connect' over a Unix socket"""
+    try:
+        with DaemonClient(socket_path) as client:
+            client.ping()
+        click.echo(f"A BlueStar daemon (pid {client.pid}) is already running on {socket_path}")
+        return
+    except ConnectionError:
+        pass
+    except IncompatibleDaemonError as e:
+        click.echo(f"{e}\nStop that daemon or choose another --socket.")
+        sys.exit(1)
+
+    if detach:
+        log_file = log_file or socket_path + ".log"
+        ## Fork before anything heavy is imported; the parent only waits for the socket
+        pid = os.fork()
+        if pid > 0:
+            click.echo(f"Starting BlueStar daemon (pid {pid}), logging to {log_file}...")
+            error = wait_for_daemon(socket_path, pid, log_file)
+            if error is not None:
+                click.echo(error)
+                sys.exit(1)
+            click.echo(f"BlueStar daemon ready on {socket_path}")
+            return
+        os.setsid()
+        log = open(log_file, 'a', buffering=1)
+        os.dup2(log.fileno(), sys.stdout.fileno())
+        os.dup2(log.fileno(), sys.stderr.fileno())
+        os.dup2(os.open(os.devnull, os.O_RDONLY), sys.stdin.fileno())
+        sys.stdout.reconfigure(line_buffering=True)
+
+    from BlueStar.utils.daemon import create_daemon
+    try:
+        click.echo("Initializing BlueStar daemon...")
+        rag = load_rag(**options)
+        server = create_daemon(rag, socket_path, options["latency_slo"])
+    except Exception as e:
+        click.echo(f"Error initializing BlueStar daemon: {e}")
+        sys.exit(1)
+
+    click.echo(f"BlueStar daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        click.echo("Shutting down...")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+@main.command()
+@socket_option
+@click.option('--latency-slo',
+    type=float,
+    default=None,
+    help='Seconds an answer may take, retrieval included. Defaults to the daemon\'s --latency-slo.')
+def connect(socket_path, latency_slo):
+    """Answer queries interactively through a running daemon, without loading any models here"""
+    start = time.perf_counter()
+    client = DaemonClient(socket_path)
+    try:
+        client.connect().ping()
+    except IncompatibleDaemonError as e:
+        client.close()
+        click.echo(f"{e}\nRestart it with: run_cli.py stop && run_cli.py daemon --detach")
+        return
+    except ConnectionError as e:
+        click.echo(f"{e}\nStart one with: run_cli.py daemon --detach")
+        return
+    click.echo(f"Connected to BlueStar daemon (pid {client.pid}) in {(time.perf_counter() - start) * 1000:.0f}ms")
+    try:
+        run_session(client, latency_slo)
+    finally:
+        client.close()
+
+def read_queries(lines):
+    """Yield (id, query, error) for each non-blank line, which is plain text or a JSON object with "query" and an optional "id" """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("{"):
+            yield number, line, None
+            continue
+        try:
+            record = json.loads(line)
+            query = str(record["query"]).strip()
+            yield record.get("id", number), query or None, None if query else "Query must not be empty"
+        except (ValueError, KeyError, TypeError) as e:
+            yield number, None, f"Invalid input line: {str(e)}"
+
+def answer_batch(rag, batch: list, top_k: int, snippet_chars: int) -> list:
+    """Output records for one batch of (id, query, error): guardrails first, then one batched generate call for the allowed queries"""
+    records = [{"id": query_id, "query": query} for query_id, query, _ in batch]
+    pending = []
+    for record, (_, query, error) in zip(records, batch):
+        if error is not None:
+            record["error"] = error
+        else:
+            pending.append(record)
+
+    try:
+        decisions = rag.check_topics([record["query"] for record in pending]) if pending else []
+    except Exception as e:
+        for record in pending:
+            record["error"] = f"Guardrail check failed: {str(e)}"
+        return records
+    allowed = []
+    for record, decision in zip(pending, decisions):
+        if decision["allowed"]:
+            allowed.append(record)
+        else:
+            record.update(answer=rag.guardrails.refusal_message, sources=[], rejected=True, category=decision["category"])
+
+    if allowed:
+        answers, metrics = rag.generate_batch([record["query"] for record in allowed], top_k, return_metrics=True)
+        for i, (record, (response, _, sources)) in enumerate(zip(allowed, answers)):
+            record.update(answer=response, rejected=False, batch_size=len(allowed))
+            record["sources"] = [{**source, "text": source["text"][:snippet_chars] if snippet_chars else source["text"]} for source in sources]
+            if "error" in metrics:
+                record["error"] = metrics["error"]
+                continue
+            record.update(prompt_tokens=metrics["prompt_tokens"][i], new_tokens=metrics["new_tokens"][i])
+            ## Stages are timed once for the whole batch, so every query in it carries the same timings
+            record["timings"] = metrics.get("stages", {})
+    return records
+
+@main.command()
+@model_options
+@click.option('--input', 'input_file',
+    type=click.File('r', encoding='utf-8'),
+    default='-',
+    help='Queries, one per line as plain text or JSON with "query" and an optional "id". Defaults to stdin.')
+@click.option('--output', 'output_file',
+    type=click.File('w', encoding='utf-8'),
+    default='-',
+    help='Where to write one JSON answer per line. Defaults to stdout.')
+@click.option('--batch-size',
+    type=int,
+    default=8,
+    help='Queries read, retrieved and generated together. Only one batch is held in memory at a time.')
+@click.option('--top-k',
+    type=int,
+    default=3,
+    help='Passages retrieved per query.')
+@click.option('--snippet-chars',
+    type=int,
+    default=200,
+    help='Characters of each source passage written with the answer, 0 for the full passage.')
+def batch(input_file, output_file, batch_size, top_k, snippet_chars, **options):
+    """Answer queries from a file or stdin without prompting and write JSONL with answers, sources, scores and stage timings"""
+    ## Log lines from model loading and generation go to stderr so JSONL on stdout stays parseable
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            click.echo("Initializing BlueStar...", err=True)
+            ## Tracing supplies the per-stage timings written with each answer
+            rag = load_rag(**{**options, "trace": True})
+            click.echo("Initialization complete!", err=True)
+        except Exception as e:
+            click.echo(f"Error initializing BlueStar: {e}", err=True)
+            sys.exit(1)
+
+        queries = read_queries(input_file)
+        counts = {"queries": 0, "rejected": 0, "errors": 0, "new_tokens": 0}
+        start = time.perf_counter()
+        while True:
+            chunk = list(islice(queries, batch_size))
+            if not chunk:
+                break
+            for record in answer_batch(rag, chunk, top_k, snippet_chars):
+                output_file.write(json.dumps(record, default=str) + "\n")
+                counts["rejected"] += record.get("rejected", False)
+                counts["errors"] += "error" in record
+                counts["new_tokens"] += record.get("new_tokens", 0)
+            output_file.flush()
+            counts["queries"] += len(chunk)
+            elapsed = time.perf_counter() - start
+            click.echo(f"\r{counts['queries']} queries, {counts['queries'] / elapsed:.2f} queries/s", nl=False, err=True)
+
+        elapsed = time.perf_counter() - start
+        click.echo(err=True)
+        click.echo(f"Answered {counts['queries']} queries in {elapsed:.1f}s ({counts['queries'] / max(elapsed, 1e-9):.2f} queries/s, "
+                   f"{counts['new_tokens'] / max(elapsed, 1e-9):.1f} tokens/s); {counts['rejected']} rejected, {counts['errors']} errors", err=True)
+
+@main.command()
+@socket_option
+def stop(socket_path):
+    """Shut down a running daemon"""
+    try:
+        with DaemonClient(socket_path) as client:
+            client.ping()
+            client.shutdown()
+        click.echo(f"Stopped BlueStar daemon (pid {client.pid})")
+    except (ConnectionError, RuntimeError) as e:
+        click.echo(str(e))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import Iterator, List, Tuple
+
+## Corpus shards are gzip-compressed JSONL files of {"id", "title", "text"} records
+SHARD_PREFIX = "corpus-"
+SHARD_SUFFIX = ".jsonl.gz"
+
+def format_article(title: str, text: str) -> str:
+    """Render an article the way corpus documents are stored and embedded"""
+    return f"Title: {title}\n\n{text}"
+
+def content_hash(text: str) -> str:
+    """Return the SHA-256 of a document's UTF-8 text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def compile_keyword_matcher(keywords: List[str]):
+    """Compile keywords into one case-insensitive alternation, so each article is scanned once without lowercasing a copy"""
+    ## Longest first, so a keyword that is a prefix of another never shadows it
+    pattern = "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True))
+    return re.compile(pattern, re.IGNORECASE)
+
+def list_shards(corpus_dir: str) -> List[str]:
+    """Return the sorted names of the corpus shards in a directory"""
+    return sorted(name for name in os.listdir(corpus_dir) if name.startswith(SHARD_PREFIX) and name.endswith(SHARD_SUFFIX))
+
+def iter_shard(path: str) -> Iterator[Tuple[str, str]]:
+    """Yield (record_id, document_text) for every article in a shard"""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield str(record["id"]), format_article(record["title"], record["text"])
+
+class ShardWriter:
+    """Writes articles to numbered, gzip-compressed JSONL shards of at most shard_size records.
+
+    Shards already in output_dir are removed first, since a shorter corpus would leave the old ones to be indexed with it.
+    """
+
+    def __init__(self, output_dir: str, shard_size: int = 10000, compresslevel: int = 6):
+        os.makedirs(output_dir, exist_ok=True)
+        self.removed_shards = list_shards(output_dir)
+        for name in self.removed_shards:
+            os.remove(os.path.join(output_dir, name))
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.compresslevel = compresslevel
+        self.num_shards = 0
+        self.num_records = 0
+        self._file = None
+        self._records_in_shard = 0
+
+    def write(self, record_id, title: str, text: str):
+        if self._file is None or self._records_in_shard >= self.shard_size:
+            self._open_next()
+        self._file.write(json.dumps({"id": record_id, "title": title, "text": text}, ensure_ascii=False) + "\n")
+        self._records_in_shard += 1
+        self.num_records += 1
+
+    def _open_next(self):
+        self.close()
+        path = os.path.join(self.output_dir, f"{SHARD_PREFIX}{self.num_shards:05d}{SHARD_SUFFIX}")
+        self._file = gzip.open(path, 'wt', encoding='utf-8', compresslevel=self.compresslevel)
+        self._records_in_shard = 0
+        self.num_shards += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,103 @@
+import json
+import os
+import socketserver
+import threading
+from typing import Optional
+from BlueStar.utils.daemon_client import PROTOCOL_VERSION, DaemonClient
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """Answers one client connection: a JSON request per line, and one JSON event per line back.
+
+    Ops are "ping", "prepare" (guardrails and refinement), "generate" and "shutdown". A generate call answers
+    with {"event": "started", "sources"} once the prompt is prefilled, then a "token" event per piece of text
+    and a final "done" event carrying metrics, stage timings and resources, or an "error" event instead.
+    """
+
+    rag = None
+    generation_lock: threading.Lock = None
+    default_latency_slo: Optional[float] = None
+
+    def _send(self, payload: dict):
+        self.wfile.write(json.dumps(payload, default=str).encode('utf-8') + b"\n")
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                op = request.get("op")
+            except (ValueError, AttributeError) as e:
+                self._send({"event": "error", "message": f"Invalid request: {str(e)}"})
+                return
+
+            try:
+                if op == "ping":
+                    self._send({"event": "pong", "protocol": PROTOCOL_VERSION, "pid": os.getpid(), "column_width": self.rag.COLUMN_WIDTH})
+                elif op == "prepare":
+                    with self.generation_lock:
+                        decision = self.rag.prepare_query(str(request["query"]))
+                    self._send({"event": "prepared", **decision})
+                elif op == "generate":
+                    if not self._generate(request):
+                        return
+                elif op == "shutdown":
+                    self._send({"event": "stopping"})
+                    ## shutdown() waits for serve_forever to return, so it cannot run on a handler thread of that loop
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+                else:
+                    self._send({"event": "error", "message": f"Unknown op '{op}'"})
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                self._send({"event": "error", "message": str(e)})
+
+    def _generate(self, request: dict) -> bool:
+        """Stream one answer to the client; returns False once the client has gone away"""
+        latency_slo = request.get("latency_slo")
+        if latency_slo is None:
+            latency_slo = self.default_latency_slo
+        ## One answer at a time: sessions share the model, so later ones wait for the current answer to finish
+        with self.generation_lock:
+            try:
+                stream = self.rag.generate_stream(str(request["query"]), int(request.get("top_k", 3)), latency_slo)
+            except Exception as e:
+                self._send({"event": "error", "message": str(e)})
+                return True
+
+            try:
+                self._send({"event": "started", "sources": stream.context_parts})
+                for text in stream:
+                    self._send({"event": "token", "text": text})
+            except (BrokenPipeError, ConnectionResetError):
+                ## The client cancelled by closing its connection
+                stream.cancel()
+                return False
+            except RuntimeError as e:
+                self._send({"event": "error", "message": str(e)})
+                return True
+
+            self._send({"event": "done", "metrics": stream.metrics, "stages": stream.stages, "resources": stream.resources})
+        return True
+
+class UnixDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def create_daemon(rag, socket_path: str, default_latency_slo: Optional[float] = None) -> UnixDaemonServer:
+    """Bind the daemon's Unix socket, replacing a stale socket file but refusing to replace a live daemon"""
+    if os.path.exists(socket_path):
+        try:
+            with DaemonClient(socket_path) as client:
+                client.ping()
+            raise RuntimeError(f"A BlueStar daemon is already running on {socket_path}")
+        except ConnectionError:
+            os.remove(socket_path)
+
+    handler = type("BlueStarDaemonHandler", (DaemonHandler,), {"rag": rag, "generation_lock": threading.Lock(),
+                                                              "default_latency_slo": default_latency_slo})
+    ## Only this user may connect; the socket answers anything the model can
+    previous_umask = os.umask(0o177)
+    try:
+        return UnixDaemonServer(socket_path, handler)
+    finally:
+        os.umask(previous_umask)
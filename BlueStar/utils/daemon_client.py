@@ -0,0 +1,147 @@
+import json
+import os
+import socket
+from typing import Optional
+
+## Only the standard library is imported here, so a client session starts without loading torch or faiss
+PROTOCOL_VERSION = 1
+CONNECT_TIMEOUT = 2.0
+
+def default_socket_path() -> str:
+    """Per-user socket path in the runtime directory, falling back to the temp directory"""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+    return os.path.join(runtime_dir, f"bluestar-{os.getuid()}.sock")
+
+class IncompatibleDaemonError(RuntimeError):
+    """Something answered on the socket, but not as a daemon speaking this client's protocol"""
+
+class RemoteStream:
+    """Client side of a daemon generate call, iterated like the StreamingResponse it mirrors"""
+
+    def __init__(self, client: "DaemonClient", context_parts: list):
+        self.client = client
+        self.context_parts = context_parts
+        self.cancelled = False
+        self.metrics = {}
+        self.stages = {}
+        self.resources = {}
+
+    def __iter__(self):
+        while True:
+            event = self.client._read_event()
+            kind = event.get("event")
+            if kind == "token":
+                yield event["text"]
+            elif kind == "done":
+                self.metrics = event.get("metrics", {})
+                self.stages = event.get("stages", {})
+                self.resources = event.get("resources", {})
+                return
+            elif kind == "error":
+                raise RuntimeError(event.get("message", "Generation failed in the daemon"))
+
+    def cancel(self):
+        """Drop the connection; the daemon stops decoding when its next token cannot be sent"""
+        self.cancelled = True
+        self.client.close()
+
+class DaemonClient:
+    """Talks to a running BlueStar daemon over its Unix socket, one JSON object per line each way.
+
+    Offers the same prepare_query, generate_stream and COLUMN_WIDTH as RAGModel, so the interactive
+    session runs unchanged against either. The connection is reopened on the next call after a cancel.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None):
+        self.socket_path = socket_path or default_socket_path()
+        self._socket = None
+        self._reader = None
+        self.COLUMN_WIDTH = 76
+        self.pid = None
+
+    def connect(self) -> "DaemonClient":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise ConnectionError(f"No BlueStar daemon is listening on {self.socket_path}: {str(e)}") from e
+        ## Answers can take as long as generation does
+        sock.settimeout(None)
+        self._socket = sock
+        self._reader = sock.makefile('rb')
+        return self
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _send(self, payload: dict):
+        if self._socket is None:
+            self.connect()
+        self._socket.sendall(json.dumps(payload).encode('utf-8') + b"\n")
+
+    def _read_event(self) -> dict:
+        line = self._reader.readline() if self._reader is not None else b""
+        if not line:
+            self.close()
+            raise ConnectionError("The BlueStar daemon closed the connection")
+        try:
+            event = json.loads(line)
+        except ValueError:
+            event = None
+        if not isinstance(event, dict):
+            self.close()
+            raise IncompatibleDaemonError(f"Unexpected reply from {self.socket_path}: {line[:80]!r}")
+        return event
+
+    def _call(self, payload: dict) -> dict:
+        try:
+            self._send(payload)
+            event = self._read_event()
+        except KeyboardInterrupt:
+            ## The reply would otherwise be read as the answer to the next call, so start over on a new connection
+            self.close()
+            raise
+        if event.get("event") == "error":
+            raise RuntimeError(event.get("message", "Request failed in the daemon"))
+        return event
+
+    def ping(self) -> dict:
+        """Check the daemon answers and speaks this protocol version"""
+        try:
+            event = self._call({"op": "ping"})
+        except IncompatibleDaemonError:
+            raise
+        except RuntimeError as e:
+            ## A daemon that rejects ping predates this protocol
+            raise IncompatibleDaemonError(f"The daemon on {self.socket_path} rejected the handshake: {str(e)}") from e
+        if event.get("protocol") != PROTOCOL_VERSION:
+            raise IncompatibleDaemonError(f"The daemon on {self.socket_path} speaks protocol {event.get('protocol')}, this client speaks {PROTOCOL_VERSION}")
+        self.pid = event.get("pid")
+        self.COLUMN_WIDTH = event.get("column_width", self.COLUMN_WIDTH)
+        return event
+
+    def prepare_query(self, query: str) -> dict:
+        return self._call({"op": "prepare", "query": query})
+
+    def generate_stream(self, query: str, top_k: int = 3, latency_slo: Optional[float] = None) -> RemoteStream:
+        """Start generating in the daemon; returns once retrieval and prefill are done, like RAGModel.generate_stream"""
+        event = self._call({"op": "generate", "query": query, "top_k": top_k, "latency_slo": latency_slo})
+        return RemoteStream(self, event.get("sources", []))
+
+    def shutdown(self):
+        self._call({"op": "shutdown"})
+        self.close()
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,272 @@
+import json
+import mmap
+import os
+import numpy as np
+from typing import Iterable, List, Tuple
+
+## Store layout, every file is append-only:
+##   documents.bin  - UTF-8 text of all documents, back to back
+##   documents.idx  - uint64 byte offsets into documents.bin, one more entry than there are documents
+##   passages.idx   - int64 rows of (doc_id, char_start, char_end, byte_start, byte_end)
+##   passage_tokens.bin / passage_tokens.idx - optional int32 generator token ids of every passage, back to back,
+##                    and their uint64 offsets (one more than there are passages); passage_tokenizer.json names the tokenizer
+## Passages removed by an incremental update keep their row, with doc_id set to DELETED_DOC_ID
+## A full rebuild writes every file under STAGING_SUFFIX and moves it into place once the build is done, so processes
+## that have the previous store memory-mapped never see its files truncated
+DOCUMENTS_FILE = "documents.bin"
+DOCUMENT_OFFSETS_FILE = "documents.idx"
+PASSAGES_FILE = "passages.idx"
+PASSAGE_TOKENS_FILE = "passage_tokens.bin"
+PASSAGE_TOKEN_OFFSETS_FILE = "passage_tokens.idx"
+PASSAGE_TOKENIZER_FILE = "passage_tokenizer.json"
+PASSAGE_FIELDS = 5
+DELETED_DOC_ID = -1
+STAGING_SUFFIX = ".building"
+
+def _map_array(path: str, dtype, mode: str = 'r') -> np.ndarray:
+    """Memory-map a raw binary array, returning an empty array for empty files"""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode)
+
+STORE_FILES = (DOCUMENTS_FILE, DOCUMENT_OFFSETS_FILE, PASSAGES_FILE, PASSAGE_TOKENS_FILE, PASSAGE_TOKEN_OFFSETS_FILE)
+
+def store_file_path(store_dir: str, name: str, staged: bool = False) -> str:
+    """Path of a store file; with staged, the copy a build is still writing when there is one"""
+    path = os.path.join(store_dir, name)
+    if staged and os.path.exists(path + STAGING_SUFFIX):
+        return path + STAGING_SUFFIX
+    return path
+
+def discard_staged_files(store_dir: str):
+    """Remove the staged files of a build that will not be resumed"""
+    for name in STORE_FILES + (PASSAGE_TOKENIZER_FILE,):
+        path = os.path.join(store_dir, name) + STAGING_SUFFIX
+        if os.path.exists(path):
+            os.remove(path)
+
+def store_file_sizes(store_dir: str) -> dict:
+    """Return the byte size of each file a build is writing, used to checkpoint it"""
+    sizes = {}
+    for name in STORE_FILES:
+        path = store_file_path(store_dir, name, staged=True)
+        sizes[name] = os.path.getsize(path) if os.path.exists(path) else 0
+    return sizes
+
+def truncate_store(store_dir: str, sizes: dict):
+    """Cut the files a build is writing back to checkpointed sizes, dropping anything appended after the checkpoint"""
+    for name, size in sizes.items():
+        path = store_file_path(store_dir, name, staged=True)
+        if os.path.exists(path):
+            os.truncate(path, size)
+
+def load_passage_tokenizer(store_dir: str, staged: bool = False):
+    """Return the name and vocabulary size of the tokenizer the store's passage tokens came from, or None"""
+    path = store_file_path(store_dir, PASSAGE_TOKENIZER_FILE, staged)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+class DocStore:
+    """Read-only view of a document store, memory-mapped so only the pages that are accessed get loaded.
+
+    With staged, files a build is still writing are read in place of the ones they will replace.
+    """
+
+    def __init__(self, store_dir: str, staged: bool = False):
+        self.store_dir = store_dir
+
+        self._documents_file = open(store_file_path(store_dir, DOCUMENTS_FILE, staged), 'rb')
+        if os.fstat(self._documents_file.fileno()).st_size > 0:
+            self._blob = mmap.mmap(self._documents_file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._blob = b""
+
+        self.document_offsets = _map_array(store_file_path(store_dir, DOCUMENT_OFFSETS_FILE, staged), np.uint64)
+        self.passages = _map_array(store_file_path(store_dir, PASSAGES_FILE, staged), np.int64).reshape(-1, PASSAGE_FIELDS)
+
+        ## Stores built before passages were pre-tokenized have no token files
+        self.passage_tokenizer = load_passage_tokenizer(store_dir, staged)
+        if self.passage_tokenizer is not None:
+            self.passage_tokens = _map_array(store_file_path(store_dir, PASSAGE_TOKENS_FILE, staged), np.int32)
+            self.passage_token_offsets = _map_array(store_file_path(store_dir, PASSAGE_TOKEN_OFFSETS_FILE, staged), np.uint64)
+
+    @property
+    def num_documents(self) -> int:
+        return max(len(self.document_offsets) - 1, 0)
+
+    @property
+    def num_passages(self) -> int:
+        return len(self.passages)
+
+    def get_document(self, doc_id: int) -> str:
+        """Return the full text of a document"""
+        start, end = int(self.document_offsets[doc_id]), int(self.document_offsets[doc_id + 1])
+        return self._blob[start:end].decode('utf-8')
+
+    def get_passage(self, passage_id: int) -> str:
+        """Return the text of a passage without decoding the rest of its document"""
+        _, _, _, byte_start, byte_end = self.passages[passage_id]
+        return self._blob[int(byte_start):int(byte_end)].decode('utf-8')
+
+    @property
+    def has_tokens(self) -> bool:
+        return self.passage_tokenizer is not None and len(self.passage_token_offsets) == self.num_passages + 1
+
+    def get_passage_tokens(self, passage_id: int) -> np.ndarray:
+        """Return a passage's generator token ids as a read-only view of the memory-mapped array"""
+        start, end = int(self.passage_token_offsets[passage_id]), int(self.passage_token_offsets[passage_id + 1])
+        return self.passage_tokens[start:end]
+
+    def get_passage_info(self, passage_id: int) -> dict:
+        """Return the doc id and character offsets of a passage"""
+        doc_id, char_start, char_end, _, _ = self.passages[passage_id]
+        return {"doc_id": int(doc_id), "start": int(char_start), "end": int(char_end)}
+
+    def is_deleted(self, passage_id: int) -> bool:
+        return int(self.passages[passage_id][0]) == DELETED_DOC_ID
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._documents_file.close()
+
+class DocStoreWriter:
+    """Appends documents and their passages to a document store.
+
+    Given a tokenizer, the writer also stores each passage's token ids so generation can assemble prompts
+    without tokenizing passage text per request.
+
+    Files that are rewritten rather than appended to, which is all of them without append, are written as staged
+    copies and only replace the originals in close(). Appending picks up the staged copies of an interrupted rebuild.
+    """
+
+    def __init__(self, store_dir: str, append: bool = False, tokenizer=None, tokenizer_name: str = None):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.append = append
+        self._staged = []
+
+        ## Appending to a store whose passages were not tokenized, or were tokenized by another tokenizer, retokenizes them first
+        tokenizer_info = None
+        backfill = False
+        if tokenizer is not None:
+            tokenizer_info = {"name": tokenizer_name or getattr(tokenizer, "name_or_path", None), "vocab_size": len(tokenizer)}
+            backfill = append and load_passage_tokenizer(store_dir, staged=True) != tokenizer_info
+
+        self._documents_file = self._open(DOCUMENTS_FILE, rewrite=not append)
+        self._offsets_file = self._open(DOCUMENT_OFFSETS_FILE, rewrite=not append)
+        self._passages_file = self._open(PASSAGES_FILE, rewrite=not append)
+        self._files = [self._documents_file, self._offsets_file, self._passages_file]
+
+        self.tokenizer = tokenizer
+        if tokenizer is not None:
+            self._tokens_file = self._open(PASSAGE_TOKENS_FILE, rewrite=backfill or not append)
+            self._token_offsets_file = self._open(PASSAGE_TOKEN_OFFSETS_FILE, rewrite=backfill or not append)
+            self._files += [self._tokens_file, self._token_offsets_file]
+            self._token_offset = self._tokens_file.tell() // 4
+            if self._token_offsets_file.tell() == 0:
+                self._token_offsets_file.write(np.array([0], dtype=np.uint64).tobytes())
+            with self._open(PASSAGE_TOKENIZER_FILE, rewrite=True, binary=False) as f:
+                json.dump(tokenizer_info, f, indent=2)
+
+        self._byte_offset = self._documents_file.tell()
+        self.num_documents = max(self._offsets_file.tell() // 8 - 1, 0)
+        self.num_passages = self._passages_file.tell() // (8 * PASSAGE_FIELDS)
+
+        ## A fresh store starts with the leading zero offset
+        if self._offsets_file.tell() == 0:
+            self._offsets_file.write(np.array([0], dtype=np.uint64).tobytes())
+
+        if backfill and self.num_passages:
+            self._backfill_tokens()
+
+    def _open(self, name: str, rewrite: bool, binary: bool = True):
+        """Open a store file for writing: a fresh staged copy when rewriting, otherwise whichever copy is being appended to"""
+        path = os.path.join(self.store_dir, name)
+        if rewrite or os.path.exists(path + STAGING_SUFFIX):
+            if path not in self._staged:
+                self._staged.append(path)
+            path += STAGING_SUFFIX
+        return open(path, ('w' if rewrite else 'a') + ('b' if binary else ''))
+
+    def _write_tokens(self, passages: List[str]):
+        """Tokenize passages in one batch and append their ids and offsets"""
+        if not passages:
+            return
+        token_ids = self.tokenizer(passages, add_special_tokens=False, verbose=False)["input_ids"]
+        lengths = np.fromiter((len(ids) for ids in token_ids), dtype=np.uint64, count=len(token_ids))
+        self._tokens_file.write(np.fromiter((token for ids in token_ids for token in ids), dtype=np.int32, count=int(lengths.sum())).tobytes())
+        self._token_offsets_file.write((self._token_offset + np.cumsum(lengths)).astype(np.uint64).tobytes())
+        self._token_offset += int(lengths.sum())
+
+    def _backfill_tokens(self, batch_size: int = 1024):
+        self._documents_file.flush()
+        self._passages_file.flush()
+        store = DocStore(self.store_dir, staged=True)
+        for start in range(0, store.num_passages, batch_size):
+            self._write_tokens([store.get_passage(pid) for pid in range(start, min(start + batch_size, store.num_passages))])
+        store.close()
+
+    def add_document(self, text: str, spans: Iterable[Tuple[int, int]]) -> Tuple[int, List[int]]:
+        """Append a document with its (char_start, char_end) passage spans, returning the new doc id and passage ids"""
+        doc_id = self.num_documents
+        encoded = text.encode('utf-8')
+
+        rows = []
+        for char_start, char_end in spans:
+            byte_start = self._byte_offset + len(text[:char_start].encode('utf-8'))
+            byte_end = byte_start + len(text[char_start:char_end].encode('utf-8'))
+            rows.append((doc_id, char_start, char_end, byte_start, byte_end))
+
+        self._documents_file.write(encoded)
+        self._byte_offset += len(encoded)
+        self._offsets_file.write(np.array([self._byte_offset], dtype=np.uint64).tobytes())
+        if rows:
+            self._passages_file.write(np.array(rows, dtype=np.int64).tobytes())
+        if self.tokenizer is not None:
+            self._write_tokens([text[int(row[1]):int(row[2])] for row in rows])
+
+        passage_ids = list(range(self.num_passages, self.num_passages + len(rows)))
+        self.num_documents += 1
+        self.num_passages += len(rows)
+        return doc_id, passage_ids
+
+    def flush(self):
+        """Flush and fsync the store files so their sizes can be checkpointed"""
+        for f in self._files:
+            f.flush()
+            os.fsync(f.fileno())
+
+    def delete_passages(self, passage_ids: Iterable[int]):
+        """Mark passages as deleted in place; their text stays in the blob until the next full rebuild"""
+        passage_ids = np.asarray(list(passage_ids), dtype=np.int64)
+        if len(passage_ids) == 0:
+            return
+        self._passages_file.flush()
+        passages = np.memmap(store_file_path(self.store_dir, PASSAGES_FILE, staged=True), dtype=np.int64, mode='r+').reshape(-1, PASSAGE_FIELDS)
+        passages[passage_ids, 0] = DELETED_DOC_ID
+        passages.flush()
+        del passages
+
+    def close(self):
+        """Close the files and move the staged copies over the originals"""
+        for f in self._files:
+            f.close()
+        for path in self._staged:
+            os.replace(path + STAGING_SUFFIX, path)
+        ## A rebuild without a tokenizer would leave the previous build's tokens behind
+        if self.tokenizer is None and not self.append and os.path.exists(os.path.join(self.store_dir, PASSAGE_TOKENIZER_FILE)):
+            os.remove(os.path.join(self.store_dir, PASSAGE_TOKENIZER_FILE))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            ## Leave the staged copies for a resumed build instead of publishing a partial store
+            for f in self._files:
+                f.close()
@@ -0,0 +1,67 @@
+import json
+import os
+import numpy as np
+from typing import List
+
+ENCODER_FILE = "encoder.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+ENCODER_CONFIG_FILE = "encoder_config.json"
+
+class OnnxQueryEncoder:
+    """Sentence encoder running an int8 ONNX export through ONNX Runtime with a Rust fast tokenizer.
+
+    Mean pooling and normalization are part of the exported graph, so this only imports onnxruntime,
+    tokenizers and numpy, never torch or sentence-transformers.
+    """
+
+    def __init__(self, model_dir: str, num_threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ENCODER_CONFIG_FILE), 'r') as f:
+            self.config = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, ENCODER_FILE), options, providers=["CPUExecutionProvider"])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def encode(self, sentences: List[str], batch_size: int = 32, convert_to_numpy: bool = True, **kwargs) -> np.ndarray:
+        """Embed sentences, matching SentenceTransformer.encode's return shape for the arguments the retriever uses"""
+        if isinstance(sentences, str):
+            sentences = [sentences]
+
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            encodings = self.tokenizer.encode_batch(sentences[start:start + batch_size])
+            feeds = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            }
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+            outputs.append(self.session.run(["sentence_embedding"], feeds)[0])
+
+        if not outputs:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.concatenate(outputs).astype(np.float32)
+
+def load_encoder(backend: str = 'torch', model_name: str = 'all-MiniLM-L6-v2', encoder_path: str = None, num_threads: int = 0):
+    """Load the query encoder for a backend, importing sentence-transformers only when it is actually used"""
+    if backend == 'onnx':
+        if encoder_path is None or not os.path.exists(os.path.join(encoder_path, ENCODER_FILE)):
+            raise FileNotFoundError(f"No ONNX encoder found at {encoder_path}, run scripts/export_encoder.py first")
+        return OnnxQueryEncoder(encoder_path, num_threads)
+    if backend == 'torch':
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name)
+    raise ValueError(f"Unknown encoder backend '{backend}', expected 'torch' or 'onnx'")
@@ -3,14 +3,71 @@ from typing import Dict, List
 import numpy as np
 from tqdm import tqdm
 import json
+import hashlib
+import multiprocessing
 import time
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from BlueStar.utils.model_benchmark import sequence_nlls
+
+## Longest text scored in one forward pass; longer texts use the sliding window of calculate_perplexity
+PERPLEXITY_MAX_LENGTH = 512
+
+## Each pool worker loads its own copy of the model once, in _init_worker
+_worker_evaluator = None
+
+def _init_worker(model_path: str, num_threads: int):
+    global _worker_evaluator
+    from transformers import AutoTokenizer
+    from BlueStar.utils.generation import load_causal_lm
+    _worker_evaluator = ModelEvaluator(load_causal_lm(model_path, num_threads=num_threads), AutoTokenizer.from_pretrained(model_path), model_path=model_path)
+
+def _evaluate_shard(items: list, batch_size: int, speed_runs: int) -> list:
+    return _worker_evaluator.evaluate_items(items, batch_size, speed_runs)
+
+def model_fingerprint(model_path: str) -> str:
+    """Identify a model by its directory and the size and modification time of each file in it.
+
+    Re-quantizing rewrites the checkpoint files, so a model evaluated before and after gets different fingerprints.
+    """
+    path = os.path.abspath(model_path)
+    if not os.path.isdir(path):
+        return path
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(path)):
+        file_path = os.path.join(path, name)
+        if os.path.isfile(file_path):
+            stat = os.stat(file_path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}\n".encode('utf-8'))
+    return f"{path}@{digest.hexdigest()[:16]}"
+
+def load_checkpoint(checkpoint_path: str, queries: List[str], model: str = None) -> Dict[int, dict]:
+    """Finished items from a JSONL checkpoint, keyed by test-set index.
+
+    Records for a different query at that index, or written for a model with a different fingerprint, are ignored.
+    """
+    done = {}
+    if not checkpoint_path or not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                ## A line cut short by a crash; that item is simply evaluated again
+                continue
+            index = record.get("index")
+            if isinstance(index, int) and index < len(queries) and record.get("query") == queries[index] and record.get("model") == model:
+                done[index] = record
+    return done
 
 class ModelEvaluator:
-    def __init__(self, model, tokenizer, retriever=None):
+    def __init__(self, model, tokenizer, retriever=None, model_path: str = None):
         self.model = model
         self.tokenizer = tokenizer
         self.retriever = retriever
+        ## Needed to load the model in worker processes when evaluating with num_workers > 1
+        self.model_path = model_path
         
     def calculate_perplexity(self, text: str) -> float:
         """Calculate perplexity score for given text"""
@@ -46,21 +103,42 @@ class ModelEvaluator:
             print(f"[ERROR] [evaluation.py] Error calculating perplexity: {e}")
             return float('inf')
     
-    def evaluate_speed(self, text: str, num_runs: int = 3) -> Dict[str, float]:
-        """Measure inference speed"""
+    def calculate_perplexity_batch(self, texts: List[str], batch_size: int = 8) -> List[float]:
+        """Perplexity of each text, scoring texts that fit in one window in padded batches"""
+        try:
+            lengths = [len(ids) for ids in self.tokenizer(texts)["input_ids"]]
+            short = [idx for idx, length in enumerate(lengths) if length <= PERPLEXITY_MAX_LENGTH]
+            perplexities = [float('inf')] * len(texts)
+            for idx, (nll, count) in zip(short, sequence_nlls(self.model, self.tokenizer, [texts[idx] for idx in short], PERPLEXITY_MAX_LENGTH, batch_size)):
+                if count > 0:
+                    perplexities[idx] = float(np.exp(nll / count))
+            for idx, length in enumerate(lengths):
+                if length > PERPLEXITY_MAX_LENGTH:
+                    perplexities[idx] = self.calculate_perplexity(texts[idx])
+            return perplexities
+
+        except Exception as e:
+            print(f"[ERROR] [evaluation.py] Error calculating batch perplexity: {e}")
+            return [float('inf')] * len(texts)
+
+    def evaluate_speed(self, text: str, num_runs: int = 3, max_new_tokens: int = 50) -> Dict[str, float]:
+        """Measure inference speed of a fixed number of new tokens after one untimed warmup run.
+
+        Only the raw model is timed here; scripts/benchmark_latency.py measures the full generate_response path.
+        """
         try:
             encodings = self.tokenizer(text, return_tensors="pt")
             times = []
+            ## min_new_tokens keeps every run the same length so runs are comparable across prompts
+            options = dict(max_new_tokens=max_new_tokens, min_new_tokens=max_new_tokens, do_sample=False,
+                           num_return_sequences=1, pad_token_id=self.tokenizer.eos_token_id)
             
-            for _ in range(num_runs):
-                start_time = time.time()
+            for run in range(num_runs + 1):
+                start_time = time.perf_counter()
                 with torch.no_grad():
-                    self.model.generate(
-                        encodings.input_ids,
-                        max_length=100,
-                        num_return_sequences=1
-                    )
-                times.append(time.time() - start_time)
+                    self.model.generate(encodings.input_ids, attention_mask=encodings.attention_mask, **options)
+                if run > 0:
+                    times.append(time.perf_counter() - start_time)
             
             return {
                 "avg_inference_time": np.mean(times),
@@ -103,28 +181,90 @@ class ModelEvaluator:
             print(f"[ERROR] [evaluation.py] Error evaluating retrieval: {e}")
             return {}
     
-    def run_full_evaluation(self, test_set_path: str, output_path: str = None):
-        """Run comprehensive evaluation and save results"""
+    def evaluate_items(self, items: list, batch_size: int = 8, speed_runs: int = 3) -> list:
+        """Perplexity and, with speed_runs > 0, mean generation time for (index, query) items"""
+        perplexities = self.calculate_perplexity_batch([query for _, query in items], batch_size)
+        records = []
+        for (index, query), perplexity in zip(items, perplexities):
+            inference_time = self.evaluate_speed(query, speed_runs)["avg_inference_time"] if speed_runs > 0 else None
+            records.append({"index": index, "query": query, "perplexity": perplexity, "inference_time": inference_time})
+        return records
+
+    def run_full_evaluation(self, test_set_path: str, output_path: str = None, batch_size: int = 8, num_workers: int = 1,
+                            checkpoint_path: str = None, speed_runs: int = 3):
+        """Run comprehensive evaluation and save results.
+
+        The test set is split into shards of batch_size queries, evaluated here or across num_workers processes
+        that each load the model from model_path. Every finished item is appended to a JSONL checkpoint
+        (next to output_path by default), and items already in it are skipped, so an interrupted run resumes.
+        Items are tagged with the model's fingerprint and only reused for the same model files; the checkpoint is
+        removed once the results are written.
+        Generation times measured by parallel workers share the CPU and read higher than a single process would.
+        """
         results = {
             "perplexity": [],
             "speed": {"inference_times": []},
             "memory": self.evaluate_memory(),
             "retrieval": {}
         }
+        if checkpoint_path is None and output_path:
+            checkpoint_path = os.path.splitext(output_path)[0] + ".checkpoint.jsonl"
         
         try:
             with open(test_set_path, 'r', encoding='utf-8') as f:
                 test_queries = [line.strip() for line in f if line.strip()]
-            
-            for query in tqdm(test_queries, desc="Evaluating queries"):
-                results["perplexity"].append(self.calculate_perplexity(query))
-                speed_metrics = self.evaluate_speed(query)
-                results["speed"]["inference_times"].append(speed_metrics["avg_inference_time"])
+
+            model_path = self.model_path or getattr(self.model, "name_or_path", None)
+            model = model_fingerprint(model_path) if model_path else None
+            done = load_checkpoint(checkpoint_path, test_queries, model)
+            pending = [(index, query) for index, query in enumerate(test_queries) if index not in done]
+            shards = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+            if done:
+                print(f"[INFO] [evaluation.py] Resuming from {checkpoint_path}: {len(done)} of {len(test_queries)} queries already evaluated")
+
+            checkpoint = None
+            if checkpoint_path:
+                os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+                ## Nothing reusable means the file only holds records of another model or test set, so it starts over
+                checkpoint = open(checkpoint_path, 'a' if done else 'w', encoding='utf-8')
+            try:
+                with tqdm(total=len(pending), desc="Evaluating queries") as progress:
+                    def record(records: list):
+                        for item in records:
+                            item["model"] = model
+                            done[item["index"]] = item
+                            if checkpoint is not None:
+                                checkpoint.write(json.dumps(item) + "\n")
+                        if checkpoint is not None:
+                            checkpoint.flush()
+                        progress.update(len(records))
+
+                    if num_workers > 1 and shards:
+                        if self.model_path is None:
+                            raise ValueError("model_path is required to evaluate with more than one worker")
+                        ## Workers split the cores instead of each starting a thread per core
+                        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+                        context = multiprocessing.get_context("spawn")
+                        with ProcessPoolExecutor(num_workers, mp_context=context, initializer=_init_worker, initargs=(self.model_path, num_threads)) as pool:
+                            futures = [pool.submit(_evaluate_shard, shard, batch_size, speed_runs) for shard in shards]
+                            for future in as_completed(futures):
+                                record(future.result())
+                    else:
+                        for shard in shards:
+                            record(self.evaluate_items(shard, batch_size, speed_runs))
+            finally:
+                if checkpoint is not None:
+                    checkpoint.close()
+
+            items = [done[index] for index in range(len(test_queries))]
+            results["perplexity"] = [item["perplexity"] for item in items]
+            results["speed"]["inference_times"] = [item["inference_time"] for item in items if item["inference_time"] is not None]
             
             results["perplexity_avg"] = np.mean(results["perplexity"])
             results["perplexity_std"] = np.std(results["perplexity"])
-            results["speed"]["avg_inference_time"] = np.mean(results["speed"]["inference_times"])
-            results["speed"]["std_inference_time"] = np.std(results["speed"]["inference_times"])
+            if results["speed"]["inference_times"]:
+                results["speed"]["avg_inference_time"] = np.mean(results["speed"]["inference_times"])
+                results["speed"]["std_inference_time"] = np.std(results["speed"]["inference_times"])
             
             if self.retriever:
                 results["retrieval"] = self.evaluate_retrieval(test_queries)
@@ -133,6 +273,9 @@ class ModelEvaluator:
                 os.makedirs(os.path.dirname(output_path), exist_ok=True)
                 with open(output_path, 'w') as f:
                     json.dump(results, f, indent=2)
+                ## The results now hold every item, and a stale checkpoint would be reused by the next run of this model
+                if checkpoint_path and os.path.exists(checkpoint_path):
+                    os.remove(checkpoint_path)
             
             return results
             
@@ -141,17 +284,18 @@ class ModelEvaluator:
             return results
 
 if __name__ == "__main__":
-    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from transformers import AutoTokenizer
+    from BlueStar.utils.generation import load_causal_lm
     
     script_dir = os.path.dirname(os.path.abspath(__file__))
     MODEL_PATH = os.path.join(script_dir, "..", "models", "quantized-gpt2-large")
     TEST_SET = os.path.join(script_dir, "..", "data", "test_set.txt")
     RESULTS_PATH = os.path.join(script_dir, "..", "data", "evaluation_results.json")
     
-    model = AutoModelForCausalLM.from_pretrained(MODEL_PATH)
+    model = load_causal_lm(MODEL_PATH)
     tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
     
-    evaluator = ModelEvaluator(model, tokenizer)
+    evaluator = ModelEvaluator(model, tokenizer, model_path=MODEL_PATH)
     
     results = evaluator.run_full_evaluation(TEST_SET, RESULTS_PATH)
     print("\n[INFO] [evaluation.py] Evaluation Results:")
@@ -0,0 +1,162 @@
+import faiss
+import json
+import math
+import os
+import numpy as np
+from typing import Optional
+
+## Supported index types and the faiss.index_factory string each one builds
+INDEX_TYPES = {
+    "flat": "Flat",
+    "ivf-flat": "IVF{nlist},Flat",
+    "ivf-pq": "IVF{nlist},PQ{pq_m}",
+    "hnsw": "HNSW{hnsw_m}",
+}
+
+DEFAULT_PQ_M = 48
+DEFAULT_HNSW_M = 32
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+## FAISS wants roughly 39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+def default_nlist(num_vectors: int) -> int:
+    """Pick an IVF list count of about 4 * sqrt(N), capped so every centroid gets enough training points"""
+    nlist = int(4 * math.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // MIN_POINTS_PER_CENTROID))
+
+def index_metadata_path(index_path: str) -> str:
+    """Return the path of the JSON metadata stored next to an index"""
+    return os.path.splitext(index_path)[0] + ".json"
+
+## HNSW graphs cannot drop vectors, so updates that remove passages need a full rebuild
+REMOVABLE_INDEX_TYPES = {"flat", "ivf-flat", "ivf-pq"}
+## Index types that must be trained on a sample before vectors can be added
+TRAINED_INDEX_TYPES = {"ivf-flat", "ivf-pq"}
+## IVF lists store the ids they are given, so these index types are not wrapped in an IndexIDMap2
+NATIVE_ID_INDEX_TYPES = {"ivf-flat", "ivf-pq"}
+
+def create_index(dimension: int, index_type: str = "flat", nlist: int = 1, pq_m: int = DEFAULT_PQ_M, hnsw_m: int = DEFAULT_HNSW_M):
+    """Create an empty index of the given type along with its metadata.
+
+    Search results are passage ids, which stay stable across incremental updates. Flat and HNSW indexes are wrapped
+    in an IndexIDMap2 for this; IVF indexes keep the ids in their inverted lists. Wrapping an IVF index would break
+    removal, because IndexIDMap compacts its id map while the lists keep the old sequential labels.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {list(INDEX_TYPES)}")
+
+    factory = INDEX_TYPES[index_type].format(nlist=nlist, pq_m=pq_m, hnsw_m=hnsw_m)
+    index = faiss.index_factory(dimension, factory, faiss.METRIC_L2)
+    if index_type not in NATIVE_ID_INDEX_TYPES:
+        index = faiss.IndexIDMap2(index)
+
+    params = {"nlist": nlist, "pq_m": pq_m, "hnsw_m": hnsw_m}
+    metadata = {
+        "index_type": index_type,
+        "factory": factory,
+        "dimension": dimension,
+        "metric": "l2",
+        "ntotal": 0,
+        "version": 1,
+        "build_params": {k: v for k, v in params.items() if "{" + k + "}" in INDEX_TYPES[index_type]},
+        "search_params": default_search_params(index_type),
+    }
+    return index, metadata
+
+def train_index(index, embeddings: np.ndarray, train_size: int = 100000, seed: int = 1234):
+    """Train an index on a random sample of at most train_size embeddings, if its type needs training"""
+    if index.is_trained:
+        return
+    sample = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if len(sample) > train_size:
+        rng = np.random.default_rng(seed)
+        sample = sample[np.sort(rng.choice(len(sample), train_size, replace=False))]
+    index.train(sample)
+
+def build_index(embeddings: np.ndarray, index_type: str = "flat", ids: Optional[np.ndarray] = None, nlist: Optional[int] = None,
+                pq_m: int = DEFAULT_PQ_M, hnsw_m: int = DEFAULT_HNSW_M, train_size: int = 100000, seed: int = 1234):
+    """Build a FAISS index of the given type in one go, training it on a random sample of the embeddings when required"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    num_vectors, dimension = embeddings.shape
+    if nlist is None:
+        nlist = default_nlist(num_vectors)
+
+    index, metadata = create_index(dimension, index_type, nlist, pq_m, hnsw_m)
+    train_index(index, embeddings, train_size, seed)
+    add_embeddings(index, embeddings, np.arange(num_vectors, dtype=np.int64) if ids is None else ids)
+    metadata["ntotal"] = int(index.ntotal)
+    return index, metadata
+
+def can_remove_ids(index, index_type: str) -> bool:
+    """Whether passages can be removed from an index in place.
+
+    IVF indexes written before they stopped being wrapped in an IndexIDMap2 cannot, and need a full rebuild.
+    """
+    if index_type not in REMOVABLE_INDEX_TYPES:
+        return False
+    return not (index_type in NATIVE_ID_INDEX_TYPES and isinstance(index, faiss.IndexIDMap))
+
+def add_embeddings(index, embeddings: np.ndarray, ids: np.ndarray):
+    """Add embeddings to an index under the given passage ids"""
+    index.add_with_ids(np.ascontiguousarray(embeddings, dtype=np.float32), np.ascontiguousarray(ids, dtype=np.int64))
+
+def remove_ids(index, ids) -> int:
+    """Remove passage ids from an index, returning how many vectors were dropped"""
+    if len(ids) == 0:
+        return 0
+    return index.remove_ids(np.ascontiguousarray(ids, dtype=np.int64))
+
+def default_search_params(index_type: str) -> dict:
+    """Return the runtime search knobs that apply to an index type"""
+    if index_type.startswith("ivf"):
+        return {"nprobe": DEFAULT_NPROBE}
+    if index_type == "hnsw":
+        return {"efSearch": DEFAULT_EF_SEARCH}
+    return {}
+
+def save_index(index, index_path: str, metadata: dict):
+    """Write an index and its metadata, replacing the old files only once the new ones are complete"""
+    faiss.write_index(index, index_path + ".tmp")
+    os.replace(index_path + ".tmp", index_path)
+
+    metadata_path = index_metadata_path(index_path)
+    with open(metadata_path + ".tmp", 'w') as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(metadata_path + ".tmp", metadata_path)
+
+def load_index_metadata(index_path: str) -> dict:
+    """Load the metadata of an index, treating indexes built before metadata existed as flat"""
+    path = index_metadata_path(index_path)
+    if not os.path.exists(path):
+        return {"index_type": "flat", "factory": "Flat", "search_params": {}}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def mmap_flags(index_type: str) -> int:
+    """Return the read flags that memory-map an index of the given type.
+
+    IVF inverted lists are mapped by the on-disk lists hook, which rejects IO_FLAG_MMAP_IFC, while flat and HNSW
+    storage is only mapped through IO_FLAG_MMAP_IFC.
+    """
+    if index_type in NATIVE_ID_INDEX_TYPES:
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+def read_index(index_path: str, index_type: Optional[str] = None):
+    """Read a FAISS index memory-mapped and read-only, taking the index type from its metadata unless given"""
+    if index_type is None:
+        index_type = load_index_metadata(index_path)["index_type"]
+    return faiss.read_index(index_path, mmap_flags(index_type))
+
+def set_search_params(index, params: dict):
+    """Apply runtime search knobs such as nprobe or efSearch, ignoring the ones the index does not have"""
+    parameter_space = faiss.ParameterSpace()
+    for name, value in params.items():
+        if value is None:
+            continue
+        try:
+            parameter_space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            print(f"[WARNING] [faiss_index.py] Index does not support search parameter '{name}', ignoring it")
@@ -1,40 +1,263 @@
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+from transformers import AutoModelForCausalLM, AutoTokenizer, StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+import contextvars
+import re
 import textwrap
+import threading
+import time
+import torch
+from BlueStar.utils.guardrails import DEFAULT_RULES_PATH, Guardrails
+from BlueStar.utils.metrics import ResourceSampler
+from BlueStar.utils.kv_cache import PromptKVCache, cache_length, to_model_cache
+from BlueStar.utils.ort_generation import load_ort_model
+from BlueStar.utils.quantized_checkpoint import is_quantized_checkpoint, load_quantized_model
 from BlueStar.utils.retrieval import Retriever
+from BlueStar.utils.speculative import SpeculativeDecoder
+from BlueStar.utils.tracing import NOOP_TRACE, current_trace, span, tracer, use_trace
+
+## The prompt is assembled from these pieces so the static prefix and each passage can be prefilled separately
+PROMPT_PREFIX = "Using the following reference information:\n"
+PROMPT_QUESTION = "\nQuestion: {query}\nPlease provide a clear, focused answer that directly addresses the question:"
+
+## GPT-2's BPE splits before " <query>" and before "\n", so tokenizing the template around the query once gives the same ids
+PROMPT_QUESTION_HEAD, PROMPT_QUESTION_TAIL = PROMPT_QUESTION.split(" {query}")
+
+## Once this fraction of the token budget is used, generation stops at the next sentence end instead of mid-sentence
+SENTENCE_STOP_FRACTION = 0.6
+## A word followed by terminal punctuation and optional closing quotes or brackets; digits before "." (3.5) do not count
+SENTENCE_END = re.compile(r"[A-Za-z)\]][.!?][\"')\]]*\s*$")
+## Token budgets for a latency SLO are sized to this share of the time left, leaving room for estimate error
+SLO_SAFETY_FACTOR = 0.9
+## Stop reasons that mean the answer was cut off by its token or time budget rather than finished
+TRUNCATED_STOP_REASONS = ("deadline", "max_new_tokens")
+
+def load_causal_lm(model_path: str, backend: str = 'torch', device: str = 'cpu', num_threads: int = None):
+    """Load the generator for a backend: the PyTorch dynamic-quant checkpoint, or the int8 ONNX export run by ONNX Runtime"""
+    if backend == 'onnx':
+        print("[INFO] [generation.py] Loading ONNX Runtime model...")
+        return load_ort_model(model_path, num_threads)
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if is_quantized_checkpoint(model_path):
+        print("[INFO] [generation.py] Loading quantized model...")
+        return load_quantized_model(model_path)
+
+    print("[INFO] [generation.py] Loading model...")
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path,
+        device_map=device,
+        low_cpu_mem_usage=True
+    )
+    model.eval()
+    return model
+
+class CancelCriteria(StoppingCriteria):
+    """Stops generation at the next decoding step once the event is set"""
+
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
+class DeadlineCriteria(StoppingCriteria):
+    """Stops generation once a time.perf_counter() deadline has passed"""
+
+    def __init__(self, deadline: float):
+        self.deadline = deadline
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if time.perf_counter() >= self.deadline:
+            self.triggered = True
+        return self.triggered
+
+class SentenceBoundaryCriteria(StoppingCriteria):
+    """Stops at the first sentence end after min_new_tokens, so budgeted answers end on a complete sentence"""
+
+    def __init__(self, tokenizer, prompt_length: int, min_new_tokens: int):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.min_new_tokens = min_new_tokens
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        if input_ids.shape[1] - self.prompt_length >= max(self.min_new_tokens, 1):
+            ## Two tokens are enough to see the word before the punctuation
+            tail = self.tokenizer.decode(input_ids[0, -2:], skip_special_tokens=True)
+            if SENTENCE_END.search(tail):
+                self.triggered = True
+        return self.triggered
+
+class RepetitionCriteria(StoppingCriteria):
+    """Stops when the response repeats an n-gram it has already produced, which is how GPT-2 falls into loops"""
+
+    def __init__(self, prompt_length: int, ngram_size: int = 6):
+        self.prompt_length = prompt_length
+        self.ngram_size = ngram_size
+        self.seen = set()
+        self.next_end = ngram_size
+        self.triggered = False
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        tokens = input_ids[0, self.prompt_length:].tolist()
+        ## Speculative decoding can add several tokens per step, so every n-gram ending since the last call is checked
+        while not self.triggered and self.next_end <= len(tokens):
+            ngram = tuple(tokens[self.next_end - self.ngram_size:self.next_end])
+            if ngram in self.seen:
+                self.triggered = True
+            self.seen.add(ngram)
+            self.next_end += 1
+        return self.triggered
+
+class StepTimer(StoppingCriteria):
+    """Records when the first and latest decoding steps finished, without ever stopping generation"""
+
+    def __init__(self):
+        self.first = None
+        self.last = None
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        step = (time.perf_counter(), input_ids.shape[1])
+        if self.first is None:
+            self.first = step
+        self.last = step
+        return False
+
+class LatencyModel:
+    """Exponentially weighted prefill and decode time per token, used to size token budgets for a latency SLO.
+
+    The defaults are rough figures for GPT-2 Large on a laptop CPU and are replaced by measurements after the first answers.
+    """
+
+    def __init__(self, prefill_seconds_per_token: float = 0.005, decode_seconds_per_token: float = 0.1, alpha: float = 0.3):
+        self.prefill_seconds_per_token = prefill_seconds_per_token
+        self.decode_seconds_per_token = decode_seconds_per_token
+        self.alpha = alpha
+        self._lock = threading.Lock()
+
+    def update(self, prefill_tokens: int, prefill_time: float, decode_tokens: int, decode_time: float):
+        with self._lock:
+            if prefill_tokens > 0:
+                self.prefill_seconds_per_token += self.alpha * (prefill_time / prefill_tokens - self.prefill_seconds_per_token)
+            if decode_tokens > 0:
+                self.decode_seconds_per_token += self.alpha * (decode_time / decode_tokens - self.decode_seconds_per_token)
+
+    def token_budget(self, time_left: float, prefill_tokens: int) -> int:
+        """Return how many tokens can be decoded in time_left after prefilling prefill_tokens"""
+        with self._lock:
+            decode_time = time_left * SLO_SAFETY_FACTOR - prefill_tokens * self.prefill_seconds_per_token
+            return int(decode_time / self.decode_seconds_per_token)
+
+class StreamingResponse:
+    """Iterates over response text as it is decoded on a background thread"""
+
+    def __init__(self, streamer: TextIteratorStreamer, context_parts: list, trace=NOOP_TRACE, sampler: ResourceSampler = None):
+        self.streamer = streamer
+        self.context_parts = context_parts
+        self.trace = trace
+        self.sampler = sampler
+        self.resources = {}
+        self.cancel_event = threading.Event()
+        self.cancelled = False
+        self.error = None
+        self.metrics = {}
+        self._thread = None
+
+    def start(self, target, **kwargs):
+        def run():
+            try:
+                _, self.metrics = target(**kwargs)
+            except Exception as e:
+                ## generate() only ends the stream when it finishes, so end it here or the reader waits forever
+                self.error = e
+                self.streamer.end()
+            finally:
+                if self.sampler is not None:
+                    self.resources = self.sampler.stop()
+                self.trace.finish(str(self.error) if self.error is not None else None)
+
+        ## The copied context carries the request's trace onto the generation thread
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        for text in self.streamer:
+            yield text
+        self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(str(self.error)) from self.error
+
+    @property
+    def stages(self) -> dict:
+        """Seconds per traced stage, empty when tracing is off"""
+        return self.trace.stage_durations()
+
+    def cancel(self):
+        """Stop decoding after the current token and wait for the generation thread to exit"""
+        self.cancelled = True
+        self.cancel_event.set()
+        if self._thread is not None:
+            self._thread.join()
 
 class RAGModel:
-    def __init__(self, model_path: str, retriever: Retriever, device: str = 'cpu'):
+    def __init__(self, model_path: str, retriever: Retriever, device: str = 'cpu', kv_cache_size: int = 8,
+                 backend: str = 'torch', num_threads: int = None, draft_model: str = None, num_draft_tokens: int = 4,
+                 guardrails_path: str = DEFAULT_RULES_PATH, sample_interval_ms: float = 50.0):
         try:
+            if backend not in ('torch', 'onnx'):
+                raise ValueError(f"Unknown generation backend '{backend}', expected 'torch' or 'onnx'")
+            self.backend = backend
+
             print(f"[INFO] [generation.py] Loading model from {model_path}...")
             
             self.tokenizer = AutoTokenizer.from_pretrained(model_path)
             self.tokenizer.pad_token = self.tokenizer.eos_token
+
+            ## Constant prompt pieces are tokenized once; per request only the query itself is encoded
+            self.prefix_ids = self.tokenizer.encode(PROMPT_PREFIX)
+            self.newline_ids = self.tokenizer.encode("\n")
+            self.question_head_ids = self.tokenizer.encode(PROMPT_QUESTION_HEAD)
+            self.question_tail_ids = self.tokenizer.encode(PROMPT_QUESTION_TAIL)
             
-            print("[INFO] [generation.py] Loading quantized model...")
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                device_map=device,
-                low_cpu_mem_usage=True
-            )
-            
-            self.pipeline = pipeline(
-                "text-generation",
-                model=self.model,
-                tokenizer=self.tokenizer,
-                temperature=0.7,
+            self.model = load_causal_lm(model_path, backend, device, num_threads)
+
+            self.generation_kwargs = dict(
                 do_sample=True,
-                repetition_penalty=1.2,
-                return_full_text=False,
                 max_new_tokens=150,
+                temperature=0.7,
+                top_p=0.9,
+                repetition_penalty=1.2,
                 pad_token_id=self.tokenizer.eos_token_id
             )
-            
+            self.latency = LatencyModel()
+            ## With a latency budget, also stop at a sentence end late in the budget or on a repeated n-gram; answers
+            ## without one keep their full length. Benchmarks turn this off so every answer decodes the same number of tokens
+            self.early_stopping = True
+
+            ## Prefill the static prompt prefix once; passage states are cached as they are first used
+            ## Each cached passage costs about 370KB per token on GPT-2 Large, so the LRU is kept small
+            ## The ORT decoder keeps its key/value states inside the session, so it always prefills the full prompt
+            self.kv_cache = PromptKVCache(self.model, self.prefix_ids, kv_cache_size) if backend == 'torch' else None
+
+            ## A draft model that shares the tokenizer (gpt2 for gpt2-large) turns on speculative decoding
+            self.speculative = None
+            if draft_model:
+                if backend != 'torch':
+                    raise ValueError("Speculative decoding needs the torch backend")
+                print(f"[INFO] [generation.py] Loading draft model {draft_model}...")
+                draft = load_causal_lm(draft_model, 'torch', device, num_threads)
+                self.speculative = SpeculativeDecoder(self.model, draft, num_draft_tokens, self.tokenizer.eos_token_id)
+
             print("[INFO] [generation.py] Model loaded successfully")
             
         except Exception as e:
             raise Exception(f"[ERROR] [generation.py] Failed to load model: {str(e)}")
             
         self.retriever = retriever
+        self.guardrails = Guardrails.from_file(guardrails_path, retriever)
+        ## Process RSS, CPU time and threads are sampled this often during each request, 0 for start and end only
+        self.sample_interval_ms = sample_interval_ms
         self.device = device
         self.COLUMN_WIDTH = 76
         self.MAX_INPUT_LENGTH = 800
@@ -52,81 +275,271 @@ class RAGModel:
         tokens = self.tokenizer.encode(text, truncation=True, max_length=max_tokens)
         return self.tokenizer.decode(tokens, skip_special_tokens=True)
 
-    def generate_response(self, query: str, top_k: int = 3) -> tuple[str, list]:
+    def _passage_ids(self, passage: dict) -> list:
+        """Token ids of a retrieved passage, read from the store when it was pre-tokenized for this vocabulary"""
+        token_ids = self.retriever.get_passage_tokens(passage["id"], len(self.tokenizer))
+        if token_ids is None:
+            with span("tokenization", passage=passage["id"]):
+                token_ids = self.tokenizer.encode(passage["text"])
+        return token_ids
+
+    def _build_segments(self, query: str, passages: list) -> tuple:
+        """Assemble the retrieved passages and question as token ids into (segments, question_ids, context_parts) within the input budget"""
+        with span("tokenization"):
+            question_ids = self.question_head_ids + self.tokenizer.encode(" " + query.strip()) + self.question_tail_ids
+
+        ## Passages are already token-bounded, so fill the budget in rank order and only trim the last one
+        context_parts, segments = [], []
+        remaining_length = self.MAX_INPUT_LENGTH - len(question_ids) - 100
+
+        for passage in passages:
+            if remaining_length <= 0:
+                break
+            segment = (self._passage_ids(passage) + self.newline_ids)[:remaining_length]
+            context_parts.append(passage["text"])
+            segments.append(segment)
+            remaining_length -= len(segment)
+
+        return segments, question_ids, context_parts
+
+    def _prepare_prompt(self, query: str, top_k: int) -> tuple:
+        """Retrieve passages and return (input_ids, past_key_values, context_parts) for the prompt"""
+        with span("retrieval", top_k=top_k):
+            passages = self.retriever.retrieve_batch([query], top_k)[0]
+        with span("prompt_assembly"):
+            segments, question_ids, context_parts = self._build_segments(query, passages)
+
+        if self.kv_cache is None:
+            prompt_ids, past_key_values = self.prefix_ids + [token for segment in segments for token in segment], None
+        else:
+            ## Only passages not already cached after the same preceding passages are prefilled here
+            with span("prefill", source="passage_cache") as prefill_span:
+                prompt_ids, past_key_values, hits = self.kv_cache.prefill(segments)
+                prefill_span.set(cached_segments=hits, segments=len(segments))
+        input_ids = torch.tensor([prompt_ids + question_ids], dtype=torch.long, device=self.model.device)
+        return input_ids, past_key_values, context_parts
+
+    def _budget(self, input_ids: torch.Tensor, past_key_values, start: float, latency_slo: float = None) -> dict:
+        """Generation options that fit the rest of a request started at start into latency_slo seconds"""
+        if latency_slo is None:
+            return {}
+        time_left = latency_slo - (time.perf_counter() - start)
+        budget = self.latency.token_budget(time_left, input_ids.shape[1] - cache_length(past_key_values))
+        return {"max_new_tokens": max(1, min(budget, self.generation_kwargs["max_new_tokens"])), "deadline": start + latency_slo}
+
+    def _generate(self, input_ids: torch.Tensor, past_key_values, deadline: float = None, **kwargs) -> tuple:
+        """Decode from a prepared prompt, returning (output_ids, metrics).
+
+        Besides any caller criteria, generation stops at the deadline if one is given. With a deadline, and unless
+        early_stopping is off, it also stops at a sentence end late in the token budget or on a repeated n-gram. The metrics report why it stopped and whether
+        that cut the answer short.
+        """
+        options = {**self.generation_kwargs, **kwargs}
+        prompt_length = input_ids.shape[1]
+        timer = StepTimer()
+        criteria = list(options.get("stopping_criteria") or []) + [timer]
+        sentence = repetition = None
+        if self.early_stopping and deadline is not None:
+            sentence = SentenceBoundaryCriteria(self.tokenizer, prompt_length, int(options["max_new_tokens"] * SENTENCE_STOP_FRACTION))
+            repetition = RepetitionCriteria(prompt_length)
+            criteria += [sentence, repetition]
+        if deadline is not None:
+            deadline_criteria = DeadlineCriteria(deadline)
+            criteria.append(deadline_criteria)
+        options["stopping_criteria"] = StoppingCriteriaList(criteria)
+
+        start = time.perf_counter()
+        if self.speculative is not None:
+            outputs, metrics = self.speculative.generate(input_ids, past_key_values, **options)
+        else:
+            if past_key_values is not None:
+                options["past_key_values"] = to_model_cache(past_key_values)
+            with torch.no_grad():
+                outputs = self.model.generate(
+                    input_ids=input_ids,
+                    attention_mask=torch.ones_like(input_ids),
+                    **options
+                )
+            elapsed = time.perf_counter() - start
+            new_tokens = outputs.shape[1] - prompt_length
+            metrics = {"speculative": False, "new_tokens": new_tokens, "generation_time": elapsed, "tokens_per_second": new_tokens / max(elapsed, 1e-9)}
+        end = time.perf_counter()
+
+        new_tokens = outputs.shape[1] - prompt_length
+        if deadline is not None and deadline_criteria.triggered:
+            stop_reason = "deadline"
+        elif repetition is not None and repetition.triggered:
+            stop_reason = "repetition"
+        elif sentence is not None and sentence.triggered:
+            stop_reason = "sentence"
+        elif new_tokens and int(outputs[0, -1]) == self.tokenizer.eos_token_id:
+            stop_reason = "eos"
+        elif new_tokens >= options["max_new_tokens"]:
+            stop_reason = "max_new_tokens"
+        else:
+            stop_reason = "cancelled"
+
+        ## The first step includes the prefill; later steps give the per-token decode time
+        prefill_tokens = prompt_length - cache_length(past_key_values)
+        trace = current_trace()
+        if timer.first is not None:
+            metrics["prefill_time"] = timer.first[0] - start
+            self.latency.update(prefill_tokens, timer.first[0] - start, timer.last[1] - timer.first[1], timer.last[0] - timer.first[0])
+            decode_tokens = outputs.shape[1] - timer.first[1]
+            trace.record("prefill", start, timer.first[0], tokens=prefill_tokens)
+            trace.record("decode", timer.first[0], end, new_tokens=decode_tokens, tokens_per_second=decode_tokens / max(end - timer.first[0], 1e-9))
+
+        metrics.update(max_new_tokens=options["max_new_tokens"], stop_reason=stop_reason, truncated=stop_reason in TRUNCATED_STOP_REASONS)
+        trace.set(new_tokens=new_tokens, tokens_per_second=metrics["tokens_per_second"], stop_reason=stop_reason)
+        return outputs, metrics
+
+    def generate_response(self, query: str, top_k: int = 3, return_metrics: bool = False, latency_slo: float = None) -> tuple:
+        """Answer a query, returning (response, context_parts), or (response, context_parts, metrics) when return_metrics is set.
+
+        With latency_slo (seconds, retrieval included), the token budget is sized from the measured prefill and
+        decode rates and decoding stops at the deadline; metrics["truncated"] tells whether that cut the answer short.
+        """
+        start = time.perf_counter()
+        trace = tracer.start_trace("generate_response", top_k=top_k)
+        sampler = ResourceSampler(self.sample_interval_ms).start()
         try:
-            retrieved_docs = self.retriever.retrieve(query, top_k)
-            
-            context_parts = []
-            remaining_length = self.MAX_INPUT_LENGTH - len(self.tokenizer.encode(query)) - 100
-            per_doc_length = remaining_length // min(2, len(retrieved_docs))
-            
-            for doc in retrieved_docs[:2]:
-                doc_excerpt = self.truncate_text(doc, per_doc_length)
-                context_parts.append(doc_excerpt)
-            
-            context = "\n".join(context_parts)
-            
-            prompt = f"""Using the following reference information:
-{context}
+            with trace:
+                input_ids, past_key_values, context_parts = self._prepare_prompt(query, top_k)
+                outputs, metrics = self._generate(input_ids, past_key_values, **self._budget(input_ids, past_key_values, start, latency_slo))
+            metrics["resources"] = sampler.stop()
+            if tracer.enabled:
+                metrics["stages"] = trace.stage_durations()
 
-Question: {query}
-Please provide a clear, focused answer that directly addresses the question:"""
-            outputs = self.pipeline(
-                prompt,
-                do_sample=True,
-                max_new_tokens=150, 
-                num_return_sequences=1,
-                temperature=0.7, 
-                top_p=0.9,
-                repetition_penalty=1.2,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
-            
-            if not outputs:
+            new_tokens = outputs[0, input_ids.shape[1]:]
+            if len(new_tokens) == 0:
                 print("[WARNING] [generation.py] No response generated")
-                return "I apologize, but I couldn't generate a response.", []
-                
-            response = outputs[0]['generated_text'] if isinstance(outputs[0], dict) else outputs[0]
-            response = self.clean_text(response)
-            response = self.wrap_text(response)
-            
-            return response, retrieved_docs[:2]
+                response, context_parts = "I apologize, but I couldn't generate a response.", []
+            else:
+                response = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+                response = self.clean_text(response)
+                response = self.wrap_text(response)
             
         except Exception as e:
             print(f"[ERROR] [generation.py] Error during generation: {str(e)}")
-            return f"An error occurred during generation: {str(e)}", []
+            response, context_parts, metrics = f"An error occurred during generation: {str(e)}", [], {"resources": sampler.stop()}
+
+        if return_metrics:
+            return response, context_parts, metrics
+        return response, context_parts
+
+    def generate_batch(self, queries: list, top_k: int = 3, return_metrics: bool = False) -> list:
+        """Answer several queries with one batched retrieval and one left-padded generate call.
+
+        Returns a (response, context_parts) pair per query, with responses left unwrapped for callers
+        that render them themselves. The whole batch is prefilled without the
+        passage KV cache, since cached states would have to line up across differently padded rows.
+
+        With return_metrics, returns (answers, metrics) instead. Each answer is (response, context_parts, sources),
+        where sources are the retrieved passage dicts that made it into the prompt. metrics has per-query
+        "prompt_tokens" and "new_tokens" lists and, when tracing is on, the batch's "stages".
+        """
+        if not queries:
+            return ([], {}) if return_metrics else []
+        trace = tracer.start_trace("generate_batch", batch_size=len(queries), top_k=top_k)
+        try:
+            with trace:
+                answers, metrics = self._generate_batch(queries, top_k)
+            if tracer.enabled:
+                metrics["stages"] = trace.stage_durations()
+        except Exception as e:
+            print(f"[ERROR] [generation.py] Error during batched generation: {str(e)}")
+            answers, metrics = [(f"An error occurred during generation: {str(e)}", [], []) for _ in queries], {"error": str(e)}
+
+        if return_metrics:
+            return answers, metrics
+        return [(response, context_parts) for response, context_parts, _ in answers]
+
+    def _generate_batch(self, queries: list, top_k: int) -> tuple:
+        """Batched retrieval, prompt assembly and left-padded generation for generate_batch"""
+        with span("retrieval", top_k=top_k, queries=len(queries)):
+            results = self.retriever.retrieve_batch(queries, top_k)
+
+        prompts, contexts = [], []
+        with span("prompt_assembly", queries=len(queries)):
+            for query, passages in zip(queries, results):
+                segments, question_ids, context_parts = self._build_segments(query, passages)
+                prompts.append(self.prefix_ids + [token for segment in segments for token in segment] + question_ids)
+                contexts.append(context_parts)
+
+        ## Left padding keeps every prompt's last token in the final column, where generation continues
+        width = max(len(prompt) for prompt in prompts)
+        pad_id = self.tokenizer.eos_token_id
+        input_ids = torch.tensor([[pad_id] * (width - len(prompt)) + prompt for prompt in prompts], dtype=torch.long, device=self.model.device)
+        attention_mask = torch.tensor([[0] * (width - len(prompt)) + [1] * len(prompt) for prompt in prompts], dtype=torch.long, device=self.model.device)
+
+        timer = StepTimer()
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model.generate(input_ids=input_ids, attention_mask=attention_mask,
+                                          stopping_criteria=StoppingCriteriaList([timer]), **self.generation_kwargs)
+        end = time.perf_counter()
+
+        ## Rows that finish early are padded with EOS up to the longest one, so EOS tokens are not counted
+        row_tokens = [int((row[width:] != self.tokenizer.eos_token_id).sum()) for row in outputs]
+        if timer.first is not None:
+            new_tokens = sum(row_tokens)
+            trace = current_trace()
+            trace.record("prefill", start, timer.first[0], tokens=int(attention_mask.sum()))
+            trace.record("decode", timer.first[0], end, new_tokens=new_tokens, tokens_per_second=new_tokens / max(end - timer.first[0], 1e-9))
+            trace.set(new_tokens=new_tokens)
+
+        answers = []
+        for row, context_parts, passages in zip(outputs, contexts, results):
+            response = self.tokenizer.decode(row[width:], skip_special_tokens=True)
+            ## _build_segments fills the prompt in rank order, so the passages used are the leading ones
+            answers.append((self.clean_text(response), context_parts, passages[:len(context_parts)]))
+        return answers, {"prompt_tokens": [len(prompt) for prompt in prompts], "new_tokens": row_tokens}
+
+    def generate_stream(self, query: str, top_k: int = 3, latency_slo: float = None) -> StreamingResponse:
+        """Start generating and return a StreamingResponse that yields text as tokens are decoded.
+
+        Retrieval and prefill happen before this returns; decoding runs on a background thread
+        until it finishes, the latency_slo deadline passes or the response is cancelled.
+        """
+        start = time.perf_counter()
+        ## The trace ends on the generation thread, when decoding does
+        trace = tracer.start_trace("generate_stream", top_k=top_k)
+        sampler = ResourceSampler(self.sample_interval_ms).start()
+        with use_trace(trace):
+            try:
+                input_ids, past_key_values, context_parts = self._prepare_prompt(query, top_k)
+            except BaseException as e:
+                ## Also on KeyboardInterrupt, so a cancelled request does not leave its sampler thread running
+                sampler.stop()
+                trace.finish(str(e) or type(e).__name__)
+                raise
+            streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+            stream = StreamingResponse(streamer, context_parts, trace, sampler)
+            stream.start(
+                self._generate,
+                input_ids=input_ids,
+                past_key_values=past_key_values,
+                streamer=streamer,
+                stopping_criteria=[CancelCriteria(stream.cancel_event)],
+                **self._budget(input_ids, past_key_values, start, latency_slo)
+            )
+        return stream
     
     def is_allowed_topic(self, query: str) -> bool:
         """Check if query is about allowed topics"""
-        disallowed = [
-            'violence', 'illegal', 'hate speech', 'adult content',
-            'weapons', 'drugs', 'terrorism', 'extremism',
-            'personal information', 'hacking', 'malware'
-        ]
+        return self.guardrails.check(query)["allowed"]
 
-        if any(topic in query.lower() for topic in disallowed):
-            return False
+    def prepare_query(self, query: str) -> dict:
+        """Guardrail check and refinement before answering: {"allowed": False, "message"} or {"allowed": True, "query"}"""
+        if not self.is_allowed_topic(query):
+            return {"allowed": False, "message": self.guardrails.refusal_message}
+        return {"allowed": True, "query": self.refine_query(query)}
 
-        if any(cmd in query.lower() for cmd in ['sudo', 'rm -rf', 'format', 'del']):
-            return False
-                
-        return True
+    def check_topics(self, queries: list) -> list:
+        """Guardrail decisions for a batch of queries, see Guardrails.check_batch"""
+        return self.guardrails.check_batch(queries)
 
     def refine_query(self, query: str) -> str:
         ## remains to be implemented properly, i'm pretty sure it's fucking up shit#
         """Improve query clarity if needed"""
-        if len(query.strip()) < 5:
-            return f"Could you please elaborate? Your message '{query}' is too short for me to understand clearly."
-                
-        common_responses = ['ok', 'okay', 'yes', 'no', 'thanks']
-        if query.lower().strip() in common_responses:
-            return query
-
-        vague_terms = ['this', 'that', 'it', 'thing']
-        if any(term in query.lower().split() for term in vague_terms):
-            return f"Could you be more specific about what you mean by '{query}'?"
-                
-        if any(term in query.lower() for term in ['code', 'program', 'function']):
-            return f"Regarding '{query}', what specific aspect or language are you interested in?"
-                
-        return query
+        return self.guardrails.refine(query)
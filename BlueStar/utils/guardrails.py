@@ -0,0 +1,145 @@
+import bisect
+import json
+import os
+import re
+import numpy as np
+from typing import Callable, Dict, List, Optional
+
+## Rules live in data/guardrails.json so they can change without code edits
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "guardrails.json")
+RULES_VERSION = 1
+DEFAULT_REFUSAL = "I apologize, but I cannot assist with that topic due to ethical constraints."
+
+def load_rules(path: str = DEFAULT_RULES_PATH) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+    if rules.get("version") != RULES_VERSION:
+        raise ValueError(f"Unsupported guardrail rules version {rules.get('version')} in {path}")
+    return rules
+
+def normalize_term(term: str) -> str:
+    return " ".join(term.lower().split())
+
+def compile_terms(terms: List[str]) -> Optional[re.Pattern]:
+    """Compile literal terms into one case-insensitive alternation that only matches whole words.
+
+    Words inside a multi-word term may be separated by any whitespace except a newline, so a batch of
+    queries can be scanned as one newline-joined string without a term spanning two queries.
+    """
+    alternatives = {r"[^\S\n]+".join(re.escape(word) for word in term.split()) for term in terms if term.strip()}
+    if not alternatives:
+        return None
+    ## Longest first, so "hate speech" wins over a shorter term it contains
+    pattern = "|".join(sorted(alternatives, key=len, reverse=True))
+    return re.compile(r"(?<!\w)(?:" + pattern + r")(?!\w)", re.IGNORECASE)
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+class TopicClassifier:
+    """Flags queries whose embedding is close to an example query of a blocked topic.
+
+    Queries are embedded by the retriever's encoder through its embedding cache, so the retrieval
+    that follows an allowed query reuses the same embedding instead of running the encoder again.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]], encode: Callable, threshold: float):
+        self.categories, vectors = [], []
+        for category, phrases in examples.items():
+            if phrases:
+                vectors.append(_normalize_rows(encode(phrases)))
+                self.categories += [category] * len(phrases)
+        self.examples = np.concatenate(vectors) if vectors else None
+        self.threshold = threshold
+
+    def classify(self, embeddings: np.ndarray) -> List[Optional[tuple]]:
+        """Return (category, similarity) for each embedding at or above the threshold, None otherwise"""
+        if self.examples is None or len(embeddings) == 0:
+            return [None] * len(embeddings)
+        scores = _normalize_rows(embeddings) @ self.examples.T
+        best = scores.argmax(axis=1)
+        return [(self.categories[idx], float(row[idx])) if row[idx] >= self.threshold else None for idx, row in zip(best, scores)]
+
+class Guardrails:
+    """Blocks and refines queries with rules compiled from a rules file, optionally backed by a topic classifier"""
+
+    def __init__(self, rules: dict, classifier: Optional[TopicClassifier] = None, embed: Optional[Callable] = None):
+        self.refusal_message = rules.get("refusal_message", DEFAULT_REFUSAL)
+
+        ## Every blocked term maps back to its category so a decision can say which rule fired
+        self.term_categories = {normalize_term(term): category for category, terms in rules.get("blocked", {}).items() for term in terms}
+        self.blocked_pattern = compile_terms(list(self.term_categories))
+
+        refinement = rules.get("refinement", {})
+        self.min_length = refinement.get("min_length", 5)
+        self.short_message = refinement.get("short_message", "{query}")
+        self.passthrough = {normalize_term(term) for term in refinement.get("passthrough", [])}
+        self.vague_pattern = compile_terms(refinement.get("vague_terms", []))
+        self.vague_message = refinement.get("vague_message", "{query}")
+        self.code_pattern = compile_terms(refinement.get("code_terms", []))
+        self.code_message = refinement.get("code_message", "{query}")
+
+        self.classifier = classifier
+        self.embed = embed
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_RULES_PATH, retriever=None) -> "Guardrails":
+        """Load rules, enabling the topic classifier when the rules turn it on and a retriever supplies the encoder"""
+        rules = load_rules(path)
+        settings = rules.get("topic_classifier", {})
+        if not settings.get("enabled") or retriever is None:
+            return cls(rules)
+        classifier = TopicClassifier(settings.get("examples", {}), lambda texts: retriever.model.encode(texts, convert_to_numpy=True), settings.get("threshold", 0.6))
+        return cls(rules, classifier, retriever.encode_queries)
+
+    def check_batch(self, queries: List[str], embeddings: Optional[np.ndarray] = None) -> List[dict]:
+        """Decide for each query whether it is allowed, returning dicts with "allowed", "category", "rule" and "score".
+
+        The rules are matched in one scan over the newline-joined batch. Queries that pass them go through the
+        topic classifier, using the given embeddings or embedding them in one batch.
+        """
+        decisions = [{"allowed": True, "category": None, "rule": None, "score": None} for _ in queries]
+        if not queries:
+            return decisions
+
+        if self.blocked_pattern is not None:
+            lines = [query.replace("\r", " ").replace("\n", " ") for query in queries]
+            starts, position = [], 0
+            for line in lines:
+                starts.append(position)
+                position += len(line) + 1
+            for match in self.blocked_pattern.finditer("\n".join(lines)):
+                idx = bisect.bisect_right(starts, match.start()) - 1
+                if decisions[idx]["allowed"]:
+                    rule = normalize_term(match.group(0))
+                    decisions[idx].update(allowed=False, category=self.term_categories.get(rule), rule=rule)
+
+        if self.classifier is not None:
+            pending = [idx for idx, decision in enumerate(decisions) if decision["allowed"]]
+            if pending:
+                vectors = np.asarray(embeddings)[pending] if embeddings is not None else self.embed([queries[idx] for idx in pending])
+                for idx, result in zip(pending, self.classifier.classify(vectors)):
+                    if result is not None:
+                        decisions[idx].update(allowed=False, category=result[0], rule="topic_classifier", score=result[1])
+
+        return decisions
+
+    def check(self, query: str) -> dict:
+        return self.check_batch([query])[0]
+
+    def refine(self, query: str) -> str:
+        """Return a clarifying question for short, vague or underspecified queries, or the query itself"""
+        if len(query.strip()) < self.min_length:
+            return self.short_message.format(query=query)
+
+        if normalize_term(query) in self.passthrough:
+            return query
+
+        if self.vague_pattern is not None and self.vague_pattern.search(query):
+            return self.vague_message.format(query=query)
+
+        if self.code_pattern is not None and self.code_pattern.search(query):
+            return self.code_message.format(query=query)
+
+        return query
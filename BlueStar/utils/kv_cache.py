@@ -0,0 +1,88 @@
+import torch
+from typing import List, Optional, Sequence, Tuple
+from BlueStar.utils.cache import LRUCache
+
+## Key/value states are kept in the legacy layout, one (key, value) pair of [batch, heads, seq, head_dim] tensors per layer
+LegacyCache = Tuple[Tuple[torch.Tensor, torch.Tensor], ...]
+
+def to_legacy_cache(past) -> LegacyCache:
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+    return tuple((layer[0], layer[1]) for layer in past)
+
+def to_model_cache(past: Optional[LegacyCache]):
+    """Wrap legacy key/value states in the Cache object newer transformers versions expect"""
+    if past is None:
+        return None
+    try:
+        from transformers import DynamicCache
+    except ImportError:
+        return past
+    ## generate() appends to the cache it is given, which replaces the wrapped tensors instead of writing into them
+    return DynamicCache.from_legacy_cache(past)
+
+def cache_length(past: Optional[LegacyCache]) -> int:
+    return 0 if past is None else past[0][0].shape[2]
+
+def crop_cache(past: Optional[LegacyCache], length: int) -> Optional[LegacyCache]:
+    """Drop every position from length onwards"""
+    if past is None or cache_length(past) <= length:
+        return past
+    return tuple((key[:, :, :length], value[:, :, :length]) for key, value in past)
+
+def concat_caches(states: Sequence[LegacyCache]) -> LegacyCache:
+    """Join consecutive key/value states along the sequence axis"""
+    if len(states) == 1:
+        return states[0]
+    return tuple(
+        (torch.cat([state[layer][0] for state in states], dim=2), torch.cat([state[layer][1] for state in states], dim=2))
+        for layer in range(len(states[0]))
+    )
+
+class PromptKVCache:
+    """Reuses prefill work across prompts made of a static prefix followed by a sequence of segments.
+
+    The prefix is prefilled once at construction. Attention is causal, so a segment's keys and values depend on
+    every token before it; segment entries are therefore keyed by the chain of segment token ids that led to them,
+    and each holds only that segment's own keys and values, so a prompt is rebuilt by concatenating the cached
+    deltas and prefilling just the segments that missed.
+    """
+
+    def __init__(self, model, prefix_ids: List[int], max_segments: int = 8):
+        self.model = model
+        self.prefix_ids = list(prefix_ids)
+        self.segments = LRUCache(max_segments)
+        self.prefix_state = self._prefill(self.prefix_ids, None)
+
+    @torch.no_grad()
+    def _prefill(self, token_ids: List[int], past: Optional[LegacyCache]) -> LegacyCache:
+        """Run the model over token_ids after past and return only the new tokens' keys and values"""
+        past_length = cache_length(past)
+        device = self.model.device
+        input_ids = torch.tensor([token_ids], dtype=torch.long, device=device)
+        attention_mask = torch.ones((1, past_length + len(token_ids)), dtype=torch.long, device=device)
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask, past_key_values=to_model_cache(past), use_cache=True)
+        return tuple((key[:, :, past_length:], value[:, :, past_length:]) for key, value in to_legacy_cache(outputs.past_key_values))
+
+    def prefill(self, segments: Sequence[List[int]]) -> Tuple[List[int], LegacyCache, int]:
+        """Return (token_ids, past_key_values, cached_segments) for the prefix followed by segments"""
+        token_ids = list(self.prefix_ids)
+        states = [self.prefix_state]
+        chain = ()
+        hits = 0
+
+        for segment in segments:
+            chain = chain + (tuple(segment),)
+            delta = self.segments.get(chain)
+            if delta is None:
+                delta = self._prefill(list(segment), concat_caches(states))
+                self.segments.put(chain, delta)
+            else:
+                hits += 1
+            states.append(delta)
+            token_ids.extend(segment)
+
+        return token_ids, concat_caches(states), hits
+
+    def clear(self):
+        self.segments.clear()
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+MANIFEST_FILE = "manifest.json"
+
+def file_hash(path: str) -> str:
+    """Return the SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(store_dir: str) -> Optional[dict]:
+    """Load the manifest of a document store, or None if the store was never built"""
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest: dict, store_dir: str):
+    """Write the manifest atomically so an interrupted update never leaves it half written"""
+    path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def new_manifest(build_config: dict) -> dict:
+    """Create an empty manifest for a build with the given chunking and embedding settings.
+
+    "files" tracks one document per .txt file; "shards" tracks corpus shards and the documents inside each one.
+    """
+    return {"build_config": build_config, "files": {}, "shards": {}}
+
+def document_entry(content_hash: str, doc_id: int, passage_ids) -> dict:
+    """Describe one indexed document: its content hash and where its passages live"""
+    return {
+        "sha256": content_hash,
+        "doc_id": doc_id,
+        "passage_ids": [passage_ids[0], passage_ids[-1] + 1] if passage_ids else [0, 0],
+    }
+
+def file_entry(path: str, content_hash: str, doc_id: int, passage_ids) -> dict:
+    """Describe one corpus file: its stat signature plus its document entry"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **document_entry(content_hash, doc_id, passage_ids)}
+
+def diff_shards(manifest: dict, corpus_dir: str, shard_names) -> tuple:
+    """Compare corpus shards with the manifest by stat signature, returning (shards_to_scan, removed_shards)"""
+    known = manifest.setdefault("shards", {})
+    to_scan = []
+    for name in shard_names:
+        stat = os.stat(os.path.join(corpus_dir, name))
+        entry = known.get(name)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            to_scan.append(name)
+
+    current = set(shard_names)
+    removed = [name for name in known if name not in current]
+    return to_scan, removed
+
+def diff_corpus(manifest: dict, corpus_dir: str, filenames) -> tuple:
+    """Compare corpus files with the manifest, returning (added, changed, removed, hashes).
+
+    A file is only hashed when its size or mtime differs from the manifest, so unchanged files are never read.
+    Hashes for the files that were read are returned alongside so callers do not hash them twice.
+    """
+    known = manifest["files"]
+    added, changed, hashes = [], [], {}
+
+    for filename in filenames:
+        path = os.path.join(corpus_dir, filename)
+        entry = known.get(filename)
+        if entry is None:
+            added.append(filename)
+            continue
+        stat = os.stat(path)
+        if stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]:
+            continue
+        hashes[filename] = file_hash(path)
+        if hashes[filename] != entry["sha256"]:
+            changed.append(filename)
+        else:
+            ## Touched but identical, refresh the stat signature only
+            entry["size"], entry["mtime_ns"] = stat.st_size, stat.st_mtime_ns
+
+    current = set(filenames)
+    removed = [filename for filename in known if filename not in current]
+    return added, changed, removed, hashes
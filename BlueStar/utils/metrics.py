@@ -1,36 +1,118 @@
 import psutil
 import os
-from typing import Tuple
+import sys
+import threading
+import time
 
-def monitor_resources() -> Tuple[float, float]:
-    """Monitor CPU and RAM usage"""
-    try:
-        cpu_percent = psutil.cpu_percent()
-        
-        ram = psutil.virtual_memory()
-        ram_percent = ram.percent
-        
-        disk = psutil.disk_usage('/')
-        disk_percent = disk.percent
-        
-        print(f"[DEBUG] [metrics.py] CPU: {cpu_percent}%, RAM: {ram_percent}%, Disk: {disk_percent}%")
-        
-        return cpu_percent, ram_percent
-    except Exception as e:
-        print(f"[ERROR] [metrics.py] Error monitoring resources: {str(e)}")
-        return 0.0, 0.0
+MB = 1024 * 1024
+
+class ResourceSampler:
+    """Samples this process's RSS, CPU time and thread count on a background thread while a request runs.
+
+    Unlike system-wide percentages, every figure is for this process alone, and sampling every
+    interval_ms catches memory peaks during prefill that a before/after snapshot would miss.
+    An interval of 0 takes only the start and end snapshots, without a thread.
+    """
+
+    def __init__(self, interval_ms: float = 50.0):
+        self.interval = interval_ms / 1000.0
+        self.process = psutil.Process(os.getpid())
+        self._stop = threading.Event()
+        self._thread = None
+        self._first = None
+        self._last = None
+        self._samples = 0
+        self._rss_peak = 0
+        self._rss_total = 0
+        self._threads_peak = 0
+
+    def snapshot(self) -> dict:
+        """One reading of the process's memory, CPU times and thread count, in bytes and seconds"""
+        with self.process.oneshot():
+            memory_info = self.process.memory_info()
+            cpu_times = self.process.cpu_times()
+            return {
+                "time": time.perf_counter(),
+                "rss": memory_info.rss,
+                "vms": memory_info.vms,
+                "cpu_user": cpu_times.user,
+                "cpu_system": cpu_times.system,
+                "threads": self.process.num_threads(),
+            }
+
+    def _record(self, sample: dict):
+        self._samples += 1
+        self._rss_peak = max(self._rss_peak, sample["rss"])
+        self._rss_total += sample["rss"]
+        self._threads_peak = max(self._threads_peak, sample["threads"])
+        self._last = sample
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._record(self.snapshot())
+
+    def start(self) -> "ResourceSampler":
+        self._first = self.snapshot()
+        self._record(self._first)
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> dict:
+        """Stop sampling and summarize the request: RSS in MB, CPU time in seconds and thread counts"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self._record(self.snapshot())
+
+        first, last = self._first, self._last
+        wall = max(last["time"] - first["time"], 1e-9)
+        cpu_user = last["cpu_user"] - first["cpu_user"]
+        cpu_system = last["cpu_system"] - first["cpu_system"]
+        return {
+            "duration_s": wall,
+            "samples": self._samples,
+            "rss_start_mb": first["rss"] / MB,
+            "rss_end_mb": last["rss"] / MB,
+            "rss_peak_mb": self._rss_peak / MB,
+            "rss_mean_mb": self._rss_total / self._samples / MB,
+            "cpu_user_s": cpu_user,
+            "cpu_system_s": cpu_system,
+            ## Share of one core; above 100% when several threads compute at once
+            "cpu_percent": (cpu_user + cpu_system) / wall * 100,
+            "threads_peak": self._threads_peak,
+            "threads_end": last["threads"],
+        }
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.summary = self.stop()
+        return False
 
 def get_process_memory() -> dict:
     """Get detailed memory usage for current process"""
     try:
-        process = psutil.Process(os.getpid())
-        memory_info = process.memory_info()
-        
+        sample = ResourceSampler(0).snapshot()
         return {
-            'rss': memory_info.rss / (1024 * 1024),  ## RSS in MB
-            'vms': memory_info.vms / (1024 * 1024),  ## VMS in MB
-            'percent': process.memory_percent()
+            'rss': sample['rss'] / MB,  ## RSS in MB
+            'vms': sample['vms'] / MB,  ## VMS in MB
+            'percent': sample['rss'] / psutil.virtual_memory().total * 100
         }
     except Exception as e:
         print(f"[ERROR] [metrics.py] Error getting process memory: {str(e)}")
         return {'rss': 0, 'vms': 0, 'percent': 0}
+
+def get_peak_memory() -> float:
+    """Peak resident set size of the current process in MB"""
+    try:
+        import resource
+        ## ru_maxrss is in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / MB if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        memory_info = psutil.Process(os.getpid()).memory_info()
+        return getattr(memory_info, 'peak_wset', memory_info.rss) / MB
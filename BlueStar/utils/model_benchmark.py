@@ -0,0 +1,75 @@
+import math
+import time
+import numpy as np
+import torch
+from BlueStar.utils.doc_store import DocStore
+
+def sample_passages(store_path: str, num_passages: int, seed: int) -> list:
+    """Return the text of a random sample of live store passages"""
+    store = DocStore(store_path)
+    rng = np.random.default_rng(seed)
+    passage_ids = rng.choice(store.num_passages, min(num_passages, store.num_passages), replace=False)
+    passages = [store.get_passage(int(pid)) for pid in passage_ids if not store.is_deleted(int(pid))]
+    store.close()
+    return passages
+
+def measure_speed(model, tokenizer, prompts: list, new_tokens: int) -> dict:
+    """Greedy-decode exactly new_tokens per prompt and split the time into prefill and decode"""
+    prefill_times, decode_rates = [], []
+    for prompt in prompts:
+        input_ids = torch.tensor([tokenizer.encode(prompt)], dtype=torch.long)
+        kwargs = dict(input_ids=input_ids, attention_mask=torch.ones_like(input_ids), do_sample=False, pad_token_id=tokenizer.eos_token_id)
+
+        with torch.no_grad():
+            start = time.perf_counter()
+            model.generate(max_new_tokens=1, min_new_tokens=1, **kwargs)
+            prefill = time.perf_counter() - start
+
+            start = time.perf_counter()
+            model.generate(max_new_tokens=new_tokens, min_new_tokens=new_tokens, **kwargs)
+            total = time.perf_counter() - start
+
+        prefill_times.append(prefill)
+        decode_rates.append((new_tokens - 1) / max(total - prefill, 1e-9))
+
+    return {
+        "prefill_s_mean": float(np.mean(prefill_times)),
+        "decode_tokens_per_s": float(np.mean(decode_rates)),
+        "end_to_end_tokens_per_s": float(new_tokens / np.mean([p + (new_tokens - 1) / r for p, r in zip(prefill_times, decode_rates)])),
+    }
+
+def sequence_nlls(model, tokenizer, texts: list, max_length: int, batch_size: int = 8) -> list:
+    """Summed negative log-likelihood and scored token count of each text, truncated to max_length tokens.
+
+    Texts are scored in right-padded batches with attention masks. They are grouped in length order so each
+    batch pads to similar lengths, and the results come back in input order. Texts under two tokens score (0.0, 0).
+    """
+    encoded = [tokenizer.encode(text)[:max_length] for text in texts]
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    order = [idx for idx in sorted(range(len(texts)), key=lambda idx: len(encoded[idx])) if len(encoded[idx]) >= 2]
+    results = [(0.0, 0)] * len(texts)
+
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        width = max(len(encoded[idx]) for idx in batch)
+        input_ids = torch.full((len(batch), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros_like(input_ids)
+        for row, idx in enumerate(batch):
+            input_ids[row, :len(encoded[idx])] = torch.tensor(encoded[idx], dtype=torch.long)
+            attention_mask[row, :len(encoded[idx])] = 1
+
+        with torch.no_grad():
+            logits = model(input_ids=input_ids, attention_mask=attention_mask).logits
+        ## Score every token from its prefix; computed from logits because the ORT model does not take labels
+        ## Padding sits after the real tokens, so causal attention never lets a real token see it
+        nll = torch.nn.functional.cross_entropy(logits[:, :-1].float().transpose(1, 2), input_ids[:, 1:], reduction='none')
+        mask = attention_mask[:, 1:].float()
+        sums, counts = (nll * mask).sum(dim=1), mask.sum(dim=1)
+        for row, idx in enumerate(batch):
+            results[idx] = (float(sums[row]), int(counts[row]))
+    return results
+
+def measure_perplexity(model, tokenizer, texts: list, max_length: int, batch_size: int = 8) -> float:
+    """Token-weighted perplexity of the model over held-out corpus passages"""
+    nlls = sequence_nlls(model, tokenizer, texts, max_length, batch_size)
+    return math.exp(sum(nll for nll, _ in nlls) / max(sum(count for _, count in nlls), 1))
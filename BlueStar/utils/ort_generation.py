@@ -0,0 +1,71 @@
+import os
+import platform
+import shutil
+import psutil
+
+## Exported decoder layout: optimum writes model.onnx (with its external weight data for GPT-2 Large), the
+## quantizer adds model_quantized.onnx next to it, and the tokenizer and config are saved alongside
+ORT_MODEL_FILE = "model.onnx"
+ORT_QUANTIZED_FILE = "model_quantized.onnx"
+
+def ort_session_options(num_threads: int = None):
+    """Session options tuned for single-stream CPU decoding.
+
+    Decoding is a chain of small matmuls, so ops run sequentially on one intra-op pool sized to the physical
+    cores; hyperthreads and a second inter-op pool only add contention.
+    """
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = num_threads or psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    options.inter_op_num_threads = 1
+    options.add_session_config_entry("session.intra_op.allow_spinning", "1")
+    return options
+
+def load_ort_model(model_path: str, num_threads: int = None, file_name: str = None):
+    """Load the exported decoder, preferring the int8 file unless file_name picks one"""
+    from optimum.onnxruntime import ORTModelForCausalLM
+
+    if file_name is None:
+        file_name = ORT_QUANTIZED_FILE if os.path.exists(os.path.join(model_path, ORT_QUANTIZED_FILE)) else ORT_MODEL_FILE
+    if not os.path.exists(os.path.join(model_path, file_name)):
+        raise FileNotFoundError(f"No ONNX model found in {model_path}, run scripts/export_generator.py first")
+    return ORTModelForCausalLM.from_pretrained(
+        model_path,
+        file_name=file_name,
+        use_cache=True,
+        provider="CPUExecutionProvider",
+        session_options=ort_session_options(num_threads)
+    )
+
+def export_ort_model(model_name: str, output_dir: str, keep_fp32: bool = False):
+    """Export a causal LM with past-key-value inputs to ONNX and quantize its weights to dynamic int8"""
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    fp32_dir = os.path.join(output_dir, "fp32")
+    model = ORTModelForCausalLM.from_pretrained(model_name, export=True, use_cache=True)
+    model.save_pretrained(fp32_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(fp32_dir)
+
+    ## VNNI kernels on x86, the arm64 config elsewhere; both quantize weights ahead of time and activations per call
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        config = AutoQuantizationConfig.arm64(is_static=False, per_channel=True)
+    else:
+        config = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=True)
+
+    quantizer = ORTQuantizer.from_pretrained(fp32_dir, file_name=ORT_MODEL_FILE)
+    ## GPT-2 Large is over protobuf's 2GB limit, so its weights live in external data files
+    quantizer.quantize(save_dir=output_dir, quantization_config=config, use_external_data_format=True)
+
+    for name in os.listdir(fp32_dir):
+        if name.endswith(".json") or name.endswith(".txt"):
+            shutil.copy(os.path.join(fp32_dir, name), output_dir)
+    if keep_fp32:
+        for name in os.listdir(fp32_dir):
+            if not os.path.exists(os.path.join(output_dir, name)):
+                shutil.copy(os.path.join(fp32_dir, name), output_dir)
+    shutil.rmtree(fp32_dir)
@@ -0,0 +1,154 @@
+import json
+import os
+import time
+import torch
+import torch.ao.nn.quantized.dynamic as nnqd
+from safetensors import safe_open
+from safetensors.torch import save_file
+from transformers import AutoConfig, AutoModelForCausalLM
+from BlueStar.utils.weight_quant import Int4Linear, set_submodule
+
+## Checkpoint layout, saved next to config.json and the tokenizer:
+##   quantized_model.safetensors - float tensors under their state_dict names, and for each quantized module
+##                                 "<name>.weight_int8", "<name>.weight_scale", "<name>.weight_zero_point"
+##                                 (int8 kernels) or "<name>.weight_int4", "<name>.weight_scale" (int4 kernels,
+##                                 two values per byte with one float16 scale per group) and, when it has one, "<name>.bias"
+##   quantization.json           - format version and the quantized modules with the kernel each one is rebuilt as
+CHECKPOINT_FILE = "quantized_model.safetensors"
+QUANTIZATION_FILE = "quantization.json"
+FORMAT_VERSION = 1
+
+def is_quantized_checkpoint(model_path: str) -> bool:
+    return os.path.exists(os.path.join(model_path, QUANTIZATION_FILE))
+
+def _pack_weight(qweight: torch.Tensor) -> dict:
+    """Split a quantized weight into its int8 values, scales and zero points"""
+    if qweight.qscheme() in (torch.per_channel_affine, torch.per_channel_symmetric):
+        scale = qweight.q_per_channel_scales().float()
+        zero_point = qweight.q_per_channel_zero_points().to(torch.int64)
+        qscheme = "per_channel"
+    else:
+        scale = torch.tensor([qweight.q_scale()], dtype=torch.float32)
+        zero_point = torch.tensor([qweight.q_zero_point()], dtype=torch.int64)
+        qscheme = "per_tensor"
+    return {"int8": qweight.int_repr().contiguous(), "scale": scale, "zero_point": zero_point, "qscheme": qscheme}
+
+def save_quantized_checkpoint(model: torch.nn.Module, output_dir: str, mode: str = "dynamic") -> dict:
+    """Write a quantized model's integer weights, scales and float tensors to a safetensors checkpoint"""
+    tensors, modules = {}, {}
+    quantized_prefixes = []
+
+    for name, module in model.named_modules():
+        if isinstance(module, nnqd.Linear):
+            weight, bias = module._weight_bias()
+            packed = _pack_weight(weight)
+            tensors[f"{name}.weight_int8"] = packed["int8"]
+            tensors[f"{name}.weight_scale"] = packed["scale"]
+            tensors[f"{name}.weight_zero_point"] = packed["zero_point"]
+            if bias is not None:
+                tensors[f"{name}.bias"] = bias.detach().contiguous()
+            modules[name] = {
+                "kernel": "dynamic_int8_linear",
+                "in_features": module.in_features,
+                "out_features": module.out_features,
+                "bias": bias is not None,
+                "qscheme": packed["qscheme"],
+            }
+            quantized_prefixes.append(name + ".")
+        elif isinstance(module, Int4Linear):
+            tensors[f"{name}.weight_int4"] = module.weight_packed.contiguous()
+            tensors[f"{name}.weight_scale"] = module.weight_scale.contiguous()
+            if module.bias is not None:
+                tensors[f"{name}.bias"] = module.bias.contiguous()
+            modules[name] = {
+                "kernel": "int4_linear",
+                "in_features": module.in_features,
+                "out_features": module.out_features,
+                "bias": module.bias is not None,
+                "group_size": module.group_size,
+            }
+            quantized_prefixes.append(name + ".")
+
+    ## Float tensors; safetensors refuses shared storage, so tied weights are written once under their first name
+    seen = set()
+    for name, value in model.state_dict().items():
+        if not isinstance(value, torch.Tensor) or value.is_quantized or any(name.startswith(prefix) for prefix in quantized_prefixes):
+            continue
+        if value.data_ptr() in seen:
+            continue
+        seen.add(value.data_ptr())
+        tensors[name] = value.detach().contiguous()
+
+    os.makedirs(output_dir, exist_ok=True)
+    save_file(tensors, os.path.join(output_dir, CHECKPOINT_FILE), metadata={"format": "bluestar-quantized", "version": str(FORMAT_VERSION)})
+    quantization = {"format_version": FORMAT_VERSION, "mode": mode, "modules": modules}
+    with open(os.path.join(output_dir, QUANTIZATION_FILE), 'w') as f:
+        json.dump(quantization, f, indent=2)
+    return quantization
+
+def _unpack_weight(reader, name: str, spec: dict) -> torch.Tensor:
+    int8 = reader.get_tensor(f"{name}.weight_int8")
+    scale = reader.get_tensor(f"{name}.weight_scale")
+    zero_point = reader.get_tensor(f"{name}.weight_zero_point")
+    if spec["qscheme"] == "per_channel":
+        return torch._make_per_channel_quantized_tensor(int8, scale.double(), zero_point, 0)
+    return torch._make_per_tensor_quantized_tensor(int8, float(scale[0]), int(zero_point[0]))
+
+def _build_dynamic_int8_linear(reader, name: str, spec: dict) -> torch.nn.Module:
+    module = nnqd.Linear(spec["in_features"], spec["out_features"], bias_=spec["bias"], dtype=torch.qint8)
+    bias = reader.get_tensor(f"{name}.bias") if spec["bias"] else None
+    module.set_weight_bias(_unpack_weight(reader, name, spec), bias)
+    return module
+
+def _build_int4_linear(reader, name: str, spec: dict) -> torch.nn.Module:
+    module = Int4Linear(spec["in_features"], spec["out_features"], spec["group_size"], spec["bias"])
+    module.weight_packed = reader.get_tensor(f"{name}.weight_int4")
+    module.weight_scale = reader.get_tensor(f"{name}.weight_scale")
+    if spec["bias"]:
+        module.bias = reader.get_tensor(f"{name}.bias")
+    return module
+
+## Kernel name in quantization.json -> builder of the module that replaces the float one
+MODULE_BUILDERS = {
+    "dynamic_int8_linear": _build_dynamic_int8_linear,
+    "int4_linear": _build_int4_linear,
+}
+
+def load_quantized_model(model_path: str) -> torch.nn.Module:
+    """Rebuild a quantized model from its checkpoint without ever materializing the float weights.
+
+    The architecture is created on the meta device, quantized modules are swapped in from their int8
+    tensors, and the remaining float tensors are assigned straight from the memory-mapped file.
+    """
+    from accelerate import init_empty_weights
+
+    start = time.perf_counter()
+    with open(os.path.join(model_path, QUANTIZATION_FILE), 'r') as f:
+        quantization = json.load(f)
+    if quantization.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported quantized checkpoint version {quantization.get('format_version')}, re-run scripts/quantize_model.py")
+
+    config = AutoConfig.from_pretrained(model_path)
+    with init_empty_weights():
+        model = AutoModelForCausalLM.from_config(config)
+
+    with safe_open(os.path.join(model_path, CHECKPOINT_FILE), framework="pt") as reader:
+        for name, spec in quantization["modules"].items():
+            if spec["kernel"] not in MODULE_BUILDERS:
+                raise ValueError(f"Unknown quantized kernel '{spec['kernel']}' for {name}")
+            set_submodule(model, name, MODULE_BUILDERS[spec["kernel"]](reader, name, spec))
+
+        quantized_prefixes = tuple(name + "." for name in quantization["modules"])
+        state = {key: reader.get_tensor(key) for key in reader.keys() if not key.startswith(quantized_prefixes)}
+    model.load_state_dict(state, strict=False, assign=True)
+
+    ## Weights tied to a tensor saved under another name (GPT-2's wte and lm_head) come back through the tie
+    if any(param.is_meta for param in model.parameters()):
+        model.tie_weights()
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise ValueError(f"Quantized checkpoint is missing tensors: {', '.join(missing[:5])}")
+
+    model.eval()
+    print(f"[INFO] [quantized_checkpoint.py] Loaded {len(quantization['modules'])} quantized modules in {time.perf_counter() - start:.2f}s")
+    return model
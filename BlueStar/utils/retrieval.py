@@ -1,31 +1,174 @@
-import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
-from typing import List
+import os
+import numpy as np
+from typing import List, Optional
+from BlueStar.utils.bm25 import BM25Index, bm25_exists, reciprocal_rank_fusion
+from BlueStar.utils.cache import LRUCache
+from BlueStar.utils.doc_store import DocStore
+from BlueStar.utils.encoders import load_encoder
+from BlueStar.utils.faiss_index import index_metadata_path, load_index_metadata, read_index, set_search_params
+from BlueStar.utils.tracing import span
+
+def normalize_query(query: str) -> str:
+    """Normalize a query for cache lookups: lowercase with collapsed whitespace"""
+    ## MiniLM's tokenizer is uncased, so the normalized string embeds exactly like the original
+    return " ".join(query.lower().split())
 
 class Retriever:
-    def __init__(self, index_path: str, corpus_path: str, model_name: str = 'all-MiniLM-L6-v2'):
+    def __init__(self, index_path: str, store_path: str, model_name: str = 'all-MiniLM-L6-v2',
+                 nprobe: Optional[int] = None, ef_search: Optional[int] = None, cache_size: int = 1024,
+                 retrieval_mode: str = 'hybrid', rrf_k: int = 60, fusion_depth: int = 20,
+                 encoder_backend: str = 'torch', encoder_path: Optional[str] = None):
         try:
-            self.index = faiss.read_index(index_path)
-            with open(corpus_path, 'rb') as f:
-                self.corpus = pickle.load(f)
-            self.model = SentenceTransformer(model_name)
-            print(f"[INFO] [retrieval.py] Retriever initialized with {len(self.corpus)} documents")
+            if retrieval_mode not in ('hybrid', 'dense'):
+                raise ValueError(f"Unknown retrieval mode '{retrieval_mode}', expected 'hybrid' or 'dense'")
+            self.index_path = index_path
+            self.store_path = store_path
+            self.retrieval_mode = retrieval_mode
+            self.rrf_k = rrf_k
+            self.fusion_depth = fusion_depth
+            self.search_overrides = {"nprobe": nprobe, "efSearch": ef_search}
+
+            ## Query embeddings and results are cached per normalized query and dropped whenever the index version changes
+            self.embedding_cache = LRUCache(cache_size)
+            self.result_cache = LRUCache(cache_size)
+
+            self.store = None
+            self._load_index()
+            ## The onnx backend runs an int8 export of the same model without importing torch
+            self.encoder_backend = encoder_backend
+            self.model = load_encoder(encoder_backend, model_name, encoder_path)
+            print(f"[INFO] [retrieval.py] Retriever initialized with {self.store.num_passages} passages from {self.store.num_documents} documents ({self.index_metadata['factory']} index)")
         except Exception as e:
             print(f"[ERROR] [retrieval.py] Failed to initialize retriever: {str(e)}")
             raise
 
-    def retrieve(self, query: str, top_k: int = 5) -> List[str]:
+    def _metadata_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(index_metadata_path(self.index_path)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_index(self):
+        """(Re)open the index, its metadata and the document store"""
+        self._metadata_mtime_ns = self._metadata_mtime()
+        self.index_metadata = load_index_metadata(self.index_path)
+        self.index = read_index(self.index_path, self.index_metadata["index_type"])
+        self.index_version = self.index_metadata.get("version", 1)
+        self.search_params = dict(self.index_metadata.get("search_params", {}))
+        self.set_search_params()
+
+        if self.store is not None:
+            self.store.close()
+        self.store = DocStore(self.store_path)
+
+        self.bm25 = None
+        if self.retrieval_mode == 'hybrid':
+            if bm25_exists(self.store_path):
+                self.bm25 = BM25Index(self.store_path)
+            else:
+                print("[WARNING] [retrieval.py] No BM25 index found in the store, falling back to dense retrieval")
+
+        self.embedding_cache.clear()
+        self.result_cache.clear()
+
+    def reload_if_changed(self) -> bool:
+        """Reopen the index and store if an update bumped the index version, returning whether it did"""
+        mtime_ns = self._metadata_mtime()
+        if mtime_ns == self._metadata_mtime_ns:
+            return False
+        self._metadata_mtime_ns = mtime_ns
+        if load_index_metadata(self.index_path).get("version", 1) == self.index_version:
+            return False
+        self._load_index()
+        print(f"[INFO] [retrieval.py] Reloaded index version {self.index_version}")
+        return True
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Override the index's runtime search knobs, keeping the stored defaults for any left as None"""
+        if nprobe is not None:
+            self.search_overrides["nprobe"] = nprobe
+        if ef_search is not None:
+            self.search_overrides["efSearch"] = ef_search
+        self.search_params.update({k: v for k, v in self.search_overrides.items() if v is not None})
+        set_search_params(self.index, self.search_params)
+        self.result_cache.clear()
+
+    def get_passage(self, passage_id: int) -> str:
+        """Return the text of a passage by its index position"""
+        return self.store.get_passage(passage_id)
+
+    def get_passage_tokens(self, passage_id: int, vocab_size: int) -> Optional[List[int]]:
+        """Return a passage's stored generator token ids, or None if the store has none from a tokenizer with this vocabulary"""
+        if not self.store.has_tokens or self.store.passage_tokenizer.get("vocab_size") != vocab_size:
+            return None
+        return self.store.get_passage_tokens(passage_id).tolist()
+
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries in one batch, reusing cached embeddings for queries seen before"""
+        keys = [normalize_query(query) for query in queries]
+        cached = [self.embedding_cache.get(key) for key in keys]
+
+        missing = list(dict.fromkeys(key for key, embedding in zip(keys, cached) if embedding is None))
+        if missing:
+            with span("query_embedding", queries=len(missing)):
+                encoded = self.model.encode(missing, convert_to_numpy=True)
+            for key, embedding in zip(missing, encoded):
+                self.embedding_cache.put(key, embedding)
+            fresh = dict(zip(missing, encoded))
+            cached = [embedding if embedding is not None else fresh[key] for key, embedding in zip(keys, cached)]
+
+        return np.ascontiguousarray(np.stack(cached), dtype=np.float32)
+
+    def retrieve_batch(self, queries: List[str], top_k: int = 5) -> List[List[dict]]:
+        """Retrieve passages for several queries with one encode and one index search.
+
+        Each result is a dict with the passage "id", its "text" and a "score". In dense mode the score is the
+        cosine similarity recovered from the squared L2 distance between unit-length embeddings; in hybrid mode
+        it is the reciprocal-rank-fusion score, with the "dense_score" and "lexical_score" that fed it. Higher is closer.
+        """
         try:
-            query_embedding = self.model.encode([query], convert_to_numpy=True)
-            distances, indices = self.index.search(query_embedding, top_k)
-            
-            ## Log retrieval metrics
-            print(f"[DEBUG] [retrieval.py] Query: {query}")
-            print(f"[DEBUG] [retrieval.py] Top {top_k} distances: {distances[0]}")
-            
-            results = [self.corpus[idx] for idx in indices[0]]
-            return results
+            self.reload_if_changed()
+
+            keys = [(normalize_query(query), top_k) for query in queries]
+            results = [self.result_cache.get(key) for key in keys]
+
+            missing = list(dict.fromkeys(key for key, result in zip(keys, results) if result is None))
+            if missing:
+                embeddings = self.encode_queries([key[0] for key in missing])
+                depth = max(top_k, self.fusion_depth) if self.bm25 is not None else top_k
+                with span("faiss_search", queries=len(missing), depth=depth):
+                    distances, indices = self.index.search(embeddings, depth)
+                fresh = {}
+                for key, row_distances, row_indices in zip(missing, distances, indices):
+                    dense = {int(idx): float(1 - distance / 2) for distance, idx in zip(row_distances, row_indices) if idx != -1}
+                    if self.bm25 is None:
+                        fresh[key] = [{"id": idx, "text": self.get_passage(idx), "score": score} for idx, score in dense.items()]
+                    else:
+                        fresh[key] = self._fuse(key[0], dense, depth, top_k)
+                    self.result_cache.put(key, fresh[key])
+                results = [result if result is not None else fresh[key] for key, result in zip(keys, results)]
+
+            return [[dict(passage) for passage in result] for result in results]
         except Exception as e:
-            print(f"[ERROR] [retrieval.py] Retrieval failed for query '{query}': {str(e)}")
-            return []
+            print(f"[ERROR] [retrieval.py] Batch retrieval failed for {len(queries)} queries: {str(e)}")
+            return [[] for _ in queries]
+
+    def _fuse(self, query: str, dense: dict, depth: int, top_k: int) -> List[dict]:
+        """Fuse dense and BM25 rankings with reciprocal-rank fusion"""
+        with span("bm25_search", depth=depth):
+            lexical = dict(self.bm25.search(query, depth))
+        fused = reciprocal_rank_fusion([list(dense), list(lexical)], self.rrf_k)[:top_k]
+        return [
+            {
+                "id": idx,
+                "text": self.get_passage(idx),
+                "score": score,
+                "dense_score": dense.get(idx),
+                "lexical_score": lexical.get(idx),
+            }
+            for idx, score in fused
+        ]
+
+    def retrieve(self, query: str, top_k: int = 5) -> List[str]:
+        """Return the text of the top_k passages closest to the query"""
+        return [result["text"] for result in self.retrieve_batch([query], top_k)[0]]
@@ -0,0 +1,239 @@
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from BlueStar.utils.metrics import ResourceSampler
+from BlueStar.utils.tracing import PROMETHEUS_CONTENT_TYPE, tracer
+
+class _Request:
+    def __init__(self, query: str, top_k: int):
+        self.query = query
+        self.top_k = top_k
+        self.enqueued_at = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        ## Set once the client stopped waiting, so the worker skips the request instead of answering nobody
+        self.abandoned = False
+
+class BatchingEngine:
+    """Queues generation requests and answers them in batches on a single worker thread.
+
+    The worker takes the first waiting request, then keeps collecting requests until max_batch_size is
+    reached or max_wait_ms has passed since the first one arrived, and runs them through one batched
+    retrieval and one padded generate call. The model is only ever used from the worker thread.
+    """
+
+    def __init__(self, rag, max_batch_size: int = 8, max_wait_ms: float = 20.0):
+        self.rag = rag
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        self.stats = {"requests": 0, "batches": 0, "rejected": 0, "errors": 0, "abandoned": 0}
+        self._stats_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, query: str, top_k: int = 3, timeout: Optional[float] = None) -> dict:
+        """Answer one query, blocking until its batch has been checked and generated"""
+        request = _Request(query, top_k)
+        self.queue.put(request)
+        if not request.done.wait(timeout):
+            request.abandoned = True
+            raise TimeoutError(f"Request was not answered within {timeout}s")
+        if request.error is not None:
+            raise RuntimeError(request.error)
+        return request.result
+
+    def _drop_abandoned(self, requests: List[_Request]) -> List[_Request]:
+        """Return the requests whose clients are still waiting, counting the rest as abandoned"""
+        waiting = [request for request in requests if not request.abandoned]
+        if len(waiting) < len(requests):
+            with self._stats_lock:
+                self.stats["abandoned"] += len(requests) - len(waiting)
+        return waiting
+
+    def _collect_batch(self) -> Optional[List[_Request]]:
+        first = self.queue.get()
+        while first is not None and not self._drop_abandoned([first]):
+            first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self.queue.put(None)
+                break
+            batch.extend(self._drop_abandoned([request]))
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            ## The whole batch goes through the guardrails in one call; rejected requests are answered right away
+            try:
+                decisions = self.rag.check_topics([request.query for request in batch])
+            except Exception as e:
+                print(f"[ERROR] [server.py] Guardrail check for {len(batch)} requests failed: {str(e)}")
+                with self._stats_lock:
+                    self.stats["errors"] += len(batch)
+                for request in batch:
+                    request.error = str(e)
+                    request.done.set()
+                continue
+            allowed = []
+            for request, decision in zip(batch, decisions):
+                if decision["allowed"]:
+                    allowed.append(request)
+                    continue
+                request.result = {"response": self.rag.guardrails.refusal_message, "sources": [], "rejected": True, "category": decision["category"]}
+                request.done.set()
+            if len(allowed) < len(batch):
+                with self._stats_lock:
+                    self.stats["rejected"] += len(batch) - len(allowed)
+
+            ## Requests asking for different passage counts cannot share a retrieval call
+            groups = {}
+            for request in allowed:
+                groups.setdefault(request.top_k, []).append(request)
+
+            for top_k, requests in groups.items():
+                ## Earlier groups may have taken long enough for these clients to give up
+                requests = self._drop_abandoned(requests)
+                if not requests:
+                    continue
+                started = time.time()
+                try:
+                    ## Requests in a batch share one process, so each gets the batch's resource summary
+                    with ResourceSampler(self.rag.sample_interval_ms) as sampler:
+                        answers, metrics = self.rag.generate_batch([request.query for request in requests], top_k, return_metrics=True)
+                    ## generate_batch reports a failed batch in its metrics rather than raising
+                    if "error" in metrics:
+                        raise RuntimeError(metrics["error"])
+                    for request, (response, context_parts, _) in zip(requests, answers):
+                        request.result = {
+                            "response": response,
+                            "sources": context_parts,
+                            "batch_size": len(requests),
+                            "queue_time": started - request.enqueued_at,
+                            "latency": time.time() - request.enqueued_at,
+                            "resources": sampler.summary,
+                        }
+                except Exception as e:
+                    print(f"[ERROR] [server.py] Batch of {len(requests)} requests failed: {str(e)}")
+                    with self._stats_lock:
+                        self.stats["errors"] += len(requests)
+                    for request in requests:
+                        request.error = str(e)
+                finally:
+                    for request in requests:
+                        request.done.set()
+
+                with self._stats_lock:
+                    self.stats["requests"] += len(requests)
+                    self.stats["batches"] += 1
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["mean_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+    def shutdown(self):
+        self.queue.put(None)
+        self._worker.join()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """JSON endpoints: POST /generate {"query", "top_k"}, GET /health and GET /stats; GET /metrics is Prometheus text"""
+
+    engine: BatchingEngine = None
+    request_timeout: Optional[float] = None
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, status: int, text: str, content_type: str):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif self.path == "/stats":
+            self._send_json(200, self.engine.get_stats())
+        elif self.path == "/metrics":
+            self._send_text(200, tracer.registry.render(), PROMETHEUS_CONTENT_TYPE)
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(payload, dict):
+                raise ValueError("body must be a JSON object")
+            query = str(payload["query"]).strip()
+            top_k = int(payload.get("top_k", 3))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Invalid request: {str(e)}"})
+            return
+        if not query:
+            self._send_json(400, {"error": "Query must not be empty"})
+            return
+
+        try:
+            self._send_json(200, self.engine.submit(query, top_k, self.request_timeout))
+        except TimeoutError as e:
+            self._send_json(504, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def address_string(self) -> str:
+        ## Unix socket peers have no address tuple
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+    def log_message(self, format, *args):
+        print(f"[INFO] [server.py] {self.address_string()} {format % args}")
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def create_server(engine: BatchingEngine, host: str = "127.0.0.1", port: int = 8000,
+                  socket_path: Optional[str] = None, request_timeout: Optional[float] = None):
+    """Create a threaded HTTP server on a TCP port, or on a Unix socket when socket_path is given"""
+    handler = type("BlueStarRequestHandler", (RequestHandler,), {"engine": engine, "request_timeout": request_timeout})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return UnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
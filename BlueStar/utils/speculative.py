@@ -0,0 +1,151 @@
+import time
+import torch
+from typing import List, Optional, Tuple
+from BlueStar.utils.kv_cache import LegacyCache, cache_length, crop_cache, to_legacy_cache, to_model_cache
+
+class SpeculativeDecoder:
+    """Speculative sampling with a small draft model that shares the target's tokenizer.
+
+    Each step the draft proposes num_draft_tokens tokens one at a time, the target scores all of them in a
+    single forward pass, and each proposal is accepted with probability min(1, p/q). The first rejection is
+    replaced by a sample from the normalized residual max(0, p - q), and if every proposal is accepted the
+    target's next distribution supplies a bonus token, so the output follows the target's distribution exactly.
+    Both models keep their key/value caches between steps and crop them back past rejected tokens.
+    """
+
+    def __init__(self, target, draft, num_draft_tokens: int = 4, eos_token_id: Optional[int] = None):
+        if target.config.vocab_size != draft.config.vocab_size:
+            raise ValueError(f"Draft vocabulary ({draft.config.vocab_size}) does not match the target's ({target.config.vocab_size})")
+        self.target = target
+        self.draft = draft
+        self.num_draft_tokens = num_draft_tokens
+        self.eos_token_id = eos_token_id
+
+    @staticmethod
+    def _forward(model, token_ids: List[int], past: Optional[LegacyCache]) -> Tuple[torch.Tensor, LegacyCache]:
+        device = model.device
+        input_ids = torch.tensor([token_ids], dtype=torch.long, device=device)
+        attention_mask = torch.ones((1, cache_length(past) + len(token_ids)), dtype=torch.long, device=device)
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, past_key_values=to_model_cache(past), use_cache=True)
+        return outputs.logits[0].float(), to_legacy_cache(outputs.past_key_values)
+
+    @staticmethod
+    def _probabilities(logits: torch.Tensor, context: List[int], do_sample: bool, temperature: float,
+                       top_p: float, repetition_penalty: float) -> torch.Tensor:
+        """Turn one position's logits into the distribution generate() would sample from"""
+        logits = logits.clone()
+        if repetition_penalty != 1.0 and context:
+            seen = torch.tensor(sorted(set(context)), dtype=torch.long, device=logits.device)
+            scores = logits[seen]
+            logits[seen] = torch.where(scores < 0, scores * repetition_penalty, scores / repetition_penalty)
+
+        if not do_sample:
+            ## Greedy decoding is sampling from a one-hot distribution, which reduces acceptance to an exact match
+            probs = torch.zeros_like(logits)
+            probs[torch.argmax(logits)] = 1.0
+            return probs
+
+        probs = torch.softmax(logits / temperature, dim=-1)
+        if top_p < 1.0:
+            sorted_probs, sorted_ids = torch.sort(probs, descending=True)
+            sorted_probs[torch.cumsum(sorted_probs, dim=-1) - sorted_probs > top_p] = 0.0
+            probs = torch.zeros_like(probs).scatter_(0, sorted_ids, sorted_probs)
+        return probs / probs.sum()
+
+    @torch.no_grad()
+    def generate(self, input_ids: torch.Tensor, past_key_values: Optional[LegacyCache] = None, max_new_tokens: int = 150,
+                 do_sample: bool = True, temperature: float = 0.7, top_p: float = 0.9, repetition_penalty: float = 1.2,
+                 streamer=None, stopping_criteria=None, **kwargs) -> Tuple[torch.Tensor, dict]:
+        """Decode like model.generate for a single sequence, returning (output_ids, metrics).
+
+        past_key_values may hold the target's states for a prefix of input_ids, as produced by the prompt KV cache.
+        """
+        def probabilities(logits, context):
+            return self._probabilities(logits, context, do_sample, temperature, top_p, repetition_penalty)
+
+        sequence = input_ids[0].tolist()
+        prompt_length = len(sequence)
+        if streamer is not None:
+            streamer.put(input_ids[0].cpu())
+
+        ## Invariant between steps: the target cache covers every token but the last, which the next pass feeds
+        target_past = crop_cache(past_key_values, prompt_length - 1)
+        if cache_length(target_past) < prompt_length - 1:
+            _, target_past = self._forward(self.target, sequence[cache_length(target_past):-1], target_past)
+        draft_past = None
+
+        proposed = accepted_total = target_passes = 0
+        target_time = 0.0
+        start = time.perf_counter()
+
+        while len(sequence) - prompt_length < max_new_tokens:
+            ## Leave room for the token the target always contributes
+            gamma = min(self.num_draft_tokens, max_new_tokens - (len(sequence) - prompt_length) - 1)
+
+            draft_tokens, draft_probs = [], []
+            pending = sequence[cache_length(draft_past):]
+            for _ in range(gamma):
+                logits, draft_past = self._forward(self.draft, pending, draft_past)
+                probs = probabilities(logits[-1], sequence + draft_tokens)
+                token = int(torch.multinomial(probs, 1))
+                draft_tokens.append(token)
+                draft_probs.append(probs)
+                pending = [token]
+
+            pass_start = time.perf_counter()
+            logits, target_past = self._forward(self.target, [sequence[-1]] + draft_tokens, target_past)
+            target_time += time.perf_counter() - pass_start
+            target_passes += 1
+
+            accepted, next_token = 0, None
+            for i, token in enumerate(draft_tokens):
+                p = probabilities(logits[i], sequence + draft_tokens[:i])
+                q = draft_probs[i]
+                if torch.rand(1).item() < min(1.0, float(p[token] / q[token])):
+                    accepted += 1
+                    continue
+                residual = torch.clamp(p - q, min=0.0)
+                next_token = int(torch.multinomial(residual / residual.sum() if residual.sum() > 0 else p, 1))
+                break
+            if next_token is None:
+                next_token = int(torch.multinomial(probabilities(logits[len(draft_tokens)], sequence + draft_tokens), 1))
+
+            proposed += len(draft_tokens)
+            accepted_total += accepted
+            target_past = crop_cache(target_past, len(sequence) + accepted)
+            draft_past = crop_cache(draft_past, len(sequence) + accepted)
+
+            new_tokens = draft_tokens[:accepted] + [next_token]
+            finished = False
+            if self.eos_token_id is not None and self.eos_token_id in new_tokens:
+                new_tokens = new_tokens[:new_tokens.index(self.eos_token_id) + 1]
+                finished = True
+            sequence.extend(new_tokens)
+            if streamer is not None:
+                streamer.put(torch.tensor(new_tokens))
+
+            if finished:
+                break
+            if stopping_criteria is not None and bool(torch.as_tensor(stopping_criteria(torch.tensor([sequence]), None)).any()):
+                break
+
+        if streamer is not None:
+            streamer.end()
+
+        elapsed = time.perf_counter() - start
+        new_count = len(sequence) - prompt_length
+        tokens_per_second = new_count / max(elapsed, 1e-9)
+        metrics = {
+            "speculative": True,
+            "new_tokens": new_count,
+            "generation_time": elapsed,
+            "tokens_per_second": tokens_per_second,
+            "draft_tokens": proposed,
+            "accepted_tokens": accepted_total,
+            "acceptance_rate": accepted_total / proposed if proposed else 0.0,
+            "target_passes": target_passes,
+            "tokens_per_target_pass": new_count / max(target_passes, 1),
+            ## Plain decoding costs about one target pass per token; a verification pass is slightly dearer, so this is conservative
+            "estimated_speedup": tokens_per_second * (target_time / max(target_passes, 1)),
+        }
+        return torch.tensor([sequence], dtype=torch.long), metrics
@@ -0,0 +1,283 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+## Upper bounds in seconds of the latency histogram buckets exported for each stage
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+## The trace of the request being handled; threads started for a request run in a copy of its context
+_current_trace = contextvars.ContextVar("bluestar_trace", default=None)
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+class _NoopTrace(_NoopSpan):
+    """Stands in for a trace when tracing is off, so instrumented code never checks whether it is enabled"""
+
+    def span(self, name: str, **attributes) -> _NoopSpan:
+        return NOOP_SPAN
+
+    def record(self, name: str, start: float, end: float, **attributes):
+        pass
+
+    def stage_durations(self) -> dict:
+        return {}
+
+    def finish(self, error: Optional[str] = None):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+NOOP_TRACE = _NoopTrace()
+
+class Span:
+    __slots__ = ("trace", "name", "attributes", "start", "end")
+
+    def __init__(self, trace: "Trace", name: str, attributes: dict, start: float = None, end: float = None):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.start = start
+        self.end = end
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc is not None:
+            self.attributes["error"] = str(exc)
+        self.trace.spans.append(self)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+class Trace:
+    """Timed spans of one request; spans may nest or overlap and are kept in the order they finished"""
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.spans = []
+        self._token = None
+
+    def span(self, name: str, **attributes) -> Span:
+        return Span(self, name, attributes)
+
+    def record(self, name: str, start: float, end: float, **attributes):
+        """Add a span measured elsewhere, from time.perf_counter() readings"""
+        self.spans.append(Span(self, name, attributes, start, end))
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def stage_durations(self) -> dict:
+        """Total seconds spent in each span name"""
+        durations = {}
+        for span in list(self.spans):
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        return durations
+
+    def finish(self, error: Optional[str] = None):
+        if self.end is not None:
+            return
+        self.end = time.perf_counter()
+        if error is not None:
+            self.attributes["error"] = error
+        self.tracer.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "timestamp": self.wall_start,
+            "duration_ms": (self.end - self.start) * 1000,
+            "attributes": self.attributes,
+            "spans": [
+                {"name": span.name, "start_ms": (span.start - self.start) * 1000, "duration_ms": span.duration * 1000, **span.attributes}
+                for span in sorted(self.spans, key=lambda span: span.start)
+            ],
+        }
+
+    def __enter__(self):
+        self._token = _current_trace.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self._token)
+        self.finish(str(exc) if exc is not None else None)
+        return False
+
+class use_trace:
+    """Make a trace current without finishing it on exit, for requests that end on another thread"""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._token = None
+
+    def __enter__(self):
+        if self.trace is not NOOP_TRACE:
+            self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        if self._token is not None:
+            _current_trace.reset(self._token)
+        return False
+
+class MetricsRegistry:
+    """Request counts, generated tokens and per-stage latency histograms from finished traces, in Prometheus text format"""
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.errors = {}
+        self.histograms = {}
+        self.generated_tokens = 0
+        self.decode_seconds = 0.0
+        self.last_tokens_per_second = 0.0
+
+    def _observe(self, metric: str, label: str, value: float):
+        histogram = self.histograms.setdefault((metric, label), {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def observe(self, trace: Trace):
+        with self._lock:
+            self.requests[trace.name] = self.requests.get(trace.name, 0) + 1
+            if "error" in trace.attributes:
+                self.errors[trace.name] = self.errors.get(trace.name, 0) + 1
+            self._observe("request", trace.name, trace.end - trace.start)
+            for span in list(trace.spans):
+                self._observe("stage", span.name, span.duration)
+                if span.name == "decode":
+                    self.generated_tokens += span.attributes.get("new_tokens", 0)
+                    self.decode_seconds += span.duration
+                    self.last_tokens_per_second = span.attributes.get("tokens_per_second", self.last_tokens_per_second)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines += ["# HELP bluestar_requests_total Traced requests by entry point.", "# TYPE bluestar_requests_total counter"]
+            lines += [f'bluestar_requests_total{{name="{name}"}} {count}' for name, count in sorted(self.requests.items())]
+            lines += ["# HELP bluestar_request_errors_total Traced requests that raised.", "# TYPE bluestar_request_errors_total counter"]
+            lines += [f'bluestar_request_errors_total{{name="{name}"}} {count}' for name, count in sorted(self.errors.items())]
+            lines += ["# HELP bluestar_generated_tokens_total Tokens decoded.", "# TYPE bluestar_generated_tokens_total counter",
+                      f"bluestar_generated_tokens_total {self.generated_tokens}"]
+            lines += ["# HELP bluestar_decode_seconds_total Seconds spent decoding.", "# TYPE bluestar_decode_seconds_total counter",
+                      f"bluestar_decode_seconds_total {self.decode_seconds:.6f}"]
+            lines += ["# HELP bluestar_decode_tokens_per_second Decode speed of the last request.", "# TYPE bluestar_decode_tokens_per_second gauge",
+                      f"bluestar_decode_tokens_per_second {self.last_tokens_per_second:.3f}"]
+
+            for metric, label_name, help_text in (("request", "name", "End-to-end request latency."), ("stage", "stage", "Latency of each traced stage.")):
+                name = f"bluestar_{metric}_seconds"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (kind, label), histogram in sorted(self.histograms.items()):
+                    if kind != metric:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, histogram["buckets"]):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+                    ## Values above the last bound only show up in +Inf and _count
+                    lines.append(f'{name}_bucket{{{label_name}="{label}",le="+Inf"}} {histogram["count"]}')
+                    lines.append(f'{name}_sum{{{label_name}="{label}"}} {histogram["sum"]:.6f}')
+                    lines.append(f'{name}_count{{{label_name}="{label}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+class Tracer:
+    """Starts request traces when enabled, and hands finished ones to the metrics registry and the JSONL trace file"""
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_path = None
+        self.registry = MetricsRegistry()
+        self._file = None
+        self._lock = threading.Lock()
+
+    def configure(self, enabled: bool = True, trace_path: Optional[str] = None):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self.enabled = enabled
+            self.trace_path = trace_path
+            if enabled and trace_path:
+                self._file = open(trace_path, 'a', encoding='utf-8')
+
+    def start_trace(self, name: str, **attributes):
+        return Trace(self, name, attributes) if self.enabled else NOOP_TRACE
+
+    def export(self, trace: Trace):
+        self.registry.observe(trace)
+        if self._file is not None:
+            line = json.dumps(trace.to_dict(), default=str)
+            with self._lock:
+                if self._file is not None:
+                    self._file.write(line + "\n")
+                    self._file.flush()
+
+## One tracer per process, configured by the CLI or server at startup
+tracer = Tracer()
+
+def configure_tracing(enabled: bool = True, trace_path: Optional[str] = None):
+    tracer.configure(enabled, trace_path)
+
+def current_trace():
+    trace = _current_trace.get()
+    return trace if trace is not None else NOOP_TRACE
+
+def span(name: str, **attributes):
+    """Time a block as a stage of the current request's trace; a shared no-op when no trace is active"""
+    trace = _current_trace.get()
+    return trace.span(name, **attributes) if trace is not None else NOOP_SPAN
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = tracer.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve GET /metrics in Prometheus text format from a daemon thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
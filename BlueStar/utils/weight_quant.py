@@ -0,0 +1,172 @@
+import torch
+import torch.ao.nn.quantized.dynamic as nnqd
+from tqdm import tqdm
+from transformers.pytorch_utils import Conv1D
+from typing import Dict, List, Optional
+
+## "dynamic" is the original torch quantize_dynamic pass, which only sees nn.Linear (GPT-2's lm_head);
+## "int8" and "int4" also cover the Conv1D attention and MLP projections
+QUANTIZATION_MODES = ("dynamic", "int8", "int4")
+DEFAULT_GROUP_SIZE = 128
+
+## Candidate fractions of each channel's max |w| to clip to; calibration picks the one with the least output error
+CLIP_RATIOS = (1.0, 0.95, 0.9, 0.85, 0.8, 0.75)
+
+def set_submodule(model: torch.nn.Module, name: str, module: torch.nn.Module):
+    parent_name, _, child = name.rpartition(".")
+    setattr(model.get_submodule(parent_name) if parent_name else model, child, module)
+
+def linear_weight(module: torch.nn.Module):
+    """Return (weight, bias) with weight laid out [out_features, in_features]; Conv1D stores it transposed"""
+    if isinstance(module, Conv1D):
+        return module.weight.detach().t().contiguous().float(), module.bias.detach().float() if module.bias is not None else None
+    return module.weight.detach().float(), module.bias.detach().float() if module.bias is not None else None
+
+def quantize_int8_per_channel(weight: torch.Tensor, clip) -> tuple:
+    """Symmetric int8 with one scale per output channel, returning (int8 weight, scales)"""
+    clip = torch.as_tensor(clip, dtype=weight.dtype)
+    max_abs = weight.abs().amax(dim=1) * clip
+    scale = (max_abs / 127).clamp(min=1e-8)
+    return torch.clamp(torch.round(weight / scale[:, None]), -127, 127).to(torch.int8), scale
+
+def dequantize_int8_per_channel(qweight: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+    return qweight.float() * scale[:, None]
+
+def quantize_int4_groupwise(weight: torch.Tensor, group_size: int, clip) -> tuple:
+    """Symmetric int4 in [-8, 7] with one scale per group of group_size input channels, returning (int8 values, scales)"""
+    out_features, in_features = weight.shape
+    grouped = weight.reshape(out_features, in_features // group_size, group_size)
+    clip = torch.as_tensor(clip, dtype=weight.dtype)
+    if clip.dim() == 1:
+        clip = clip[:, None]
+    scale = (grouped.abs().amax(dim=-1) * clip / 7).clamp(min=1e-8)
+    qweight = torch.clamp(torch.round(grouped / scale[..., None]), -8, 7).to(torch.int8)
+    return qweight.reshape(out_features, in_features), scale
+
+def dequantize_int4_groupwise(qweight: torch.Tensor, scale: torch.Tensor) -> torch.Tensor:
+    out_features, in_features = qweight.shape
+    groups = scale.shape[1]
+    return (qweight.float().reshape(out_features, groups, in_features // groups) * scale.float()[..., None]).reshape(out_features, in_features)
+
+def pack_int4(qweight: torch.Tensor) -> torch.Tensor:
+    """Pack pairs of int4 values into one uint8, low nibble first"""
+    unsigned = (qweight.to(torch.int16) + 8).to(torch.uint8)
+    return unsigned[:, 0::2] | (unsigned[:, 1::2] << 4)
+
+def unpack_int4(packed: torch.Tensor) -> torch.Tensor:
+    low = (packed & 0x0F).to(torch.int8) - 8
+    high = (packed >> 4).to(torch.int8) - 8
+    return torch.stack([low, high], dim=-1).reshape(packed.shape[0], packed.shape[1] * 2)
+
+class Int4Linear(torch.nn.Module):
+    """Weight-only int4 linear layer: packed group-wise weights, dequantized to float for each matmul.
+
+    This trades some speed for a quarter of the int8 weight memory, which matters once decoding is bandwidth bound.
+    """
+
+    def __init__(self, in_features: int, out_features: int, group_size: int = DEFAULT_GROUP_SIZE, bias: bool = True):
+        super().__init__()
+        if in_features % group_size or in_features % 2:
+            raise ValueError(f"in_features ({in_features}) must be even and divisible by group_size ({group_size})")
+        self.in_features = in_features
+        self.out_features = out_features
+        self.group_size = group_size
+        self.register_buffer("weight_packed", torch.zeros(out_features, in_features // 2, dtype=torch.uint8))
+        self.register_buffer("weight_scale", torch.zeros(out_features, in_features // group_size, dtype=torch.float16))
+        self.register_buffer("bias", torch.zeros(out_features) if bias else None)
+
+    @classmethod
+    def from_float(cls, weight: torch.Tensor, bias: Optional[torch.Tensor], group_size: int, clip=1.0) -> "Int4Linear":
+        module = cls(weight.shape[1], weight.shape[0], group_size, bias is not None)
+        qweight, scale = quantize_int4_groupwise(weight, group_size, clip)
+        module.weight_packed.copy_(pack_int4(qweight))
+        module.weight_scale.copy_(scale.to(torch.float16))
+        if bias is not None:
+            module.bias.copy_(bias)
+        return module
+
+    def dequantize(self) -> torch.Tensor:
+        return dequantize_int4_groupwise(unpack_int4(self.weight_packed), self.weight_scale)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return torch.nn.functional.linear(x, self.dequantize().to(x.dtype), self.bias)
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}, group_size={self.group_size}"
+
+def int8_dynamic_linear(weight: torch.Tensor, bias: Optional[torch.Tensor], clip=1.0) -> nnqd.Linear:
+    """Dynamic-quant Linear with per-channel int8 weights, run by the fbgemm/qnnpack int8 kernels"""
+    qweight, scale = quantize_int8_per_channel(weight, clip)
+    module = nnqd.Linear(weight.shape[1], weight.shape[0], bias_=bias is not None, dtype=torch.qint8)
+    packed = torch._make_per_channel_quantized_tensor(qweight, scale.double(), torch.zeros(len(scale), dtype=torch.int64), 0)
+    module.set_weight_bias(packed, bias)
+    return module
+
+@torch.no_grad()
+def collect_calibration_inputs(model, tokenizer, texts: List[str], targets: Dict[str, torch.nn.Module],
+                               max_rows: int = 256, max_length: int = 256) -> Dict[str, torch.Tensor]:
+    """Record a random sample of each target layer's input rows while running the model over calibration texts"""
+    rows_per_text = max(1, max_rows // max(len(texts), 1))
+    samples = {name: [] for name in targets}
+
+    def make_hook(name):
+        def hook(module, inputs, output):
+            rows = inputs[0].detach().reshape(-1, inputs[0].shape[-1])
+            samples[name].append(rows[torch.randperm(len(rows))[:rows_per_text]].float())
+        return hook
+
+    handles = [module.register_forward_hook(make_hook(name)) for name, module in targets.items()]
+    try:
+        for text in tqdm(texts, desc="Calibrating"):
+            input_ids = tokenizer(text, return_tensors="pt", truncation=True, max_length=max_length)["input_ids"]
+            if input_ids.shape[1]:
+                model(input_ids=input_ids)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return {name: torch.cat(rows)[:max_rows] for name, rows in samples.items() if rows}
+
+def choose_clip(weight: torch.Tensor, inputs: torch.Tensor, quantize, dequantize) -> torch.Tensor:
+    """Pick each output channel's clip ratio minimizing ||X W^T - X Wq^T||^2 on calibration inputs.
+
+    Output channels are independent in that error, so every channel gets its own best ratio from one pass per ratio.
+    """
+    best_error = torch.full((weight.shape[0],), float("inf"))
+    best_clip = torch.ones(weight.shape[0])
+    for ratio in CLIP_RATIOS:
+        error = ((inputs @ (weight - dequantize(*quantize(weight, ratio))).t()) ** 2).sum(dim=0)
+        better = error < best_error
+        best_error = torch.where(better, error, best_error)
+        best_clip[better] = ratio
+    return best_clip
+
+def quantize_weights(model, mode: str, tokenizer=None, calibration_texts: Optional[List[str]] = None,
+                     group_size: int = DEFAULT_GROUP_SIZE) -> torch.nn.Module:
+    """Quantize every Linear and Conv1D layer of a float model in place (or return the quantize_dynamic copy)"""
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}', expected one of {', '.join(QUANTIZATION_MODES)}")
+    model.eval()
+    if mode == "dynamic":
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    targets = {name: module for name, module in model.named_modules() if isinstance(module, (torch.nn.Linear, Conv1D))}
+    inputs = collect_calibration_inputs(model, tokenizer, calibration_texts, targets) if calibration_texts else {}
+
+    for name, module in tqdm(targets.items(), desc=f"Quantizing ({mode})"):
+        weight, bias = linear_weight(module)
+        if mode == "int8":
+            quantize, dequantize = quantize_int8_per_channel, dequantize_int8_per_channel
+        else:
+            layer_group = group_size if weight.shape[1] % group_size == 0 else weight.shape[1]
+            quantize = lambda w, clip, g=layer_group: quantize_int4_groupwise(w, g, clip)
+            dequantize = dequantize_int4_groupwise
+
+        clip = choose_clip(weight, inputs[name], quantize, dequantize) if name in inputs else 1.0
+        if mode == "int8":
+            set_submodule(model, name, int8_dynamic_linear(weight, bias, clip))
+        else:
+            set_submodule(model, name, Int4Linear.from_float(weight, bias, layer_group, clip))
+        inputs.pop(name, None)
+
+    return model
@@ -32,14 +32,6 @@ if errorlevel 1 (
     exit /b 1
 )
 
-:: Quantize model
-echo Quantizing model...
-python "%ROOT_DIR%\BlueStar\scripts\quantize_model.py"
-if errorlevel 1 (
-    echo Error quantizing model. Please check the error message above.
-    exit /b 1
-)
-
 :: Create corpus and build retrieval index
 echo Creating corpus...
 python "%ROOT_DIR%\BlueStar\scripts\create_corpus.py"
@@ -55,6 +47,21 @@ if errorlevel 1 (
     exit /b 1
 )
 
+:: Quantize model, after the store exists so calibration can sample the corpus
+echo Quantizing model...
+python "%ROOT_DIR%\BlueStar\scripts\quantize_model.py"
+if errorlevel 1 (
+    echo Error quantizing model. Please check the error message above.
+    exit /b 1
+)
+
+echo Exporting ONNX query encoder...
+python "%ROOT_DIR%\BlueStar\scripts\export_encoder.py"
+if errorlevel 1 (
+    echo Error exporting query encoder. Please check the error message above.
+    exit /b 1
+)
+
 :: Run model validation
 echo Validating model...
 python "%ROOT_DIR%\BlueStar\scripts\validate_model.py"
@@ -28,14 +28,6 @@ mkdir -p "${ROOT_DIR}/BlueStar/models"
 echo "Downloading base model..."
 python3 -c "from transformers import AutoModelForCausalLM, AutoTokenizer; AutoModelForCausalLM.from_pretrained('gpt2-large', local_files_only=False); AutoTokenizer.from_pretrained('gpt2-large', local_files_only=False)"
 
-## Quantize model
-echo "Quantizing model..."
-python3 "${ROOT_DIR}/BlueStar/scripts/quantize_model.py"
-if [ $? -ne 0 ]; then
-    echo "Error quantizing model. Please check the error message above."
-    exit 1
-fi
-
 ## Create corpus and build retrieval index
 echo "Creating corpus..."
 python3 "${ROOT_DIR}/BlueStar/scripts/create_corpus.py"
@@ -51,6 +43,21 @@ if [ $? -ne 0 ]; then
     exit 1
 fi
 
+## Quantize model, after the store exists so calibration can sample the corpus
+echo "Quantizing model..."
+python3 "${ROOT_DIR}/BlueStar/scripts/quantize_model.py"
+if [ $? -ne 0 ]; then
+    echo "Error quantizing model. Please check the error message above."
+    exit 1
+fi
+
+echo "Exporting ONNX query encoder..."
+python3 "${ROOT_DIR}/BlueStar/scripts/export_encoder.py"
+if [ $? -ne 0 ]; then
+    echo "Error exporting query encoder. Please check the error message above."
+    exit 1
+fi
+
 ## Run model validation
 echo "Validating model..."
 python3 "${ROOT_DIR}/BlueStar/scripts/validate_model.py"